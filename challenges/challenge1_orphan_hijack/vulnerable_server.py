@@ -10,15 +10,26 @@ Challenge 1: Orphan Response Hijacking - 脆弱なサーバー
 注意: これは教育目的の脆弱なコードです。本番環境では使用しないでください。
 """
 
+import argparse
+import asyncio
 import json
+import multiprocessing
+import os
 import socket
+import sys
 import threading
 import time
+from collections import deque
 from typing import Dict, Any, Optional
 
+# 改行区切りのフレーミングは mcp/transport.py を共有する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "mcp"))
+from transport import FrameTooLarge, MAX_FRAME_SIZE, SocketTransport
+
 # サーバー設定
 HOST = "127.0.0.1"
 PORT = 9999
+BACKLOG = 5  # listen() の待ち行列長（大人数で使うときは --backlog で増やす）
 
 # ユーザーデータベース（各ユーザーの秘密情報）
 USER_SECRETS = {
@@ -27,6 +38,7 @@ USER_SECRETS = {
 }
 
 # 脆弱性1: グローバルな orphan_responses リスト（全ユーザー共有）
+# --workers 指定時は、全ワーカープロセスで共有するリスト（Manager のプロキシ）に置き換わる
 orphan_responses: list = []
 
 
@@ -40,40 +52,125 @@ class VulnerableClientHandler:
         # 脆弱性2: 連番ID（予測可能）
         self._next_id = 1
         self.running = True
+        # 相手の切断（EOF / RST）を読み取り側で検出したら True
+        self.peer_closed = False
+        # 遅延処理用のワーカー（実行中だけ存在する）と、その後ろに並んだメッセージ
+        self._worker: Optional[threading.Thread] = None
+        self._backlog = deque()
+        self._work_lock = threading.Lock()
 
     def handle(self):
-        """クライアント接続を処理"""
+        """
+        クライアント接続を処理
+
+        メッセージはこの受信スレッド上でそのまま処理する。
+        遅延のあるメソッド（get_secret / slow_operation）だけはワーカースレッドに渡し、
+        受信スレッドは読み続けるので、遅延中でも切断（EOF / RST）をすぐに検出できる
+        （送信のたびに接続状態を問い合わせる必要がない）。
+        遅延処理の実行中に届いたメッセージはワーカーの後ろに並べ、受信順に 1 件ずつ処理する。
+        ワーカーは並んだ分を処理し終えたら終了するので、接続あたりのスレッドが
+        2 本になるのは遅延処理の実行中だけ。
+        """
         print(f"[SERVER] クライアント接続: {self.addr}")
-        buffer = ""
-
-        try:
-            while self.running:
-                data = self.conn.recv(4096)
-                if not data:
-                    break
-
-                buffer += data.decode("utf-8")
 
-                # 改行区切りでJSONを処理
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    if line.strip():
-                        self._process_message(line.strip())
+        def on_close(error):
+            if isinstance(error, FrameTooLarge):
+                print(f"[SERVER] メッセージが大きすぎるため切断: {error}")
+                self._on_message(error)
+                return
+            if error is not None:
+                print(f"[SERVER] エラー: {error}")
+            # 以後の送信は失敗する（遅延中の処理のレスポンスは orphan 経路へ）
+            self.peer_closed = True
 
+        try:
+            # 改行区切りでJSONを処理（EOF / RST / 上限超えまで戻らない）
+            SocketTransport(self.conn, "tcp").run(
+                lambda frame: self._on_message(frame.decode("utf-8").strip()), on_close)
         except Exception as e:
             print(f"[SERVER] エラー: {e}")
+            self.peer_closed = True
         finally:
+            with self._work_lock:
+                worker = self._worker
+            if worker is not None:
+                worker.join()
             print(f"[SERVER] クライアント切断: {self.addr}")
             self.conn.close()
 
-    def _process_message(self, message: str):
-        """受信メッセージを処理"""
+    def _on_message(self, item):
+        """
+        受信した 1 件（文字列 / 解析済みの dict / FrameTooLarge）を処理する。
+        ワーカーの実行中はその後ろに並べ、遅延のあるメソッドならワーカーを起動する。
+        """
+        with self._work_lock:
+            if self._worker is None and isinstance(item, str):
+                item = self._parse(item)
+                if item is None:
+                    return
+            if self._worker is None and not self._may_block(item):
+                inline = True
+            else:
+                inline = False
+                self._backlog.append(item)
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._work, daemon=True)
+                    self._worker.start()
+        if inline:
+            self._run_one(item)
+
+    @staticmethod
+    def _may_block(item) -> bool:
+        return (isinstance(item, dict) and item.get("id") is not None
+                and item.get("method") in ("get_secret", "slow_operation"))
+
+    def _work(self):
+        """並んだメッセージを受信順に処理し、なくなったら終了するワーカー"""
+        while True:
+            with self._work_lock:
+                if not self._backlog or not self.running:
+                    self._backlog.clear()
+                    self._worker = None
+                    return
+                item = self._backlog.popleft()
+            self._run_one(item)
+
+    def _run_one(self, item):
+        """1 件処理する。処理を続けられなくなったら受信側も止める"""
         try:
-            data = json.loads(message)
+            if isinstance(item, FrameTooLarge):
+                self._send_error(None, -32600, f"Invalid Request: {item}")
+                self.running = False
+            elif isinstance(item, str):
+                self._process_message(item)
+            else:
+                self._process_data(item)
+        except Exception as e:
+            print(f"[SERVER] エラー: {e}")
+            self.running = False
+        if not self.running:
+            # 受信側を止める（recv から抜けさせる）
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _parse(self, message: str):
+        """JSON を解析する（失敗したら Parse error を返して None）"""
+        try:
+            return json.loads(message)
         except json.JSONDecodeError as e:
             self._send_error(None, -32700, f"Parse error: {e}")
-            return
+            return None
 
+    def _process_message(self, message: str):
+        """受信メッセージを処理"""
+        data = self._parse(message)
+        if data is not None:
+            self._process_data(data)
+
+    def _process_data(self, data):
+        """解析済みのメッセージを処理"""
         # JSON-RPC 2.0 リクエスト
         if "method" in data:
             self._handle_request(data)
@@ -132,6 +229,10 @@ class VulnerableClientHandler:
             print(f"[SERVER] {self.authenticated_user} の get_secret に {delay_ms}ms 遅延")
             time.sleep(delay_ms / 1000.0)
 
+        self._finish_get_secret(req_id)
+
+    def _finish_get_secret(self, req_id: Any):
+        """get_secret の遅延後の処理（レスポンス送信、失敗時は orphan 保存）"""
         secret = USER_SECRETS.get(self.authenticated_user, "NO_SECRET")
         response = {
             "jsonrpc": "2.0",
@@ -155,6 +256,10 @@ class VulnerableClientHandler:
 
         print(f"[SERVER] slow_operation 開始 ({delay_ms}ms)")
         time.sleep(delay_ms / 1000.0)
+        self._finish_slow_operation(req_id, delay_ms)
+
+    def _finish_slow_operation(self, req_id: Any, delay_ms: int):
+        """slow_operation の遅延後の処理（レスポンス送信、失敗時は orphan 保存）"""
         print(f"[SERVER] slow_operation 完了")
 
         response = {
@@ -173,9 +278,11 @@ class VulnerableClientHandler:
     def _handle_get_orphans(self, req_id: Any):
         """orphan リストを返す（脆弱性: 他ユーザーのデータが含まれる可能性）"""
         # 実際のシステムでは絶対にこんなメソッドを公開してはいけない
+        # [:] で一度にコピーする（--workers の共有リストでは list() だと要素ごとにプロセス間通信になる）
+        orphans = orphan_responses[:]
         self._send_result(req_id, {
-            "orphans": orphan_responses.copy(),
-            "count": len(orphan_responses)
+            "orphans": orphans,
+            "count": len(orphans)
         })
 
     def _send_result(self, req_id: Any, result: Any):
@@ -196,43 +303,199 @@ class VulnerableClientHandler:
         }
         self._send_raw(response)
 
-    def _is_connected(self) -> bool:
-        """接続がまだ有効かチェック"""
-        try:
-            # getpeername() は切断されていると例外を発生させる
-            self.conn.getpeername()
-            # さらに確実にするため、ソケットのエラー状態をチェック
-            self.conn.setblocking(False)
-            try:
-                # 0バイトのpeekで接続状態を確認
-                data = self.conn.recv(1, socket.MSG_PEEK)
-                if data == b'':
-                    return False  # 相手が切断
-            except BlockingIOError:
-                pass  # データがないだけ、接続は有効
-            except ConnectionResetError:
-                return False
-            finally:
-                self.conn.setblocking(True)
-            return True
-        except (OSError, socket.error):
-            return False
-
     def _send_raw(self, data: Dict[str, Any]):
         """生データを送信"""
         # 接続チェック（脆弱性: 切断検出後にorphanに保存する経路がある）
-        if not self._is_connected():
+        # 切断は受信スレッドが検出済み。送信自体の失敗（EPIPE 等）も例外として同じ経路に入る
+        if self.peer_closed:
             raise ConnectionError("Client disconnected")
         message = json.dumps(data) + "\n"
         self.conn.sendall(message.encode("utf-8"))
 
 
-def run_server():
+class AsyncVulnerableClientHandler(VulnerableClientHandler):
+    """
+    イベントループ版のクライアントハンドラー（--mode asyncio）。
+
+    接続ごとにスレッドを作らず、1 つのイベントループで多数の接続を扱う。
+    メソッドと脆弱性（orphan の保存・get_orphans）はスレッド版と同じ。
+
+    スレッド版との違い:
+    - get_secret / slow_operation の遅延は asyncio.sleep（ループを止めない）
+      で、接続ごとのタスクとして実行する（その間も同じ接続の他のリクエストに応答する）
+    - 切断は読み取り側の EOF で検出し、以後の送信は失敗 → orphan に保存される
+    - 送信は writer.write でバッファに積むだけなので、1 件処理するたびに drain し、
+      レスポンスを読まないクライアントからはそれ以上読まない（スレッド版の sendall が
+      ブロックするのと同じく、バッファは上限（high watermark）程度で止まる）
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(writer.get_extra_info("socket"), writer.get_extra_info("peername"))
+        self.reader = reader
+        self.writer = writer
+        self._tasks = set()
+
+    async def handle_async(self):
+        """クライアント接続を処理"""
+        print(f"[SERVER] クライアント接続: {self.addr}")
+        try:
+            while self.running:
+                try:
+                    line = await self.reader.readline()
+                except ValueError as e:
+                    # StreamReader の limit（MAX_FRAME_SIZE）を超えた
+                    print(f"[SERVER] メッセージが大きすぎるため切断: {e}")
+                    self._send_error(None, -32600, "Invalid Request: frame too large")
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    self._process_message(line.decode("utf-8").strip())
+                # 相手がレスポンスを読まずにバッファが溜まっていれば、はけるまで次を読まない
+                await self.writer.drain()
+        except Exception as e:
+            print(f"[SERVER] エラー: {e}")
+        finally:
+            print(f"[SERVER] クライアント切断: {self.addr}")
+            self.running = False
+            self.writer.close()
+
+    def _handle_request(self, request: Dict[str, Any]):
+        """遅延のあるメソッドだけタスクにして、残りはスレッド版と同じ処理"""
+        method = request.get("method", "")
+        params = request.get("params", {})
+        req_id = request.get("id")
+
+        if req_id is not None and method == "get_secret":
+            self._spawn(self._handle_get_secret_async(req_id, params))
+        elif req_id is not None and method == "slow_operation":
+            self._spawn(self._handle_slow_operation_async(req_id, params))
+        else:
+            super()._handle_request(request)
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_get_secret_async(self, req_id: Any, params: Dict[str, Any]):
+        if not self.authenticated_user:
+            self._send_error(req_id, -32000, "Not authenticated")
+            return
+
+        # 意図的な遅延（脆弱性: タイミング攻撃を可能にする）
+        delay_ms = params.get("delay_ms", 0)
+        if delay_ms > 0:
+            print(f"[SERVER] {self.authenticated_user} の get_secret に {delay_ms}ms 遅延")
+            await asyncio.sleep(delay_ms / 1000.0)
+
+        self._finish_get_secret(req_id)
+
+    async def _handle_slow_operation_async(self, req_id: Any, params: Dict[str, Any]):
+        delay_ms = params.get("delay_ms", 1000)
+
+        print(f"[SERVER] slow_operation 開始 ({delay_ms}ms)")
+        await asyncio.sleep(delay_ms / 1000.0)
+        self._finish_slow_operation(req_id, delay_ms)
+
+    def _send_raw(self, data: Dict[str, Any]):
+        """生データを送信（切断済みなら失敗させ、呼び出し側で orphan 経路に入る）"""
+        if not self.running or self.writer.is_closing():
+            raise ConnectionError("Client disconnected")
+        message = json.dumps(data) + "\n"
+        self.writer.write(message.encode("utf-8"))
+        # 書き込みバッファは handle_async の drain で上限付きにする（読まないクライアント対策）
+
+
+async def _serve_asyncio(backlog: int, reuse_port: bool = False):
+    async def on_connect(reader, writer):
+        await AsyncVulnerableClientHandler(reader, writer).handle_async()
+
+    server = await asyncio.start_server(
+        on_connect, HOST, PORT, backlog=backlog, reuse_address=True,
+        reuse_port=reuse_port or None, limit=MAX_FRAME_SIZE,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def _serve_threads(backlog: int, reuse_port: bool = False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # 同じポートに複数プロセスが bind し、カーネルが接続を振り分ける
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((HOST, PORT))
+    server.listen(backlog)
+
+    try:
+        while True:
+            conn, addr = server.accept()
+            handler = VulnerableClientHandler(conn, addr)
+            thread = threading.Thread(target=handler.handle)
+            thread.daemon = True
+            thread.start()
+    finally:
+        server.close()
+
+
+def _serve(mode: str, backlog: int, reuse_port: bool = False):
+    if mode == "asyncio":
+        asyncio.run(_serve_asyncio(backlog, reuse_port))
+    else:
+        _serve_threads(backlog, reuse_port)
+
+
+def _worker_main(mode: str, backlog: int, shared_orphans):
+    """ワーカープロセス: 共有 orphan リストを使って、同じポートで待ち受ける"""
+    global orphan_responses
+    orphan_responses = shared_orphans
+    print(f"[SERVER] ワーカー起動 (pid={multiprocessing.current_process().pid})")
+    try:
+        _serve(mode, backlog, reuse_port=True)
+    except KeyboardInterrupt:
+        pass
+
+
+def _serve_workers(mode: str, backlog: int, workers: int):
+    """
+    マルチプロセスモード（--workers N）。
+
+    N 個のワーカープロセスがそれぞれ SO_REUSEPORT で同じポートに bind し、
+    JSON の解析・処理を別々の GIL で並列に行う（プロセス間で共有する状態はない）。
+    例外は orphan_responses だけで、これは Manager プロセスが持つ共有リストにし、
+    どのワーカーで発生した orphan も get_orphans から見えるようにする。
+    """
+    if not sys.platform.startswith("linux") or not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("[SERVER] --workers は Linux（SO_REUSEPORT）でのみ使用できます")
+
+    # Manager のサーバープロセスは SIGINT を無視するので、Ctrl+C 後も後片付けできる
+    manager = multiprocessing.Manager()
+    shared_orphans = manager.list()
+    ctx = multiprocessing.get_context("fork")
+    processes = [
+        ctx.Process(target=_worker_main, args=(mode, backlog, shared_orphans), daemon=True)
+        for _ in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        manager.shutdown()
+
+
+def run_server(mode: str = "thread", backlog: int = BACKLOG, workers: int = 1):
     """サーバーを起動"""
     print("=" * 60)
     print("[SERVER] 脆弱なMCPサーバー起動（Challenge 1: Orphan Hijack）")
     print("=" * 60)
-    print(f"[SERVER] ポート: {PORT}")
+    print(f"[SERVER] ポート: {PORT}（モード: {mode}, backlog: {backlog}, ワーカー: {workers}）")
     print(f"[SERVER] 登録ユーザー: {', '.join(USER_SECRETS.keys())}")
     print()
     print("[SERVER] 脆弱性:")
@@ -243,23 +506,32 @@ def run_server():
     print("[SERVER] 停止するには Ctrl+C を押してください")
     print("=" * 60)
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
-    server.listen(5)
-
     try:
-        while True:
-            conn, addr = server.accept()
-            handler = VulnerableClientHandler(conn, addr)
-            thread = threading.Thread(target=handler.handle)
-            thread.daemon = True
-            thread.start()
+        if workers > 1:
+            _serve_workers(mode, backlog, workers)
+        else:
+            _serve(mode, backlog)
     except KeyboardInterrupt:
         print("\n[SERVER] シャットダウン")
-    finally:
-        server.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Challenge 1 の脆弱なサーバー")
+    parser.add_argument(
+        "--mode", choices=("thread", "asyncio"), default="thread",
+        help="thread: 接続ごとにスレッド（従来） / asyncio: イベントループで多数の接続を処理",
+    )
+    parser.add_argument(
+        "--backlog", type=int, default=BACKLOG,
+        help="listen() の待ち行列長（大人数のワークショップでは 1024 など）",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="ワーカープロセス数（2 以上で SO_REUSEPORT によるマルチプロセス、Linux のみ）",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    run_server()
+    args = parse_args()
+    run_server(mode=args.mode, backlog=args.backlog, workers=args.workers)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+asyncio ネイティブな MCP クライアント実装（async_client.py）
+
+StdioMcpClient / SecureStdioMcpClient との主な違い:
+
+1. readerスレッド → イベントループ上の reader タスク
+2. concurrent.futures.Future → asyncio.Future（呼び出し側スレッドをブロックしない）
+3. subprocess.Popen → asyncio.create_subprocess_exec
+
+1 つのイベントループから多数のサーバープロセスを駆動し、
+asyncio.gather で数千件のリクエストを同時に待てるようにするためのもの。
+ID 生成と orphan の扱いは堅牢版（secure_client.py）の方針に合わせる。
+
+使用例:
+    async with await AsyncStdioMcpClient.start(sys.executable, SERVER_PATH) as client:
+        resp = await client.request("ping", {})
+"""
+
+import os
+import sys
+import asyncio
+import secrets
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from secure_client import DEFAULT_TIMEOUT, ID_BYTES, log_security
+from backpressure import DEFAULT_OVERLOAD_WAIT, OverloadedError
+from transport import STDIO_MAX_FRAME_SIZE
+from codec import get_codec
+
+
+class AsyncStdioMcpClient:
+    """
+    asyncio 版の stdio transport 用 MCP クライアント。
+
+    ポイント:
+    - reader タスクが stdout を読み続け、id -> asyncio.Future の台帳で突き合わせる
+    - タイムアウトしたリクエストは台帳から外す（後着レスポンスは orphan として破棄）
+    - すべての状態はイベントループのスレッドからのみ触るのでロック不要
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process, codec: str = "json",
+                 cancel_on_timeout: bool = False, tracer=None, max_in_flight: int = None,
+                 overload_wait: float = DEFAULT_OVERLOAD_WAIT):
+        # 直接呼ばずに start() を使う（プロセス起動が非同期のため）
+        # tracer（session_trace.TraceWriter）を渡すと、送受信した行をすべて記録する
+        self.tracer = tracer
+        self.process = process
+        self._codec = get_codec(codec)
+        # True のとき、タイムアウトしたリクエストについて notifications/cancelled を送る
+        self.cancel_on_timeout = cancel_on_timeout
+
+        self._pending = {}  # id -> asyncio.Future
+
+        # max_in_flight を指定すると、応答待ちをその件数までに抑える
+        # 空きがなければ overload_wait 秒まで await で待ち、それでも空かなければ
+        # OverloadedError（overload_wait=0 なら待たずにすぐ断る）
+        # 送信も同じ overload_wait で打ち切る。サーバーが読まずにパイプの書き込みバッファが
+        # 上限（high watermark）を超えていれば、空くまで待ち、空かなければ書かずに OverloadedError
+        # （書き込みバッファが QueuedWriter の送信キューにあたる）
+        self.max_in_flight = max_in_flight
+        self.overload_wait = overload_wait
+        self._slots = asyncio.Semaphore(max_in_flight) if max_in_flight is not None else None
+        self._slots_lock = asyncio.Lock()  # バッチの枠を途中まで確保したまま他と取り合わない
+        self._in_use = 0
+
+        self.stats = {
+            "requests_sent": 0,
+            "responses_received": 0,
+            "orphans_discarded": 0,
+            "timeouts": 0,
+            "cancels_sent": 0,
+            "overloaded": 0,
+        }
+
+        self.notifications = []
+
+        self._reader = asyncio.get_running_loop().create_task(self._reader_loop())
+
+    @classmethod
+    async def start(cls, python_exe: str, server_script: str, server_args: list = None,
+                    codec: str = "json", cancel_on_timeout: bool = False, tracer=None,
+                    max_in_flight: int = None, overload_wait: float = DEFAULT_OVERLOAD_WAIT,
+                    max_frame: int = STDIO_MAX_FRAME_SIZE):
+        """
+        サーバーを子プロセスとして起動し、クライアントを返す。
+        max_frame は 1 行の上限（StreamReader の limit。デフォルトの 64 KiB では大きなバッチが読めない）。
+        """
+        process = await asyncio.create_subprocess_exec(
+            python_exe, server_script, *(server_args or []),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=max_frame,
+        )
+        return cls(process, codec=codec, cancel_on_timeout=cancel_on_timeout, tracer=tracer,
+                   max_in_flight=max_in_flight, overload_wait=overload_wait)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """サーバー停止と後始末"""
+        self._reader.cancel()
+        try:
+            if self.process.returncode is None:
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), timeout=3)
+        except Exception:
+            pass
+
+        # 応答を待っている呼び出し側を置き去りにしない
+        self._fail_pending(ConnectionError("client closed"))
+
+    def _fail_pending(self, error: Exception):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(error)
+        self._pending.clear()
+
+    async def _send(self, msg):
+        data = self._codec.dumps(msg) + b"\n"
+        stdin = self.process.stdin
+        await self._wait_writable(stdin)
+        if self.tracer is not None:
+            self.tracer.record("send", data)
+        stdin.write(data)
+        if not self._congested(stdin):
+            # 詰まっていなければ即座に戻る（相手が終了していればここで例外になる）
+            # 詰まったら待たずに戻り、次の送信が _wait_writable で待つ
+            await stdin.drain()
+
+    @staticmethod
+    def _congested(stdin) -> bool:
+        transport = stdin.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    async def _wait_writable(self, stdin):
+        """書き込みバッファが上限を超えていれば、overload_wait 秒まで空くのを待つ"""
+        if not self._congested(stdin):
+            return
+        if self.overload_wait is None:
+            await stdin.drain()
+            return
+        try:
+            if self.overload_wait <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(stdin.drain(), timeout=self.overload_wait)
+        except asyncio.TimeoutError:
+            self.stats["overloaded"] += 1
+            raise OverloadedError(f"server is not reading: {stdin.transport.get_write_buffer_size()} "
+                                  f"bytes unsent after {self.overload_wait}s") from None
+
+    def _issue_id(self) -> str:
+        return secrets.token_hex(ID_BYTES)
+
+    async def _acquire(self, n: int):
+        """応答待ちの枠を n 件分確保する（overload_wait 秒以内に空かなければ OverloadedError）"""
+        if self._slots is None:
+            return
+        full = self._in_use + n > self.max_in_flight
+        if n > self.max_in_flight or (full and self.overload_wait <= 0):
+            self.stats["overloaded"] += 1
+            raise OverloadedError(f"{self._in_use} requests in flight (max_in_flight={self.max_in_flight})")
+        if not full:
+            # 空いていれば待たずに確保できる
+            await self._take(n)
+            return
+        try:
+            await asyncio.wait_for(self._take(n), timeout=self.overload_wait)
+        except asyncio.TimeoutError:
+            self.stats["overloaded"] += 1
+            raise OverloadedError(f"no free slot within {self.overload_wait}s "
+                                  f"(max_in_flight={self.max_in_flight})") from None
+
+    async def _take(self, n: int):
+        taken = 0
+        try:
+            async with self._slots_lock:
+                for _ in range(n):
+                    await self._slots.acquire()
+                    self._in_use += 1
+                    taken += 1
+        except asyncio.CancelledError:
+            # 期限切れで打ち切られたら、途中まで取れた分を返す
+            for _ in range(taken):
+                self._release()
+            raise
+
+    def _release(self):
+        self._in_use -= 1
+        self._slots.release()
+
+    def _new_future(self) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        if self._slots is not None:
+            # 完了したら（レスポンス・タイムアウトによるキャンセル・close）枠を返す
+            fut.add_done_callback(lambda _: self._release())
+        return fut
+
+    def _dispatch(self, data: dict):
+        if not isinstance(data, dict):
+            log_security("WARN", f"不正な形式のメッセージを破棄: {str(data)[:100]}")
+            return
+
+        resp_id = data.get("id")
+        if resp_id is None:
+            self.notifications.append(data)
+            return
+
+        # 突き合わせたら台帳から外す（send_request / send_batch だけで使った場合も残さない。
+        # 同じ id のレスポンスが再び届いたら orphan として扱う）
+        fut = self._pending.pop(resp_id, None)
+        if fut is None:
+            self.stats["orphans_discarded"] += 1
+            log_security("WARN", f"Orphan response を破棄: id={resp_id}")
+            return
+
+        self.stats["responses_received"] += 1
+        if not fut.done():
+            fut.set_result(data)
+
+    async def _reader_loop(self):
+        try:
+            while True:
+                try:
+                    line = await self.process.stdout.readline()
+                except ValueError as e:
+                    # 1 行が limit（max_frame）を超えた。その行は捨てて読み続ける
+                    log_security("WARN", f"大きすぎるメッセージを破棄: {e}")
+                    continue
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                if self.tracer is not None:
+                    self.tracer.record("recv", line)
+
+                try:
+                    data = self._codec.loads(line)
+                except ValueError:
+                    # JSONDecodeError / UnicodeDecodeError
+                    log_security("WARN", f"JSON以外を受信（stdout汚染の疑い）: {line[:100]!r}")
+                    continue
+
+                if isinstance(data, list):
+                    for item in data:
+                        self._dispatch(item)
+                else:
+                    self._dispatch(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_security("FATAL", f"readerタスクがクラッシュ: {e}")
+        # 受信が終わった（サーバー終了・クラッシュ）。応答待ちはタイムアウトを待たずに失敗させる
+        self._fail_pending(ConnectionError("server closed"))
+
+    async def send_request(self, method: str, params: dict) -> tuple[str, asyncio.Future]:
+        """request（idあり）を投げ、asyncio.Future を返す（待機は呼び出し側）"""
+        await self._acquire(1)
+        request_id = self._issue_id()
+        fut = self._new_future()
+        self._pending[request_id] = fut
+
+        msg = {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": method,
+            "params": params
+        }
+        await self._send_registered([(request_id, fut)], msg)
+        self.stats["requests_sent"] += 1
+        return request_id, fut
+
+    async def request(self, method: str, params: dict, timeout: float = None) -> dict:
+        """
+        レスポンスを待って dict を返す。
+        タイムアウトしたら asyncio.TimeoutError を投げる。
+        """
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+
+        request_id, fut = await self.send_request(method, params)
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            if self.cancel_on_timeout:
+                await self.cancel(request_id)
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def send_batch(self, calls: list) -> list:
+        """
+        複数の request を JSON-RPC バッチ（1 行の配列）として投げる。
+
+        calls: [(method, params), ...]
+        戻り値: [(request_id, asyncio.Future), ...]（calls と同じ順序）
+        """
+        await self._acquire(len(calls))
+        entries = [(self._issue_id(), self._new_future()) for _ in calls]
+        for request_id, fut in entries:
+            self._pending[request_id] = fut
+
+        batch = [
+            {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": method,
+                "params": params
+            }
+            for (request_id, _), (method, params) in zip(entries, calls)
+        ]
+        await self._send_registered(entries, batch)
+        self.stats["requests_sent"] += len(entries)
+        return entries
+
+    async def _send_registered(self, entries: list, msg):
+        """台帳に登録済みのリクエストを送る。送れなければ台帳から外して例外を投げ直す"""
+        try:
+            await self._send(msg)
+        except BaseException:
+            for request_id, fut in entries:
+                self._pending.pop(request_id, None)
+                fut.cancel()
+            raise
+
+    async def request_many(self, calls: list, timeout: float = None) -> list:
+        """バッチで投げて、全レスポンスを calls と同じ順序のリストで返す"""
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+
+        entries = await self.send_batch(calls)
+        futs = [fut for _, fut in entries]
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futs), timeout=timeout)
+        except asyncio.TimeoutError:
+            expired = [request_id for request_id, fut in entries if not fut.done() or fut.cancelled()]
+            self.stats["timeouts"] += len(expired)
+            if self.cancel_on_timeout:
+                for request_id in expired:
+                    await self.cancel(request_id)
+            raise
+        finally:
+            for request_id, _ in entries:
+                self._pending.pop(request_id, None)
+
+    async def notify(self, method: str, params: dict):
+        msg = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params
+        }
+        await self._send(msg)
+
+    async def cancel(self, request_id: str, reason: str = "timeout"):
+        """notifications/cancelled を送り、サーバーに処理の打ち切りを求める"""
+        try:
+            await self.notify("notifications/cancelled", {"requestId": request_id, "reason": reason})
+        except (ConnectionError, RuntimeError) as e:
+            log_security("WARN", f"キャンセル通知の送信に失敗: id={request_id} ({e!r})")
+            return
+        self.stats["cancels_sent"] += 1
+
+    def get_stats(self) -> dict:
+        """統計情報を取得（監視・デバッグ用）"""
+        return dict(self.stats)
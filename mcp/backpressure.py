@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+送信側のバックプレッシャー（backpressure.py）
+
+send_request はこれまで上限なしに子プロセスの stdin へ書き込んでいた。
+サーバーが読むのをやめると、パイプのバッファが埋まった時点で
+呼び出し側のスレッドが write の中で止まり、pending 台帳も際限なく増える。
+
+- InFlightLimiter: 応答待ちのリクエスト数の上限（ウィンドウ）
+- QueuedWriter:    上限付きの送信キューと、書き込み専用のスレッド
+
+どちらも「空きを待つ」か「すぐに OverloadedError で断る」かを
+待ち時間（timeout）で選ぶ。timeout=0 なら待たずに断り、None なら空くまで待つ。
+"""
+
+import time
+import threading
+
+DEFAULT_OVERLOAD_WAIT = 5.0  # 空きを待つ時間のデフォルト（秒）
+
+
+class OverloadedError(RuntimeError):
+    """送信ウィンドウ・送信キューに空きがなく、待てる時間内に送れなかった"""
+
+
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class InFlightLimiter:
+    """
+    応答待ちのリクエスト数を limit 件までに抑えるカウンター。
+    バッチは n 件まとめて確保する（途中まで確保した状態で待たない）。
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError("max_in_flight must be >= 1")
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._used = 0
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    def acquire(self, n: int = 1, timeout: float = None):
+        """n 件分の枠を確保する（timeout 秒以内に空かなければ OverloadedError）"""
+        if n > self.limit:
+            raise OverloadedError(f"{n} requests exceed max_in_flight={self.limit}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._used + n > self.limit:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    raise OverloadedError(f"{self._used} requests in flight (max_in_flight={self.limit})")
+                self._cond.wait(remaining)
+            self._used += n
+
+    def release(self, n: int = 1):
+        with self._cond:
+            self._used -= n
+            self._cond.notify_all()
+
+
+class QueuedWriter:
+    """
+    上限付きの送信キュー。書き込みは専用のスレッドが行う。
+
+    呼び出し側は write() でキューに積むだけなので、サーバーが読まなくなっても
+    パイプの write の中で止まらない（キューが一杯なら待つか断る）。
+    書き込みスレッドはキューに溜まっているメッセージをまとめて 1 回で書き出すので、
+    CoalescingWriter と同じく write syscall もまとまる。
+    CoalescingWriter と同じく stream は write() / flush() を持つもの（Transport など）。
+    """
+
+    def __init__(self, stream, max_queued: int):
+        if max_queued < 1:
+            raise ValueError("max_queued must be >= 1")
+        self.stream = stream
+        self.max_queued = max_queued
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._unsent = 0       # キューにある数 + 書き込み中の数
+        self._closed = False
+        self._error = None     # 書き込みスレッドで発生したエラー
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self) -> int:
+        """まだ書き終わっていないメッセージ数"""
+        return self._unsent
+
+    def write(self, data, timeout: float = None):
+        """1 メッセージをキューに積む（timeout 秒以内に空かなければ OverloadedError）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    raise self._error
+                if self._closed:
+                    raise ValueError("write to closed QueuedWriter")
+                if self._unsent < self.max_queued:
+                    break
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    raise OverloadedError(f"send queue is full ({self.max_queued} messages)")
+                self._cond.wait(remaining)
+
+            self._queue.append(data)
+            self._unsent += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """キューが空になるまで待つ（書き終わったら True）"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._unsent == 0 or self._error is not None, timeout=timeout
+            ) and self._error is None
+
+    def close(self, timeout: float = 1.0):
+        """
+        残りを書き出して書き込みスレッドを止める（ストリーム自体は閉じない）。
+        相手が読まずに書き込みが詰まっている場合は timeout で諦める
+        （呼び出し側がストリームを閉じれば、書き込みスレッドもエラーで抜ける）。
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch, self._queue = self._queue, []
+
+            try:
+                self.stream.write(batch[0][:0].join(batch))
+                self.stream.flush()
+            except (OSError, ValueError) as e:
+                # 相手プロセスが終了した等。次の write() で呼び出し側に伝える
+                with self._cond:
+                    self._error = e
+                    self._queue = []
+                    self._unsent = 0
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._unsent -= len(batch)
+                self._cond.notify_all()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+上限付きの観測用ストア（bounded_store.py）
+
+脆弱な実装（StdioMcpClient）は orphan response と通知を「観測のために」保存するが、
+素朴なリストだと短いタイムアウトで長時間回すと際限なく増え続ける（メモリリーク）。
+
+BoundedStore はリストのように読める（len / [-1] / for / bool）リングバッファで、
+次の 3 つの上限を超えた古いエントリから捨てる。
+- max_items: 保持件数
+- ttl:       保持時間（秒）
+- max_bytes: 保持する JSON の合計バイト数
+
+1 件で max_bytes を超えるエントリは保存しない（入れると他のエントリを全部押し出し、
+自分も残らない）。これも捨てた件数（rejected）として数える。
+
+捨てた件数は stats() で確認できる（「観測できなかった orphan」の量が分かる）。
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+DEFAULT_STORE_ITEMS = 1000
+DEFAULT_STORE_TTL = 300.0          # 5 分
+DEFAULT_STORE_BYTES = 1024 * 1024  # 1 MiB
+
+
+class BoundedStore:
+    """
+    件数・時間・バイト数で上限を持つリングバッファ。
+
+    reader スレッドが append() し、シナリオ側（別スレッド）が読む前提でロックする。
+    """
+
+    def __init__(self, max_items: int = DEFAULT_STORE_ITEMS, ttl: float = DEFAULT_STORE_TTL,
+                 max_bytes: int = DEFAULT_STORE_BYTES):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = deque()  # (追加時刻, バイト数, item)
+        self._bytes = 0
+
+        self.added = 0
+        self.evicted_ttl = 0       # 保持時間切れで捨てた件数
+        self.evicted_overflow = 0  # 件数・バイト数の上限で捨てた件数
+        self.rejected = 0          # 1 件で max_bytes を超えたため保存しなかった件数
+
+    def append(self, item, size: int = None):
+        """
+        item を追加する。size には受信した行のバイト数など、呼び出し側が既に知っている大きさを渡す
+        （省略時だけ JSON にシリアライズして測る）。
+        """
+        if size is None:
+            size = len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
+
+        now = time.monotonic()
+        with self._lock:
+            if size > self.max_bytes:
+                # 保存しても自分ごと押し出されるだけなので、既存のエントリを残す
+                self.rejected += 1
+                return
+            self._entries.append((now, size, item))
+            self._bytes += size
+            self.added += 1
+            self._expire_locked(now)
+            while self._entries and (
+                len(self._entries) > self.max_items or self._bytes > self.max_bytes
+            ):
+                self._pop_oldest_locked()
+                self.evicted_overflow += 1
+
+    def _pop_oldest_locked(self):
+        _, size, _ = self._entries.popleft()
+        self._bytes -= size
+
+    def _expire_locked(self, now: float):
+        if self.ttl is None:
+            return
+        limit = now - self.ttl
+        while self._entries and self._entries[0][0] < limit:
+            self._pop_oldest_locked()
+            self.evicted_ttl += 1
+
+    def _snapshot(self) -> list:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            return [item for _, _, item in self._entries]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._snapshot())
+
+    def __getitem__(self, index):
+        # 1 件だけ取り出す（全体をコピーしない）。スライスはリストで返す
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            if isinstance(index, slice):
+                return [item for _, _, item in list(self._entries)[index]]
+            return self._entries[index][2]
+
+    def __repr__(self) -> str:
+        return f"BoundedStore({self._snapshot()!r})"
+
+    def find(self, item_id):
+        """id が一致する最新のエントリを返す（なければ None）"""
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            for _, _, item in reversed(self._entries):
+                if isinstance(item, dict) and item.get("id") == item_id:
+                    return item
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            return {
+                "stored": len(self._entries),
+                "bytes": self._bytes,
+                "added": self.added,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_overflow": self.evicted_overflow,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+書き込みコアレッシング（coalescing_writer.py）
+
+stdio transport では 1 メッセージごとに write + flush すると、
+小さなレスポンスが大量に出るときに「1 メッセージ = 1 write syscall」になる。
+CoalescingWriter は短い時間窓のあいだに溜まったメッセージを
+1 回の write + flush にまとめて書き出す。
+
+flush のタイミング:
+- max_latency 経過（最初の未送信メッセージからの最大遅延）
+- バッファが max_bytes 以上になったとき
+- flush() / close() を明示的に呼んだとき
+  （後続のメッセージがないと分かっている呼び出し側は flush() を呼ぶ。
+  demo_server は受信済み・処理中のリクエストがなくなった時点で呼ぶので、
+  1 件ずつ往復する場合に毎回 max_latency ぶん待たされることはない）
+
+max_latency=0（デフォルト）のときはコアレッシングせず、
+従来どおり write のたびに即座に flush する。
+スループットとテールレイテンシのトレードオフは max_latency で調整する。
+"""
+
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 64 * 1024  # これ以上溜まったら時間窓を待たずに flush
+
+
+class CoalescingWriter:
+    """
+    ストリーム（sys.stdout や子プロセスの stdin）への書き込みをまとめるラッパー。
+
+    複数スレッドから write() してよい（1 メッセージが途中で混ざることはない）。
+    テキストストリームには str、バイナリストリームには bytes を渡す。
+    """
+
+    def __init__(self, stream, max_latency: float = 0.0, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.stream = stream
+        self.max_latency = max_latency
+        self.max_bytes = max_bytes
+
+        self._cond = threading.Condition()
+        self._buffer = []      # 未送信のメッセージ
+        self._buffered = 0     # 未送信のバイト数（文字数）
+        self._scheduled = False
+        self._closed = False
+        self._error = None     # flusher スレッドで発生した書き込みエラー
+
+        self._flusher = None
+        if max_latency > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def write(self, data):
+        """1 メッセージを書き込む（必要に応じて即 flush）"""
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise ValueError("write to closed CoalescingWriter")
+
+            self._buffer.append(data)
+            self._buffered += len(data)
+
+            if self._flusher is None or self._buffered >= self.max_bytes:
+                self._flush_locked()
+            elif not self._scheduled:
+                # 時間窓を開始（flusher スレッドを起こす）
+                self._scheduled = True
+                self._cond.notify()
+
+    def flush(self):
+        """溜まっているメッセージをすべて書き出す"""
+        with self._cond:
+            self._flush_locked()
+
+    def close(self):
+        """残りを書き出して flusher スレッドを止める（ストリーム自体は閉じない）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._flush_locked()
+            finally:
+                self._cond.notify()
+
+    def _flush_locked(self):
+        self._scheduled = False
+        if not self._buffer:
+            return
+
+        chunk = self._buffer[0][:0].join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        self.stream.write(chunk)
+        self.stream.flush()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._scheduled and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+
+            # 時間窓のあいだに後続のメッセージを溜める
+            time.sleep(self.max_latency)
+
+            with self._cond:
+                try:
+                    self._flush_locked()
+                except (OSError, ValueError) as e:
+                    # 相手プロセスが終了した等。次の write() で呼び出し側に伝える
+                    self._error = e
+                    return
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+JSON コーデック（codec.py）
+
+get_codec() で JSON のエンコード/デコードを差し替え可能にする。
+- "json"  : 標準ライブラリ（デフォルト、追加依存なし）
+- "orjson": orjson がインストールされていれば使える高速版
+- "auto"  : orjson があれば orjson、なければ json
+
+改行区切りのフレーミングは transport.py（LineFramer）が受け持つ。
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # 任意依存（標準ライブラリのみでも動作する）
+    orjson = None
+
+
+class JsonCodec:
+    """標準ライブラリ json によるコーデック"""
+
+    name = "json"
+
+    def __init__(self):
+        self._decode = json.JSONDecoder().decode
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(self, data):
+        # json.loads は memoryview を受け付けず、bytes だと文字コード判定も走るため、
+        # バッファから直接 UTF-8 として str に変換してデコーダに渡す
+        return self._decode(str(data, "utf-8"))
+
+
+class OrjsonCodec:
+    """orjson によるコーデック（memoryview をそのままデコードできる）"""
+
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        # orjson.JSONDecodeError は json.JSONDecodeError のサブクラス
+        return orjson.loads(data)
+
+
+def get_codec(name: str = "json"):
+    """名前からコーデックを取得する"""
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+
+    if name == "json":
+        return JsonCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("orjson がインストールされていません（pip install orjson）")
+        return OrjsonCodec()
+    raise ValueError(f"Unknown codec: {name}")
@@ -1,19 +1,133 @@
 #!/usr/bin/env python3
+import os
 import sys
 import json
+import stat
 import time
+import signal
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from coalescing_writer import CoalescingWriter, DEFAULT_MAX_BYTES
+from metrics import ShardedCounters, LatencyHistogram
+from metrics_exporter import MetricFamily, MetricsServer, histogram_family
+from fault_injection import FaultInjector, load_config
+from transport import StreamTransport, SocketTransport
 
 # ============================================================
-# stdioユーティリティ
+# 接続と出力
 # ============================================================
 
-def send_message(obj: dict):
+# --faults が指定されると FaultInjector が入り、レスポンスに障害を注入する
+_faults = None
+
+LISTEN_BACKLOG = 128  # --listen の listen() の待ち行列長
+
+# 接続の開始・終了数（--listen 時の同時接続数 = opened - closed）
+_connection_counts = ShardedCounters(("opened", "closed"))
+
+
+class Connection:
+    """
+    クライアントとの 1 本の接続。
+
+    出力（CoalescingWriter）と、tools/call の id の名前空間（in_flight）を接続ごとに持つ。
+    stdio では 1 つだけ、--listen では accept した接続ごとに作るので、
+    別々のクライアントが同じ id を使ってもキャンセルやレスポンスが混ざらない。
+    並行モードでも 1 行の JSON が途中で混ざらないよう writer 内でロックされる。
+
+    --flush-latency-ms の時間窓は、続けて届いたリクエストのレスポンスをまとめるためのもの。
+    受信側が追いつき（受信済みのメッセージがない）、処理中のメッセージもなくなったら、
+    それ以上まとめる相手はいないので時間窓を待たずに flush する
+    （1 件ずつ往復するクライアントが毎回時間窓ぶん待たされない）。
+    """
+
+    def __init__(self, transport, max_latency: float = 0.0, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.transport = transport
+        self.output = CoalescingWriter(transport, max_latency=max_latency, max_bytes=max_bytes)
+        # 実行中（または実行待ち）の tools/call の id -> キャンセル用 Event
+        self.in_flight = {}
+
+        self._idle_lock = threading.Lock()
+        self._unfinished = 0     # 受信して、まだ処理（レスポンスの書き込み）が終わっていない数
+        self._caught_up = True   # 受信済みのフレームをすべて処理系へ渡し終えている
+
+    def write_line(self, line: str):
+        self.output.write(line)
+
+    def received(self):
+        """受信したメッセージを処理系へ渡す前に呼ぶ"""
+        with self._idle_lock:
+            self._unfinished += 1
+            self._caught_up = False
+
+    def finished(self):
+        """1 件の処理が終わったら呼ぶ（受信側が追いついていれば flush）"""
+        with self._idle_lock:
+            self._unfinished -= 1
+            idle = self._caught_up and self._unfinished == 0
+        if idle:
+            self._flush()
+
+    def caught_up(self):
+        """受信ループが、受信済みのフレームをすべて処理系へ渡したら呼ぶ"""
+        with self._idle_lock:
+            self._caught_up = True
+            idle = self._unfinished == 0
+        if idle:
+            self._flush()
+
+    def _flush(self):
+        try:
+            self.output.flush()
+        except (OSError, ValueError) as e:
+            log(f"レスポンスを送信できません: {e!r}")
+
+    def close(self):
+        try:
+            self.output.close()
+        except (OSError, ValueError):
+            pass
+        self.transport.close()
+
+
+class StaticResponse(dict):
+    """
+    id 以外が毎回同じレスポンス（initialize / tools/list など）。
+
+    result 部分は起動時に 1 回だけ JSON 化しておき（result_json）、
+    送信時には id だけを埋め込んで文字列を組み立てる。
+    dict としても普通に読めるので、handle_request の戻り値の扱いは変わらない。
+    """
+
+    __slots__ = ("result_json",)
+
+    def __init__(self, req_id, result, result_json: str):
+        super().__init__(jsonrpc="2.0", id=req_id, result=result)
+        self.result_json = result_json
+
+    def encode(self) -> str:
+        # json.dumps(self) と同じ文字列になる
+        return '{"jsonrpc": "2.0", "id": ' + json.dumps(self["id"]) + ', "result": ' + self.result_json + "}"
+
+
+def encode_message(obj) -> str:
+    """メッセージ（dict / バッチの list）を JSON 文字列にする"""
+    if isinstance(obj, StaticResponse):
+        return obj.encode()
+    if isinstance(obj, list):
+        return "[" + ", ".join(encode_message(item) for item in obj) + "]"
+    return json.dumps(obj)
+
+
+def send_message(obj: dict, conn: Connection):
     """
-    stdout に JSON メッセージを 1 行で送信する。
+    接続に JSON メッセージを 1 行で送信する。
     stdio transport の仕様上、stdout には JSON 以外を出してはいけない。
     """
-    sys.stdout.write(json.dumps(obj) + "\n")
-    sys.stdout.flush()
+    conn.output.write(encode_message(obj) + "\n")
 
 
 def log(msg: str):
@@ -24,10 +138,150 @@ def log(msg: str):
     print(msg, file=sys.stderr, flush=True)
 
 
+# ============================================================
+# メソッド・ツール登録（レジストリ）
+# ============================================================
+
+# JSON-RPC メソッド名 -> ハンドラー（msg を受け取り、レスポンスまたは None を返す）
+METHODS = {}
+
+# ツール名 -> ツール関数（arguments を受け取り、result を返す）
+TOOLS = {}
+
+# ツール名 -> tools/list に載せるメタデータ（登録順）
+TOOL_SPECS = {}
+
+# static=True で登録したメソッドの result を返す関数
+_STATIC_METHODS = {}
+
+# メソッド名 -> (result, JSON 化した result)。ツール登録時に破棄して作り直す
+_static_cache = {}
+
+# ツールごとの呼び出し回数・エラー回数・実行時間（--metrics-port で公開）
+_tool_counters = {}
+_tool_durations = {}
+
+
+def method(name: str, static: bool = False):
+    """
+    JSON-RPC メソッドを登録するデコレーター。
+
+    @method("ping")
+    def handle_ping(msg): ...
+
+    static=True の場合、関数は引数なしで result を返す。
+    result は最初の呼び出しで 1 回だけ JSON 化され、以後は id だけ埋め込んで返す。
+    """
+    def register(func):
+        if static:
+            _STATIC_METHODS[name] = func
+            _static_cache.pop(name, None)
+            METHODS[name] = lambda msg: static_response(name, msg.get("id"))
+        else:
+            METHODS[name] = func
+        return func
+    return register
+
+
+def tool(name: str, description: str, input_schema: dict):
+    """
+    ツールを登録するデコレーター（tools/list と tools/call の両方に反映される）。
+
+    @tool("add_numbers", "2つの数値を足し算する", {...})
+    def tool_add_numbers(args): ...
+    """
+    def register(func):
+        TOOLS[name] = func
+        TOOL_SPECS[name] = {
+            "name": name,
+            "description": description,
+            "inputSchema": input_schema,
+        }
+        _tool_counters.setdefault(name, ShardedCounters(("calls", "errors", "cancelled")))
+        _tool_durations.setdefault(name, LatencyHistogram())
+        # tools/list のキャッシュを作り直す
+        _static_cache.pop("tools/list", None)
+        return func
+    return register
+
+
+def static_response(method_name: str, req_id):
+    entry = _static_cache.get(method_name)
+    if entry is None:
+        result = _STATIC_METHODS[method_name]()
+        entry = _static_cache[method_name] = (result, json.dumps(result))
+    return StaticResponse(req_id, entry[0], entry[1])
+
+
+# ============================================================
+# 実行中リクエストとキャンセル（notifications/cancelled）
+# ============================================================
+
+class RequestCancelled(Exception):
+    """実行中の tools/call が notifications/cancelled で中断された"""
+
+
+# 各接続の in_flight（Connection.in_flight）を守る
+_in_flight_lock = threading.Lock()
+
+# 処理中のスレッドが、いま処理している接続（conn）と
+# 自分のリクエストのキャンセル用 Event（cancel）を参照する
+_current = threading.local()
+
+
+def _current_in_flight() -> dict:
+    conn = getattr(_current, "conn", None)
+    return conn.in_flight if conn is not None else {}
+
+
+def _track(msg, conn: Connection):
+    """
+    tools/call の id を実行中として登録する（バッチなら要素ごと）。
+    読み取りループ上で、ワーカーに渡す前に呼ぶので、
+    直後に届いた notifications/cancelled も取りこぼさない。
+    """
+    if isinstance(msg, list):
+        for item in msg:
+            _track(item, conn)
+        return
+    if isinstance(msg, dict) and msg.get("method") == "tools/call":
+        req_id = msg.get("id")
+        if isinstance(req_id, (str, int)):
+            with _in_flight_lock:
+                conn.in_flight[req_id] = threading.Event()
+
+
+def _untrack(in_flight: dict, req_id, event: threading.Event):
+    with _in_flight_lock:
+        if in_flight.get(req_id) is event:
+            del in_flight[req_id]
+
+
+def cancellable_sleep(seconds: float):
+    """
+    キャンセル可能な sleep（時間のかかるツールはこれで待つ）。
+    待っている間に自分のリクエストがキャンセルされたら RequestCancelled を投げる。
+    """
+    event = getattr(_current, "cancel", None)
+    if event is None:
+        time.sleep(seconds)
+        return
+    if event.wait(seconds):
+        raise RequestCancelled()
+
+
 # ============================================================
 # ツール実装
 # ============================================================
 
+@tool("add_numbers", "2つの数値を足し算する", {
+    "type": "object",
+    "properties": {
+        "a": {"type": "number"},
+        "b": {"type": "number"},
+    },
+    "required": ["a", "b"],
+})
 def tool_add_numbers(args: dict):
     """
     a と b を足し算するデモ用ツール（正常系確認用）
@@ -50,11 +304,19 @@ def tool_add_numbers(args: dict):
     }
 
 
+@tool("sleep_ms", "指定したミリ秒だけ待機する（タイムアウト実験用）", {
+    "type": "object",
+    "properties": {
+        "ms": {"type": "number"},
+    },
+    "required": ["ms"],
+})
 def tool_sleep_ms(args: dict):
     """
     指定したミリ秒だけ sleep するツール。
     タイムアウトや遅延レスポンス（orphan response）を
     確実に再現するために使用する。
+    notifications/cancelled を受けると待機を打ち切り、レスポンスを返さない。
     """
     ms = args.get("ms")
 
@@ -66,7 +328,7 @@ def tool_sleep_ms(args: dict):
             ],
         }
 
-    time.sleep(ms / 1000.0)
+    cancellable_sleep(ms / 1000.0)
 
     return {
         "content": [
@@ -75,187 +337,527 @@ def tool_sleep_ms(args: dict):
     }
 
 
-# ============================================================
-# ツール登録
-# ============================================================
+def collect_metrics() -> list:
+    """/metrics 用のメトリクス（ツール別）"""
+    calls_family = MetricFamily("mcp_server_tool_calls_total", "counter", "tools/call invocations")
+    errors_family = MetricFamily("mcp_server_tool_errors_total", "counter",
+                                 "tools/call results with isError")
+    cancelled_family = MetricFamily("mcp_server_tool_cancelled_total", "counter",
+                                    "tools/call aborted by notifications/cancelled")
+    names = list(TOOLS)
+    for name in names:
+        counts = _tool_counters[name].snapshot()
+        calls_family.add(counts["calls"], {"tool": name})
+        errors_family.add(counts["errors"], {"tool": name})
+        cancelled_family.add(counts["cancelled"], {"tool": name})
+
+    counts = _connection_counts.snapshot()
+    connections_family = MetricFamily("mcp_server_connections", "gauge", "Open client connections")
+    connections_family.add(counts["opened"] - counts["closed"])
 
-TOOLS = {
-    "add_numbers": tool_add_numbers,
-    "sleep_ms": tool_sleep_ms,
-}
+    return [
+        calls_family,
+        errors_family,
+        cancelled_family,
+        connections_family,
+        histogram_family("mcp_server_tool_duration_seconds", "tools/call execution time",
+                         [({"tool": name}, _tool_durations[name]) for name in names]),
+    ]
 
 
 def list_tools():
     """
     tools/list 用のレスポンスを生成する。
-    Inspector の Tools タブで表示される。
+    Inspector の Tools タブで表示される（@tool で登録した順）。
     """
-    return [
-        {
-            "name": "add_numbers",
-            "description": "2つの数値を足し算する",
-            "inputSchema": {
-                "type": "object",
-                "properties": {
-                    "a": {"type": "number"},
-                    "b": {"type": "number"},
-                },
-                "required": ["a", "b"],
-            },
-        },
-        {
-            "name": "sleep_ms",
-            "description": "指定したミリ秒だけ待機する（タイムアウト実験用）",
-            "inputSchema": {
-                "type": "object",
-                "properties": {
-                    "ms": {"type": "number"},
-                },
-                "required": ["ms"],
-            },
-        },
-    ]
+    return list(TOOL_SPECS.values())
 
 
 # ============================================================
-# リクエスト処理
+# メソッド実装
 # ============================================================
 
-def handle_request(msg: dict):
+@method("initialize", static=True)
+def initialize_result():
+    return {
+        "protocolVersion": "2025-11-25",
+        "capabilities": {
+            "resources": {},
+            "tools": {},
+        },
+        "serverInfo": {
+            "name": "async-rpc-failure-simulator",
+            "version": "0.1.0",
+        },
+    }
+
+
+@method("notifications/initialized")
+def handle_initialized(msg: dict):
+    # 通知なのでレスポンス不要
+    return None
+
+
+@method("notifications/cancelled")
+def handle_cancelled(msg: dict):
     """
-    1 件の MCP / JSON-RPC メッセージを処理する。
+    実行中（または実行待ち）の tools/call をキャンセルする。
+    キャンセルされたリクエストにはレスポンスを返さない（MCP の仕様どおり）。
+    完了済み・未知の id は無視する。
     """
-    method = msg.get("method")
+    params = msg.get("params") or {}
+    req_id = params.get("requestId")
+    if not isinstance(req_id, (str, int)):
+        return None
+    with _in_flight_lock:
+        event = _current_in_flight().get(req_id)
+    if event is not None:
+        event.set()
+        log(f"キャンセル要求: id={req_id} reason={params.get('reason')}")
+    return None
+
+
+@method("ping")
+def handle_ping(msg: dict):
+    return {
+        "jsonrpc": "2.0",
+        "id": msg.get("id"),
+        "result": {},
+    }
+
+
+@method("resources/list", static=True)
+def resources_list_result():
+    # このデモサーバーは resources を提供しない（Inspector互換のため空配列を返す）
+    return {
+        "resources": []
+    }
+
+
+@method("resources/templates/list", static=True)
+def resource_templates_list_result():
+    # このデモサーバーは resource template を提供しない
+    # Inspector 互換のため、空配列を返す
+    return {
+        "resourceTemplates": []
+    }
+
+
+@method("tools/list", static=True)
+def tools_list_result():
+    # Inspector 互換のため、配列そのものではなくオブジェクト内の tools 配列で返す
+    return {
+        "tools": list_tools()
+    }
+
+
+@method("tools/call")
+def handle_tools_call(msg: dict):
     req_id = msg.get("id")
+    # dispatch() の _track で登録された実行中の印は、どの経路で返っても必ず外す
+    in_flight = _current_in_flight()
+    with _in_flight_lock:
+        event = in_flight.get(req_id) if isinstance(req_id, (str, int)) else None
+    try:
+        return _call_tool(req_id, msg.get("params", {}), event)
+    finally:
+        if event is not None:
+            _untrack(in_flight, req_id, event)
+
+
+def _invalid_params(req_id, message: str):
+    """JSON-RPC 2.0 の Invalid params エラー（-32602）"""
+    return {
+        "jsonrpc": "2.0",
+        "id": req_id,
+        "error": {"code": -32602, "message": f"Invalid params: {message}"},
+    }
+
 
-    # --- initialize ---
-    if method == "initialize":
+def _call_tool(req_id, params, event):
+    if not isinstance(params, dict):
+        return _invalid_params(req_id, "params must be an object")
+    tool_name = params.get("name")
+    arguments = params.get("arguments", {})
+    if not isinstance(arguments, dict):
+        return _invalid_params(req_id, "arguments must be an object")
+
+    func = TOOLS.get(tool_name) if isinstance(tool_name, str) else None
+    if func is None:
+        # ツールレベルのエラー（JSON-RPC error ではない）
         return {
             "jsonrpc": "2.0",
             "id": req_id,
             "result": {
-                "protocolVersion": "2025-11-25",
-                "capabilities": {
-                    "resources": {},
-                    "tools": {},
-                },
-                "serverInfo": {
-                    "name": "async-rpc-failure-simulator",
-                    "version": "0.1.0",
-                },
+                "isError": True,
+                "content": [
+                    {"type": "text", "text": f"Error: Unknown tool {tool_name}"}
+                ],
             },
         }
 
-    # --- notifications/initialized ---
-    if method == "notifications/initialized":
-        # 通知なのでレスポンス不要
+    counters = _tool_counters[tool_name]
+    if event is not None and event.is_set():
+        # 実行待ちの間にキャンセルされた
+        counters.inc("cancelled")
         return None
 
-    # --- ping ---
-    if method == "ping":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {},
-        }
-    
-	# --- resources/list ---
-    if method == "resources/list":
-        # このデモサーバーは resources を提供しない（Inspector互換のため空配列を返す）
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "resources": []
-            },
-        }
+    _current.cancel = event
+    started = time.perf_counter()
+    try:
+        result = func(arguments)
+    except RequestCancelled:
+        counters.inc("cancelled")
+        return None
+    finally:
+        _current.cancel = None
+    _tool_durations[tool_name].record(time.perf_counter() - started)
 
-    # --- resources/templates/list ---
-    if method == "resources/templates/list":
-        # このデモサーバーは resource template を提供しない
-        # Inspector 互換のため、空配列を返す
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "resourceTemplates": []
-            },
-        }
+    counters.inc("calls")
+    if result.get("isError"):
+        counters.inc("errors")
+    return {
+        "jsonrpc": "2.0",
+        "id": req_id,
+        "result": result,
+    }
 
-    # --- tools/list ---
-    if method == "tools/list":
-        # Inspector 互換のため、配列そのものではなくオブジェクト内の tools 配列で返す
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "tools": list_tools()
-            },
-        }
 
-    # --- tools/call ---
-    if method == "tools/call":
-        params = msg.get("params", {})
-        tool_name = params.get("name")
-        arguments = params.get("arguments", {})
-
-        tool = TOOLS.get(tool_name)
-        if tool is None:
-            # ツールレベルのエラー（JSON-RPC error ではない）
-            return {
-                "jsonrpc": "2.0",
-                "id": req_id,
-                "result": {
-                    "isError": True,
-                    "content": [
-                        {"type": "text", "text": f"Error: Unknown tool {tool_name}"}
-                    ],
-                },
-            }
-
-        result = tool(arguments)
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": result,
-        }
+# ============================================================
+# リクエスト処理
+# ============================================================
 
-    # --- 未知のメソッド ---
+def _invalid_request(req_id=None):
+    """
+    JSON-RPC 2.0 の Invalid Request エラー（-32600）。
+    オブジェクトでないメッセージや空のバッチに対して返す。
+    """
     return {
         "jsonrpc": "2.0",
         "id": req_id,
+        "error": {"code": -32600, "message": "Invalid Request"},
+    }
+
+
+def handle_batch(msgs: list):
+    """
+    JSON-RPC 2.0 のバッチ（配列）を処理する。
+
+    - 各要素を順に handle_request で処理し、レスポンスを配列で返す
+    - 通知（"id" キーのない要素）は処理だけして、レスポンスは配列に含めない
+      （ハンドラーが何を返したか、未知のメソッドかどうかに関係なく、id の有無で決める）
+    - すべて通知だった場合は何も返さない（None）
+    - 空配列は単一の Invalid Request エラーを返す（仕様どおり）
+    """
+    if not msgs:
+        return _invalid_request()
+
+    responses = []
+    for item in msgs:
+        if not isinstance(item, dict):
+            responses.append(_invalid_request())
+            continue
+        response = handle_request(item)
+        if response is not None and "id" in item:
+            responses.append(response)
+
+    return responses or None
+
+
+def handle_request(msg: dict):
+    """
+    1 件の MCP / JSON-RPC メッセージを処理する。
+    配列（バッチ）が渡された場合は handle_batch に委譲する。
+    メソッドは METHODS（@method で登録）から 1 回の dict 参照で引く。
+    """
+    if isinstance(msg, list):
+        return handle_batch(msg)
+    if not isinstance(msg, dict):
+        return _invalid_request()
+
+    method_name = msg.get("method")
+    handler = METHODS.get(method_name) if isinstance(method_name, str) else None
+    if handler is not None:
+        return handler(msg)
+
+    # --- 未知のメソッド ---
+    return {
+        "jsonrpc": "2.0",
+        "id": msg.get("id"),
         "result": {
             "isError": True,
             "content": [
-                {"type": "text", "text": f"Error: Unknown method {method}"}
+                {"type": "text", "text": f"Error: Unknown method {method_name}"}
             ],
         },
     }
 
 
 # ============================================================
-# メインループ（stdio）
+# メインループ（stdio / --listen）
 # ============================================================
 
-def main():
-    # 起動ログ（stderr のみ）
-    log("MCP デモサーバー起動（stdio transport）")
+def _handle_and_send(msg: dict, conn: Connection):
+    """
+    1 件のメッセージを処理し、レスポンスがあれば送信する。
+    ワーカースレッドで例外が握りつぶされないよう stderr に記録する。
+    """
+    try:
+        _respond(msg, conn)
+    finally:
+        # 他に処理中・受信済みのメッセージがなければ、時間窓を待たずに書き出す
+        conn.finished()
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-
-        try:
-            msg = json.loads(line)
-        except json.JSONDecodeError:
-            # JSON 以外は無視（stderr にのみ記録）
-            log(f"JSON 解析失敗: {line}")
-            continue
 
+def _respond(msg: dict, conn: Connection):
+    _current.conn = conn
+    try:
         response = handle_request(msg)
-        if response is not None:
-            send_message(response)
+    except Exception as e:
+        log(f"リクエスト処理中に例外: {e!r}")
+        return
+    finally:
+        _current.conn = None
+    if response is None:
+        return
+    try:
+        if _faults is None:
+            send_message(response, conn)
+        elif isinstance(msg, list):
+            _faults.deliver("batch", response, write=conn.write_line)
+        else:
+            params = msg.get("params")
+            tool_name = params.get("name") if isinstance(params, dict) else None
+            _faults.deliver(msg.get("method"), response, tool_name, write=conn.write_line)
+    except (OSError, ValueError) as e:
+        # 処理中に相手が切断した（このレスポンスはどこにも届かない）
+        log(f"レスポンスを送信できません: {e!r}")
+
+
+def _needs_worker(msg) -> bool:
+    """tools/call を含むメッセージ（バッチなら要素のいずれか）か"""
+    if isinstance(msg, list):
+        return any(_needs_worker(item) for item in msg)
+    return isinstance(msg, dict) and msg.get("method") == "tools/call"
+
+
+def dispatch(msg: dict, conn: Connection, executor: ThreadPoolExecutor = None):
+    """
+    受信メッセージを処理系へ振り分ける。
+
+    - executor なし: 読み取りループ上でそのまま処理する
+    - executor あり: tools/call だけをワーカーに投げ、
+      完了した順にレスポンスを返す（ワーカー 1 本なら受信順）
+
+    initialize や ping などの軽いメソッドは読み取りループ上で即座に返す。
+    tools/call の実行中も読み取りループは止まらないので、
+    notifications/cancelled をすぐに処理できる。
+    バッチは 1 行で返す必要があるため、tools/call を含むならまとめて 1 タスクにする。
+    """
+    _track(msg, conn)
+    conn.received()
+    if executor is not None and _needs_worker(msg):
+        executor.submit(_handle_and_send, msg, conn)
+        return
+    _handle_and_send(msg, conn)
+
+
+def _on_frame(frame: bytes, conn: Connection, executor: ThreadPoolExecutor):
+    try:
+        msg = json.loads(frame)
+    except ValueError:
+        # JSON 以外は無視（stderr にのみ記録）
+        log(f"JSON 解析失敗: {frame.decode('utf-8', 'replace')}")
+        return
+    dispatch(msg, conn, executor)
+
+
+def _on_close(error):
+    if error is not None:
+        log(f"受信を終了: {error!r}")
+
+
+def _on_oversize(error, conn: Connection):
+    """上限を超えた 1 行は捨てて Invalid Request を返す（接続はそのまま）"""
+    log(f"大きすぎるメッセージを破棄: {error}")
+    try:
+        send_message(_invalid_request(), conn)
+    except (OSError, ValueError) as e:
+        log(f"レスポンスを送信できません: {e!r}")
+
+
+def serve_connection(conn: Connection, executor: ThreadPoolExecutor):
+    """接続が閉じるまで、呼び出したスレッドで受信して処理する"""
+    conn.transport.run(lambda frame: _on_frame(frame, conn, executor), _on_close,
+                       lambda error: _on_oversize(error, conn), conn.caught_up)
+
+
+def _frame_kwargs(args) -> dict:
+    """--max-frame-bytes の指定（省略時はトランスポートごとのデフォルト）"""
+    return {} if args.max_frame_bytes is None else {"max_frame": args.max_frame_bytes}
+
+
+def _serve_client(sock: socket.socket, name: str, args, shared_executor: ThreadPoolExecutor):
+    """--listen で accept した 1 接続を処理する（接続ごとのスレッド）"""
+    conn = Connection(SocketTransport(sock, name, **_frame_kwargs(args)),
+                      max_latency=args.flush_latency_ms / 1000.0, max_bytes=args.flush_bytes)
+    # --workers 0 なら接続ごとに 1 本のワーカー（接続内では受信順、接続どうしは並行）
+    executor = shared_executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool-worker")
+    _connection_counts.inc("opened")
+    try:
+        serve_connection(conn, executor)
+    finally:
+        if executor is not shared_executor:
+            # 切断後も、実行中のツールのレスポンスは送信を試みてから閉じる
+            executor.shutdown(wait=True)
+        conn.close()
+        _connection_counts.inc("closed")
+
+
+def _bind(spec: str) -> socket.socket:
+    """--listen の指定（unix:PATH / tcp:HOST:PORT）から待ち受けソケットを作る"""
+    kind, _, rest = spec.partition(":")
+    if kind == "unix":
+        # 前回の起動で残ったソケットファイルは消す（通常のファイルは消さない）
+        if os.path.exists(rest) and stat.S_ISSOCK(os.stat(rest).st_mode):
+            os.unlink(rest)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(rest)
+    elif kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host or "127.0.0.1", int(port)))
+    else:
+        raise ValueError(f"unknown listen address: {spec!r}")
+    server.listen(LISTEN_BACKLOG)
+    return server
+
+
+def serve_listen(spec: str, args, shared_executor: ThreadPoolExecutor = None):
+    """
+    --listen: 1 つのプロセスで複数のクライアントを処理する。
+    接続ごとにスレッドを 1 本立て、handle_request は stdio と同じものを使う。
+    """
+    server = _bind(spec)
+    kind = spec.partition(":")[0]
+    log(f"待ち受け開始: {spec}")
+    try:
+        while True:
+            sock, _ = server.accept()
+            if kind == "tcp":
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=_serve_client, args=(sock, kind, args, shared_executor),
+                             daemon=True).start()
+    finally:
+        server.close()
+        if kind == "unix":
+            try:
+                os.unlink(spec.partition(":")[2])
+            except OSError:
+                pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MCP デモサーバー（stdio transport / --listen）")
+    parser.add_argument(
+        "--listen", default=None,
+        help="unix:PATH または tcp:HOST:PORT で待ち受け、複数のクライアントを 1 プロセスで処理する"
+             "（省略時は stdin / stdout）",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="tools/call を並行実行するワーカー数（0 = 1 本のワーカーで受信順に実行。"
+             "--listen では 0 なら接続ごとに 1 本、1 以上なら全接続で共有）",
+    )
+    parser.add_argument(
+        "--flush-latency-ms", type=float, default=0.0,
+        help="レスポンスをまとめて書き出すまでの最大遅延（0 = レスポンスごとに flush）。"
+             "受信済み・処理中のリクエストがなくなったら時間窓を待たずに flush する",
+    )
+    parser.add_argument(
+        "--flush-bytes", type=int, default=DEFAULT_MAX_BYTES,
+        help="この量まで溜まったら時間窓を待たずに flush する",
+    )
+    parser.add_argument(
+        "--max-frame-bytes", type=int, default=None,
+        help="1 メッセージ（1 行）の上限。超えた行は捨てて -32600 を返す"
+             "（省略時は stdio で 64 MiB、--listen で 1 MiB）",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None,
+        help="指定すると 127.0.0.1:PORT/metrics でツール別メトリクスを公開する",
+    )
+    parser.add_argument(
+        "--faults", default=None,
+        help="障害注入の設定（JSON ファイルのパス、または JSON 文字列）。fault_injection.py 参照",
+    )
+    parser.add_argument(
+        "--fault-seed", type=int, default=None,
+        help="障害注入の乱数シード（設定ファイルの seed より優先）",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global _faults
+    args = parse_args(argv)
+
+    # 起動ログ（stderr のみ）
+    if args.listen is None:
+        log("MCP デモサーバー起動（stdio transport）")
+    else:
+        log(f"MCP デモサーバー起動（listen: {args.listen}）")
+
+    if args.faults is not None:
+        try:
+            _faults = FaultInjector(load_config(args.faults), encode=encode_message,
+                                    seed=args.fault_seed)
+        except (OSError, ValueError, KeyError) as e:
+            log(f"障害注入の設定を読み込めません: {e!r}")
+            sys.exit(2)
+        log(f"障害注入有効: rules={', '.join(_faults.rules) or '(なし)'}")
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(args.metrics_port, [collect_metrics])
+        if _faults is not None:
+            metrics_server.register(_faults.collect_metrics)
+        log(f"メトリクス公開: http://127.0.0.1:{metrics_server.port}/metrics")
+
+    # シリアルモード（workers=0）でも tools/call は 1 本のワーカーで実行し、
+    # 長いツールの実行中に notifications/cancelled を読めるようにする
+    # （--listen かつ workers=0 のときは接続ごとに 1 本）
+    executor = None
+    if args.workers > 0 or args.listen is None:
+        executor = ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="tool-worker")
+    if args.workers > 0:
+        log(f"並行ディスパッチ有効: workers={args.workers}")
+
+    conn = None
+    try:
+        if args.listen is not None:
+            # SIGTERM でも finally を通してソケットファイルを消す
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            serve_listen(args.listen, args, executor)
+        else:
+            # stdin / stdout をトランスポートとして扱う（フレーミングはクライアントと共通）
+            conn = Connection(StreamTransport(sys.stdin.buffer, sys.stdout.buffer, **_frame_kwargs(args)),
+                              max_latency=args.flush_latency_ms / 1000.0, max_bytes=args.flush_bytes)
+            serve_connection(conn, executor)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # stdin が閉じられても、実行中のツールのレスポンスは返し切る
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if _faults is not None:
+            # 遅延中のレスポンスも送り切る
+            _faults.close()
+        if conn is not None:
+            conn.output.close()
+        if metrics_server is not None:
+            metrics_server.close()
 
 
 if __name__ == "__main__":
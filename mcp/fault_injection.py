@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+障害注入（fault_injection.py）
+
+sleep_ms で 1 件だけ遅らせるのでは、実運用のようなテールレイテンシや
+レスポンス欠落のパターンを大量に再現できない。
+FaultInjector は demo_server.py の送信経路に入り、メソッドごとの設定に従って
+レスポンスに次の障害を確率的に注入する。
+
+- latency:   遅延（fixed / uniform / exponential / pareto）
+- drop:      レスポンスを返さない
+- duplicate: 同じレスポンスを 2 回返す
+- reorder:   次のレスポンスと順序を入れ替える
+- corrupt:   JSON を途中で切って壊す
+- pollute:   stdout に JSON 以外の行を混ぜる（stdio transport の典型的な事故）
+
+設定（JSON ファイルまたは JSON 文字列）:
+
+    {
+      "seed": 42,
+      "rules": {
+        "tools/call:sleep_ms": {"drop": 0.05},
+        "tools/call": {
+          "latency": {"dist": "pareto", "scale_ms": 5, "alpha": 1.5, "max_ms": 2000},
+          "duplicate": 0.01,
+          "reorder": 0.02
+        },
+        "*": {"latency": {"dist": "exponential", "mean_ms": 2}, "pollute": 0.001}
+      }
+    }
+
+ルールは「tools/call:ツール名」→「メソッド名」→「*」の順に探し、最初に見つかったものを使う。
+確率はすべて 0〜1。乱数は seed で固定できる（シリアル処理なら同じ入力に同じ障害が出る）。
+"""
+
+import json
+import random
+import threading
+
+from metrics import ShardedCounters
+from metrics_exporter import MetricFamily
+from timer_wheel import TimerWheel
+
+FAULT_KINDS = ("delayed", "dropped", "duplicated", "reordered", "corrupted", "polluted")
+
+REORDER_WINDOW_MS = 50.0   # 入れ替え相手が来なければ、この時間で保留を解放する
+POLLUTION_LINE = "[debug] this line should have gone to stderr"
+
+
+def load_config(source: str) -> dict:
+    """--faults の値（ファイルパスまたは JSON 文字列）を読み込む"""
+    text = source.strip()
+    if not text.startswith("{"):
+        with open(source, encoding="utf-8") as f:
+            text = f.read()
+    config = json.loads(text)
+    if not isinstance(config, dict):
+        raise ValueError("fault config must be a JSON object")
+    return config
+
+
+def sample_latency(spec: dict, rng: random.Random) -> float:
+    """遅延の設定から 1 回分の遅延（秒）を引く"""
+    if rng.random() >= spec.get("p", 1.0):
+        return 0.0
+
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        ms = spec["ms"]
+    elif dist == "uniform":
+        ms = rng.uniform(spec["min_ms"], spec["max_ms"])
+    elif dist == "exponential":
+        ms = rng.expovariate(1.0 / spec["mean_ms"])
+    elif dist == "pareto":
+        # scale_ms 以上で、alpha が小さいほど裾が重い
+        ms = spec["scale_ms"] * rng.paretovariate(spec["alpha"])
+    else:
+        raise ValueError(f"unknown latency distribution: {dist}")
+
+    if "max_ms" in spec:
+        ms = min(ms, spec["max_ms"])
+    return max(0.0, ms) / 1000.0
+
+
+def _validate_rule(key: str, rule: dict):
+    if not isinstance(rule, dict):
+        raise ValueError(f"fault rule for {key!r} must be an object")
+    for name in ("drop", "duplicate", "reorder", "corrupt", "pollute"):
+        p = rule.get(name, 0.0)
+        if not isinstance(p, (int, float)) or not 0.0 <= p <= 1.0:
+            raise ValueError(f"fault rule {key!r}: {name} must be a probability (0..1)")
+    latency = rule.get("latency")
+    if latency is not None:
+        # 設定ミスは起動時に検出する
+        sample_latency(dict(latency, p=1.0), random.Random(0))
+
+
+class FaultInjector:
+    """
+    レスポンス送信の前段に入り、ルールに従って障害を注入する。
+
+    deliver(method, response) を send_message の代わりに呼ぶ。
+    接続が複数ある（demo_server --listen）ときは、送信先を deliver(..., write=) で渡す。
+    遅延・入れ替えの保留は TimerWheel で管理する（メッセージごとにスレッドを作らない）。
+    """
+
+    def __init__(self, config: dict, write=None, encode=json.dumps, seed: int = None):
+        # write:  1 行（改行込みの str）を stdout に書く関数（deliver の write= が優先）
+        # encode: レスポンス（dict / バッチ）を JSON 文字列にする関数
+        self._write = write
+        self._encode = encode
+
+        self.rules = config.get("rules", {})
+        for key, rule in self.rules.items():
+            _validate_rule(key, rule)
+        self.reorder_window = config.get("reorder_window_ms", REORDER_WINDOW_MS) / 1000.0
+
+        if seed is None:
+            seed = config.get("seed")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()   # 乱数の順序と保留中のメッセージを守る
+        self._held = None               # reorder で保留中の (行, タイマー, 送信先)
+
+        self._wheel = TimerWheel(tick=0.001, slots=4096)
+        self._idle = threading.Condition()
+        self._scheduled = 0             # 遅延中・保留中のメッセージ数
+
+        self.counters = ShardedCounters(FAULT_KINDS)
+
+    def rule_for(self, method, tool_name=None):
+        if tool_name is not None:
+            rule = self.rules.get(f"{method}:{tool_name}")
+            if rule is not None:
+                return rule
+        rule = self.rules.get(method)
+        if rule is None:
+            rule = self.rules.get("*")
+        return rule
+
+    def deliver(self, method, response, tool_name=None, write=None):
+        """レスポンスを（障害を注入しつつ）送信する"""
+        write = write or self._write
+        rule = self.rule_for(method, tool_name) if isinstance(method, str) else self.rules.get("*")
+        if not rule:
+            write(self._encode(response) + "\n")
+            return
+
+        line = self._encode(response) + "\n"
+        with self._lock:
+            rng = self._rng
+            if rng.random() < rule.get("pollute", 0.0):
+                self.counters.inc("polluted")
+                write(POLLUTION_LINE + "\n")
+
+            if rng.random() < rule.get("drop", 0.0):
+                self.counters.inc("dropped")
+                return
+
+            if rng.random() < rule.get("corrupt", 0.0):
+                self.counters.inc("corrupted")
+                # 閉じ括弧に届かない位置で切る → 必ず不正な JSON になる
+                line = line[:rng.randrange(1, max(2, len(line) - 2))] + "\n"
+
+            copies = 1
+            if rng.random() < rule.get("duplicate", 0.0):
+                self.counters.inc("duplicated")
+                copies = 2
+
+            delay = 0.0
+            latency = rule.get("latency")
+            if latency is not None:
+                delay = sample_latency(latency, rng)
+                if delay > 0:
+                    self.counters.inc("delayed")
+
+            reorder = rng.random() < rule.get("reorder", 0.0)
+
+        data = line * copies
+        if delay > 0:
+            self._schedule(delay, lambda: self._emit(data, write, reorder))
+        else:
+            self._emit(data, write, reorder)
+
+    def _emit(self, data: str, write, reorder: bool = False):
+        """送信する。reorder なら次のメッセージの後ろに回すため保留する"""
+        with self._lock:
+            held = self._held
+            self._held = None
+            if reorder and held is None:
+                self.counters.inc("reordered")
+                self._held = (data, self._schedule(self.reorder_window, self._release_held), write)
+                return
+
+        if held is not None:
+            if self._wheel.cancel(held[1]):
+                self._done()
+            write(data)
+            self._send_held(held)
+            return
+        write(data)
+
+    def _send_held(self, held):
+        data, _, write = held
+        try:
+            write(data)
+        except (OSError, ValueError):
+            # 保留中に相手の接続が閉じた（別の接続の送信を巻き込まない）
+            pass
+
+    def _release_held(self):
+        with self._lock:
+            held = self._held
+            self._held = None
+        if held is not None:
+            self._send_held(held)
+
+    def _schedule(self, delay: float, callback):
+        def run():
+            try:
+                callback()
+            finally:
+                self._done()
+
+        with self._idle:
+            self._scheduled += 1
+        return self._wheel.schedule(delay, run)
+
+    def _done(self):
+        with self._idle:
+            self._scheduled -= 1
+            if self._scheduled == 0:
+                self._idle.notify_all()
+
+    def close(self, timeout: float = 10.0):
+        """遅延中・保留中のレスポンスを送り切ってからタイマーを止める"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._scheduled == 0, timeout=timeout)
+        self._release_held()
+        self._wheel.stop()
+
+    def collect_metrics(self) -> list:
+        """/metrics 用（注入した障害の種類別件数）"""
+        family = MetricFamily("mcp_server_faults_injected_total", "counter",
+                              "Faults injected into responses")
+        for kind, value in self.counters.snapshot().items():
+            family.add(value, {"kind": kind})
+        return [family]
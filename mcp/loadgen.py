@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+再現可能な負荷生成器（loadgen.py）
+
+シナリオ（scenarios_test.py）は数件のリクエストを手で投げ、
+time.sleep(ms/1000 + 0.1) で orphan の到着を待つだけなので、
+負荷のかかった状態での timeout / orphan の発生パターンは分からない。
+
+LoadGenerator は seed で固定したスケジュールで StdioMcpClient / SecureStdioMcpClient に
+リクエストを投げ、すべてのイベント（send / receive / timeout / orphan）を記録する。
+
+負荷のかけ方（mode）:
+- poisson: 開ループ。ポアソン到着（指数分布の間隔）で rate 件/秒を送る。
+           応答を待たずに予定時刻どおり送るので、レイテンシは「予定送信時刻」から測る
+           （サーバーが詰まっても送信が遅れず、coordinated omission が起きない）
+- closed:  閉ループ。users 人がそれぞれ「送る → 応答（またはタイムアウト）を待つ →
+           考える時間」を繰り返す
+- burst:   burst_interval 秒ごとに burst_size 件をまとめて送る
+
+同じ seed・同じ引数なら、送るリクエストの内容と予定時刻は毎回同じになる。
+
+実行例:
+  ./venv/bin/python mcp/loadgen.py --mode poisson --rate 500 --duration 5 --timeout 0.2 \\
+      --mix add_numbers=9,sleep_ms=1 --sleep-ms 300 --events /tmp/events.jsonl
+  ./venv/bin/python mcp/loadgen.py --client secure --mode closed --users 16 --duration 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from scenarios_test import StdioMcpClient
+from secure_client import SecureStdioMcpClient
+from metrics import LatencyHistogram
+from timer_wheel import TimerWheel
+from session_trace import TraceWriter
+
+SERVER_PATH = os.path.join(HERE, "demo_server.py")
+
+MODES = ("poisson", "closed", "burst")
+CLIENTS = ("vulnerable", "secure")
+
+
+# ============================================================
+# リクエストの内容（ツールの混合比）
+# ============================================================
+
+def parse_mix(text: str) -> list:
+    """'add_numbers=9,sleep_ms=1' → [("add_numbers", 9.0), ("sleep_ms", 1.0)]"""
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def build_call(tool: str, sleep_ms: float, seq: int) -> tuple:
+    """ツール名から (method, params) を作る"""
+    if tool == "ping":
+        return "ping", {}
+    if tool == "sleep_ms":
+        return "tools/call", {"name": "sleep_ms", "arguments": {"ms": sleep_ms}}
+    return "tools/call", {"name": tool, "arguments": {"a": seq, "b": 1}}
+
+
+# ============================================================
+# スケジュール（seed で固定）
+# ============================================================
+
+def poisson_schedule(rng: random.Random, rate: float, duration: float) -> list:
+    """開ループ: 予定送信時刻（開始からの秒）のリスト"""
+    offsets = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+def burst_schedule(burst_size: int, interval: float, duration: float) -> list:
+    """バースト: interval 秒ごとに burst_size 件（同時刻）"""
+    offsets = []
+    t = 0.0
+    while t < duration:
+        offsets.extend([t] * burst_size)
+        t += interval
+    return offsets
+
+
+# ============================================================
+# イベント記録
+# ============================================================
+
+class EventLog:
+    """
+    send / receive / timeout / orphan の記録。
+    時刻は開始からの経過ナノ秒（time.monotonic_ns()）。
+    list.append はスレッド間で安全なので、記録時にロックは取らない。
+    """
+
+    def __init__(self):
+        self.start_ns = time.monotonic_ns()
+        self.events = []
+
+    def record(self, kind: str, request_id, **fields):
+        self.events.append((time.monotonic_ns() - self.start_ns, kind, request_id, fields))
+
+    def counts(self) -> dict:
+        result = dict.fromkeys(("send", "receive", "timeout", "orphan"), 0)
+        for _, kind, _, _ in self.events:
+            result[kind] = result.get(kind, 0) + 1
+        return result
+
+    def write_jsonl(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for t_ns, kind, request_id, fields in self.events:
+                f.write(json.dumps(dict(fields, t_ns=t_ns, event=kind, id=request_id)) + "\n")
+
+
+# ============================================================
+# 負荷生成器
+# ============================================================
+
+class LoadGenerator:
+    """
+    1 つのクライアントに対してスケジュールどおりにリクエストを投げる。
+
+    タイムアウトは TimerWheel で管理し、期限が来たら client.expire() で台帳から外す
+    （以後に届いたレスポンスは client.on_orphan 経由で orphan として記録される）。
+    """
+
+    def __init__(self, client, mix: list, sleep_ms: float = 100.0, timeout: float = 1.0,
+                 seed: int = 0):
+        self.client = client
+        self.timeout = timeout
+        self.sleep_ms = sleep_ms
+        self.rng = random.Random(seed)
+        self._tools = [name for name, _ in mix]
+        self._weights = [weight for _, weight in mix]
+
+        self.log = EventLog()
+        self.latency = LatencyHistogram()  # 予定送信時刻からの応答時間
+        self._timers = TimerWheel()
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._seq = 0
+
+        client.on_orphan = self._on_orphan
+
+    def _next_call(self) -> tuple:
+        self._seq += 1
+        tool = self.rng.choices(self._tools, self._weights)[0]
+        return tool, build_call(tool, self.sleep_ms, self._seq)
+
+    def _send(self, tool: str, call: tuple, intended_ns: int, done=None):
+        """1 件送る。intended_ns は予定送信時刻（開始からのナノ秒）"""
+        method, params = call
+        with self._idle:
+            self._outstanding += 1
+        request_id, fut = self.client.send_request(method, params)
+        self.log.record("send", request_id, tool=tool,
+                        lag_ns=time.monotonic_ns() - self.log.start_ns - intended_ns)
+        timer = self._timers.schedule(self.timeout, lambda: self.client.expire(request_id))
+
+        def on_done(f):
+            self._timers.cancel(timer)
+            if f.exception() is None:
+                self.client.expire(request_id)  # 台帳の後始末（完了済みなので失敗はさせない）
+                elapsed_ns = time.monotonic_ns() - self.log.start_ns - intended_ns
+                self.latency.record(elapsed_ns / 1e9)
+                self.log.record("receive", request_id, latency_ns=elapsed_ns)
+            elif isinstance(f.exception(), FutureTimeoutError):
+                self.log.record("timeout", request_id)
+            with self._idle:
+                self._outstanding -= 1
+                self._idle.notify_all()
+            if done is not None:
+                done()
+
+        fut.add_done_callback(on_done)
+
+    def _on_orphan(self, data):
+        self.log.record("orphan", data.get("id") if isinstance(data, dict) else None)
+
+    def _sleep_until(self, offset_ns: int):
+        delay = (self.log.start_ns + offset_ns - time.monotonic_ns()) / 1e9
+        if delay > 0:
+            time.sleep(delay)
+
+    def run_open(self, offsets: list):
+        """開ループ（poisson / burst）: 予定時刻が来たら応答を待たずに送る"""
+        calls = [self._next_call() for _ in offsets]  # 内容は先に決めておく（送信タイミングに依存しない）
+        self.log.start_ns = time.monotonic_ns()
+        for offset, (tool, call) in zip(offsets, calls):
+            intended_ns = int(offset * 1e9)
+            self._sleep_until(intended_ns)
+            self._send(tool, call, intended_ns)
+
+    def run_closed(self, users: int, duration: float, think_ms: float = 0.0):
+        """閉ループ: 各ユーザーが「送る → 待つ → 考える」を繰り返す"""
+        # ユーザーごとに乱数を分けて、スレッドの実行順に結果が左右されないようにする
+        rngs = [random.Random(self.rng.random()) for _ in range(users)]
+        self.log.start_ns = time.monotonic_ns()
+        end_ns = int(duration * 1e9)
+
+        def user_loop(rng: random.Random):
+            turn = threading.Event()
+            seq = 0
+            while time.monotonic_ns() - self.log.start_ns < end_ns:
+                tool = rng.choices(self._tools, self._weights)[0]
+                seq += 1
+                turn.clear()
+                self._send(tool, build_call(tool, self.sleep_ms, seq),
+                           time.monotonic_ns() - self.log.start_ns, done=turn.set)
+                turn.wait()
+                if think_ms > 0:
+                    time.sleep(rng.expovariate(1000.0 / think_ms))
+
+        threads = [threading.Thread(target=user_loop, args=(rng,), daemon=True) for rng in rngs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def drain(self, orphan_wait: float):
+        """未完了のリクエストがタイムアウトか応答で片付くのを待ち、さらに orphan の到着を待つ"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._outstanding == 0, timeout=self.timeout + 5.0)
+        time.sleep(orphan_wait)
+        self._timers.stop()
+
+    def summary(self) -> dict:
+        counts = self.log.counts()
+        elapsed = (time.monotonic_ns() - self.log.start_ns) / 1e9
+        latency = self.latency.summary()
+        return {
+            "sent": counts["send"],
+            "received": counts["receive"],
+            "timeouts": counts["timeout"],
+            "orphans": counts["orphan"],
+            "orphan_ratio": round(counts["orphan"] / counts["send"], 4) if counts["send"] else 0.0,
+            "elapsed_s": round(elapsed, 3),
+            "latency_ms": {key[:-3]: value for key, value in latency.items() if key.endswith("_ms")},
+        }
+
+
+# ============================================================
+# CLI
+# ============================================================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MCP クライアント向けの再現可能な負荷生成器")
+    parser.add_argument("--client", choices=CLIENTS, default="vulnerable")
+    parser.add_argument("--mode", choices=MODES, default="poisson")
+    parser.add_argument("--seed", type=int, default=0, help="スケジュールと混合比の乱数シード")
+    parser.add_argument("--duration", type=float, default=5.0, help="負荷をかける時間（秒）")
+    parser.add_argument("--rate", type=float, default=200.0, help="poisson: 平均到着率（件/秒）")
+    parser.add_argument("--users", type=int, default=8, help="closed: 同時ユーザー数")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="closed: 平均の考える時間（ミリ秒）")
+    parser.add_argument("--burst-size", type=int, default=50, help="burst: 1 回にまとめて送る件数")
+    parser.add_argument("--burst-interval", type=float, default=1.0, help="burst: バーストの間隔（秒）")
+    parser.add_argument("--mix", default="add_numbers=1",
+                        help="ツールの混合比（例: add_numbers=9,sleep_ms=1。ping も指定可）")
+    parser.add_argument("--sleep-ms", type=float, default=100.0, help="sleep_ms ツールの待ち時間")
+    parser.add_argument("--timeout", type=float, default=1.0, help="1 リクエストのタイムアウト（秒）")
+    parser.add_argument("--orphan-wait", type=float, default=None,
+                        help="終了前に orphan の到着を待つ時間（秒、既定は sleep-ms + 0.5 秒）")
+    parser.add_argument("--server-args", default="",
+                        help="demo_server.py に渡す引数（例: \"--workers 8 --faults faults.json\"）")
+    parser.add_argument("--events", default=None, help="イベントを JSONL で書き出すパス")
+    parser.add_argument("--trace", default=None,
+                        help="送受信トレースを書き出すパス（trace_replay.py で再生できる）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client_cls = SecureStdioMcpClient if args.client == "secure" else StdioMcpClient
+    server_args = args.server_args.split()
+    tracer = None
+    if args.trace:
+        tracer = TraceWriter(args.trace, meta={"server_args": server_args, "client": args.client})
+    client = client_cls(sys.executable, SERVER_PATH, server_args=server_args, tracer=tracer)
+
+    generator = LoadGenerator(client, parse_mix(args.mix), sleep_ms=args.sleep_ms,
+                              timeout=args.timeout, seed=args.seed)
+    try:
+        client.request("initialize", {})
+        if args.mode == "poisson":
+            generator.run_open(poisson_schedule(generator.rng, args.rate, args.duration))
+        elif args.mode == "burst":
+            generator.run_open(burst_schedule(args.burst_size, args.burst_interval, args.duration))
+        else:
+            generator.run_closed(args.users, args.duration, args.think_ms)
+
+        orphan_wait = args.orphan_wait
+        if orphan_wait is None:
+            orphan_wait = args.sleep_ms / 1000.0 + 0.5
+        generator.drain(orphan_wait)
+    finally:
+        client.close()
+        if tracer is not None:
+            tracer.close()
+
+    result = dict(generator.summary(), client=args.client, mode=args.mode, seed=args.seed)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.events:
+        generator.log.write_jsonl(args.events)
+        print(f"[INFO] イベントを書き出しました: {args.events}（{len(generator.log.events)} 件）",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
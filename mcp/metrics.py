@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+スレッドシャード化されたメトリクス（metrics.py）
+
+reader スレッドと呼び出し側スレッドの両方が 1 つの dict を
+ロックなしで += すると、カウントが競合で失われる。
+かといって pending 台帳と同じロックを取ると、そのロックが混雑する。
+
+ここでは「スレッドごとに自分専用のシャードを持ち、読むときに合計する」方式をとる。
+- 書き込み: 自スレッドのシャードだけを更新する（ロック不要・他スレッドと競合しない）
+- 読み出し: 全シャードを合計する（書き込み側を止めない）
+- スレッドが終了したら、そのシャードは「終了済みスレッドの合計」に畳み込む
+  （接続ごとにスレッドを立てる --listen でもシャードが増え続けない）
+
+ShardedCounters  : 名前付きカウンター（stats["timeouts"] のように読める）
+LatencyHistogram : HDR 風の対数線形バケットによるレイテンシ分布
+"""
+
+import threading
+import weakref
+
+# 1 オクターブ（2 倍の範囲）を何分割するか。16 分割で相対誤差は約 6% 以内
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+class _ThreadMarker:
+    """スレッドローカルに置く目印。スレッドが終了すると解放される"""
+
+    __slots__ = ("__weakref__",)
+
+
+class _Shards:
+    """
+    スレッドごとのシャードを作成・列挙する共通部分。
+
+    merge(into, shard) は shard の値を into に加える関数。
+    スレッドの終了時（スレッドローカルの目印が解放されたとき）に、
+    そのスレッドのシャードを終了済みスレッドの合計（retired）に畳み込んで一覧から外す。
+    """
+
+    def __init__(self, factory, merge):
+        self._factory = factory
+        self._merge = merge
+        self._local = threading.local()
+        self._retired = factory()
+        self._shards = [self._retired]
+        self._shards_lock = threading.Lock()  # シャードの追加・畳み込み時のみ使う
+
+    def mine(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._factory()
+            marker = _ThreadMarker()
+            weakref.finalize(marker, self._retire, shard)
+            with self._shards_lock:
+                self._shards = self._shards + [shard]
+            self._local.marker = marker
+            self._local.shard = shard
+            return shard
+
+    def _retire(self, shard):
+        # 読み出し中の all() のコピーと二重に数えないよう、retired は作り直して
+        # 一覧ごと差し替える（既存のオブジェクトは書き換えない）
+        with self._shards_lock:
+            retired = self._factory()
+            self._merge(retired, self._retired)
+            self._merge(retired, shard)
+            self._shards = [retired] + [s for s in self._shards
+                                        if s is not shard and s is not self._retired]
+            self._retired = retired
+
+    def all(self) -> list:
+        # 一覧は追加・畳み込みのたびに作り直すので、参照を取るだけで一貫したコピーになる
+        return self._shards
+
+
+class ShardedCounters:
+    """
+    スレッドごとのシャードに加算し、読み出し時に合計するカウンター群。
+
+    counters.inc("requests_sent")
+    counters["requests_sent"]  # 全スレッドの合計
+    """
+
+    def __init__(self, names):
+        self._names = tuple(names)
+        self._shards = _Shards(lambda: dict.fromkeys(self._names, 0), _merge_counters)
+
+    def inc(self, name: str, n: int = 1):
+        self._shards.mine()[name] += n
+
+    def __getitem__(self, name: str) -> int:
+        if name not in self._names:
+            raise KeyError(name)
+        return sum(shard[name] for shard in self._shards.all())
+
+    def keys(self):
+        return self._names
+
+    def snapshot(self) -> dict:
+        total = dict.fromkeys(self._names, 0)
+        for shard in self._shards.all():
+            _merge_counters(total, shard)
+        return total
+
+
+def _merge_counters(into: dict, shard: dict):
+    for name, value in list(shard.items()):
+        into[name] += value
+
+
+def bucket_index(value: int) -> int:
+    """値（整数、マイクロ秒）を対数線形バケットの番号に変換する"""
+    if value < 2 * SUB_BUCKETS:
+        return max(0, value)
+    exponent = value.bit_length() - SUB_BUCKET_BITS - 1
+    return exponent * SUB_BUCKETS + (value >> exponent)
+
+
+def bucket_upper(index: int) -> int:
+    """バケット番号に含まれる最大値"""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    exponent = index // SUB_BUCKETS - 1
+    mantissa = index - exponent * SUB_BUCKETS
+    return ((mantissa + 1) << exponent) - 1
+
+
+class _HistogramShard:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = {}  # バケット番号 -> 件数（疎）
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+def _merge_histogram(into: _HistogramShard, shard: _HistogramShard):
+    for index, n in list(shard.counts.items()):
+        into.counts[index] = into.counts.get(index, 0) + n
+    into.count += shard.count
+    into.total += shard.total
+    into.max = max(into.max, shard.max)
+
+
+class LatencyHistogram:
+    """
+    HDR 風のレイテンシヒストグラム（マイクロ秒精度、相対誤差 約 6%）。
+
+    record() は自スレッドのシャードにだけ書くので、reader スレッドから
+    呼んでも他スレッドを待たせない。
+    """
+
+    def __init__(self):
+        self._shards = _Shards(_HistogramShard, _merge_histogram)
+
+    def record(self, seconds: float):
+        us = int(seconds * 1_000_000)
+        shard = self._shards.mine()
+        index = bucket_index(us)
+        shard.counts[index] = shard.counts.get(index, 0) + 1
+        shard.count += 1
+        shard.total += us
+        if us > shard.max:
+            shard.max = us
+
+    def merged(self) -> tuple:
+        """全シャードを合計して (バケット -> 件数, 件数, 合計us, 最大us) を返す"""
+        total = _HistogramShard()
+        for shard in self._shards.all():
+            _merge_histogram(total, shard)
+        return total.counts, total.count, total.total, total.max
+
+    def cumulative(self, bounds_us: list) -> tuple:
+        """
+        Prometheus ヒストグラム用に、各上限（マイクロ秒）以下の累積件数を返す。
+        戻り値: ([累積件数...], 全件数, 合計us)
+        バケット単位の近似（バケットの最大値が上限以下なら含める）。
+        """
+        counts, count, total, _ = self.merged()
+        ordered = sorted(counts.items())
+        result = []
+        seen = 0
+        i = 0
+        for bound in bounds_us:
+            while i < len(ordered) and bucket_upper(ordered[i][0]) <= bound:
+                seen += ordered[i][1]
+                i += 1
+            result.append(seen)
+        return result, count, total
+
+    def summary(self) -> dict:
+        """件数・平均・パーセンタイル（ミリ秒）"""
+        counts, count, total, maximum = self.merged()
+        result = {"count": count, "mean_ms": 0.0, "max_ms": round(maximum / 1000.0, 3)}
+        if count == 0:
+            for q in ("p50", "p90", "p99", "p999"):
+                result[f"{q}_ms"] = 0.0
+            return result
+
+        result["mean_ms"] = round(total / count / 1000.0, 3)
+        ordered = sorted(counts.items())
+        for name, q in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("p999", 0.999)):
+            target = q * count
+            seen = 0
+            for index, n in ordered:
+                seen += n
+                if seen >= target:
+                    result[f"{name}_ms"] = round(min(bucket_upper(index), maximum) / 1000.0, 3)
+                    break
+        return result
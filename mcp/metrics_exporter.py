@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Prometheus / OpenMetrics 形式のメトリクス公開（metrics_exporter.py）
+
+get_stats() の dict は実行の最後に表示するだけなので、
+orphan が大量発生している「その瞬間」をダッシュボードで見られない。
+MetricsServer はローカル HTTP（デフォルト 127.0.0.1）で /metrics を公開し、
+Prometheus のテキスト形式（text/plain; version=0.0.4）で返す。
+
+collector は「MetricFamily のリストを返す関数」。
+複数のクライアントの collector を 1 つの MetricsServer に登録でき、
+同名のメトリクスはラベル違いとして 1 つのファミリーにまとめて出力される。
+
+標準ライブラリ（http.server）のみ使用。
+"""
+
+import sys
+import threading
+import http.server
+
+# ヒストグラムの上限（秒）。RPC の往復時間・ツール実行時間向け
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricFamily:
+    """1 つのメトリクス名（HELP / TYPE）とそのサンプル群"""
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind  # counter / gauge / histogram
+        self.help = help_text
+        self.samples = []  # (接尾辞, ラベル dict, 値)
+
+    def add(self, value, labels: dict = None, suffix: str = ""):
+        self.samples.append((suffix, labels or {}, value))
+        return self
+
+
+def histogram_family(name: str, help_text: str, samples: list,
+                     buckets: tuple = DEFAULT_BUCKETS) -> MetricFamily:
+    """
+    LatencyHistogram 群から Prometheus ヒストグラムを作る。
+    samples: [(ラベル dict, LatencyHistogram), ...]
+    """
+    family = MetricFamily(name, "histogram", help_text)
+    bounds_us = [int(b * 1_000_000) for b in buckets]
+    for labels, histogram in samples:
+        cumulative, count, total_us = histogram.cumulative(bounds_us)
+        for bound, n in zip(buckets, cumulative):
+            family.add(n, dict(labels, le=_format_value(bound)), "_bucket")
+        family.add(count, dict(labels, le="+Inf"), "_bucket")
+        family.add(total_us / 1_000_000, labels, "_sum")
+        family.add(count, labels, "_count")
+    return family
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + inner + "}"
+
+
+def render(families: list) -> str:
+    """MetricFamily のリストをテキスト形式にする（同名はまとめる）"""
+    merged = {}
+    for family in families:
+        if family.name in merged:
+            merged[family.name].samples.extend(family.samples)
+        else:
+            copy = MetricFamily(family.name, family.kind, family.help)
+            copy.samples = list(family.samples)
+            merged[family.name] = copy
+
+    lines = []
+    for family in merged.values():
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for suffix, labels, value in family.samples:
+            lines.append(f"{family.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    /metrics を公開するローカル HTTP サーバー（デーモンスレッドで動作）。
+
+    server = MetricsServer(9464, [client.collect_metrics])
+    ...
+    server.close()
+    """
+
+    def __init__(self, port: int, collectors: list = None, host: str = "127.0.0.1"):
+        self.collectors = list(collectors or [])
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # スクレイプごとのログは出さない（stdio サーバーの stdout を汚さないためにも）
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        # port=0 を指定した場合は OS が割り当てたポートになる
+        self.port = self._httpd.server_address[1]
+
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        families = []
+        for collector in list(self.collectors):
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"[WARN] メトリクス収集で例外: {e!r}", file=sys.stderr)
+        return render(families)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -4,8 +4,13 @@ import sys
 import json
 import time
 import threading
-import subprocess
-from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+
+from backpressure import DEFAULT_OVERLOAD_WAIT, InFlightLimiter, QueuedWriter
+from coalescing_writer import CoalescingWriter, DEFAULT_MAX_BYTES
+from codec import get_codec
+from transport import STDIO_MAX_FRAME_SIZE, StdioTransport
+from bounded_store import BoundedStore, DEFAULT_STORE_ITEMS, DEFAULT_STORE_TTL, DEFAULT_STORE_BYTES
 
 # ============================================================
 # 目的:
@@ -39,16 +44,44 @@ class StdioMcpClient:
       → 後から返ってきたレスポンスは orphan として観測できる
     """
 
-    def __init__(self, python_exe: str, server_script: str):
-        # サーバーを子プロセスとして起動（stdio transport）
-        self.process = subprocess.Popen(
-            [python_exe, server_script],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,  # サーバーstderrは捨てる（クライアント出力と混ざらない）
-            text=True,
-            bufsize=1,           # 行バッファ（読みやすさのため）
-        )
+    def __init__(self, python_exe: str = None, server_script: str = None,
+                 flush_latency: float = 0.0, flush_bytes: int = DEFAULT_MAX_BYTES,
+                 binary: bool = False, codec: str = "json", server_args: list = None,
+                 orphan_limit: int = DEFAULT_STORE_ITEMS, orphan_ttl: float = DEFAULT_STORE_TTL,
+                 orphan_max_bytes: int = DEFAULT_STORE_BYTES, cancel_on_timeout: bool = False,
+                 tracer=None, transport=None, max_in_flight: int = None, max_queued: int = None,
+                 overload_wait: float = DEFAULT_OVERLOAD_WAIT, max_frame: int = STDIO_MAX_FRAME_SIZE):
+        # tracer（session_trace.TraceWriter）を渡すと、送受信した行をすべて記録する
+        self.tracer = tracer
+        # cancel_on_timeout=True のときは、タイムアウトしたリクエストについて
+        # notifications/cancelled を送り、サーバー側の処理を打ち切らせる
+        # （orphan 自体が発生しなくなる。観測用のデフォルトは False）
+        self.cancel_on_timeout = cancel_on_timeout
+
+        # binary=True のときは codec でエンコード/デコードする（orjson などに差し替え可能）
+        self.binary = binary
+        self._codec = get_codec(codec)
+
+        # transport を渡さなければ、サーバーを子プロセスとして起動する（stdio transport）
+        # TCP / Unix ソケット / プロセス内パイプなどは transport.py を参照
+        if transport is None:
+            transport = StdioTransport.spawn([python_exe, server_script, *(server_args or [])], max_frame)
+        self.transport = transport
+        self.process = getattr(transport, "process", None)
+
+        # 送信（flush_latency > 0 なら複数リクエストを1回のwriteにまとめる）
+        # max_queued を指定すると、上限付きの送信キューと書き込み専用スレッドで送る
+        if max_queued is not None:
+            self._writer = QueuedWriter(transport, max_queued)
+        else:
+            self._writer = CoalescingWriter(
+                transport, max_latency=flush_latency, max_bytes=flush_bytes
+            )
+
+        # max_in_flight を指定すると、応答待ちをその件数までに抑える
+        # 空きがなければ overload_wait 秒まで待ち、それでも空かなければ OverloadedError
+        self._limiter = InFlightLimiter(max_in_flight) if max_in_flight is not None else None
+        self.overload_wait = overload_wait
 
         # request_id発行とpending台帳
         self._lock = threading.Lock()
@@ -56,13 +89,16 @@ class StdioMcpClient:
         self._pending = {}  # id -> Future
 
         # orphan（タイムアウト後に返ってきた遅延レスポンス等）の観測用
-        self.orphan_responses = []  # list[dict]
-        self.notifications = []     # list[dict]
-
-        # readerスレッド開始
+        # 長時間回しても増え続けないよう、件数・保持時間・バイト数に上限を持つ
+        # （リストのように len / [-1] / for で読める。捨てた件数は .stats() で確認）
+        self.orphan_responses = BoundedStore(orphan_limit, orphan_ttl, orphan_max_bytes)
+        self.notifications = BoundedStore(orphan_limit, orphan_ttl, orphan_max_bytes)
+        # orphan を受信するたびに reader スレッドから呼ばれるフック（data を受け取る）
+        self.on_orphan = None
+
+        # 受信スレッド開始（フレームごとに _on_frame が呼ばれる）
         self._running = True
-        self._reader = threading.Thread(target=self._reader_loop, daemon=True)
-        self._reader.start()
+        transport.start(self._on_frame, self._on_close, self._on_oversize)
 
     def close(self):
         """
@@ -70,71 +106,147 @@ class StdioMcpClient:
         """
         self._running = False
         try:
-            if self.process and self.process.poll() is None:
-                self.process.terminate()
-                self.process.wait(timeout=3)
+            self._writer.close()
         except Exception:
             pass
+        self.transport.close()
+
+    @property
+    def in_flight(self) -> int:
+        """応答待ち（台帳に残っている）リクエスト数"""
+        with self._lock:
+            return len(self._pending)
 
-    def _send(self, msg: dict):
+    def _send(self, msg, wait: float = None):
         """
-        1行JSONをサーバーstdinへ送信
+        1行JSON（オブジェクトまたはバッチ配列）をサーバーstdinへ送信
+        （送信キューを使う場合、空きを待つのは wait 秒まで）
         """
-        s = json.dumps(msg)
-        self.process.stdin.write(s + "\n")
-        self.process.stdin.flush()
+        if self.binary:
+            data = self._codec.dumps(msg) + b"\n"
+        else:
+            data = (json.dumps(msg) + "\n").encode("utf-8")
+        if self.tracer is not None:
+            self.tracer.record("send", data)
+        if isinstance(self._writer, QueuedWriter):
+            self._writer.write(data, timeout=wait)
+        else:
+            self._writer.write(data)
+
+    def _acquire(self, n: int) -> float:
+        """応答待ちの枠を n 件分確保し、送信キューの空きを待てる残り時間を返す"""
+        deadline = time.monotonic() + self.overload_wait
+        if self._limiter is not None:
+            self._limiter.acquire(n, timeout=self.overload_wait)
+        return max(0.0, deadline - time.monotonic())
+
+    def _new_future(self) -> Future:
+        fut = Future()
+        if self._limiter is not None:
+            # 完了したら（レスポンス・期限切れ・送信失敗）枠を返す
+            fut.add_done_callback(lambda _: self._limiter.release())
+        return fut
+
+    def _forget(self, request_ids: list, error: Exception = None):
+        """
+        台帳から外す。未完了の Future は error（省略時は TimeoutError）で失敗させる。
+        """
+        with self._lock:
+            futs = [self._pending.pop(request_id, None) for request_id in request_ids]
+        for request_id, fut in zip(request_ids, futs):
+            if fut is None or fut.done():
+                continue
+            try:
+                fut.set_exception(error or FutureTimeoutError(f"request {request_id} timed out"))
+            except InvalidStateError:
+                # 直前に reader スレッドがレスポンスを設定した
+                pass
 
     def _issue_id(self) -> int:
         with self._lock:
             self._next_id += 1
             return self._next_id
 
-    def _reader_loop(self):
+    def _dispatch(self, data: dict, size: int = None):
+        """
+        受信メッセージ 1 件を id で pending 台帳と突き合わせる。
+        size は受信したフレームのうちこのメッセージ分のバイト数（保存時の上限計算に使う）。
+        """
+        if not isinstance(data, dict):
+            print(f"[WARN] 不正な形式のメッセージを受信: {data}")
+            return
+
+        # 通知（idなし）
+        resp_id = data.get("id")
+        if resp_id is None:
+            self.notifications.append(data, size)
+            return
+
+        # レスポンス（idあり）
+        with self._lock:
+            fut = self._pending.get(resp_id)
+
+        if fut is not None:
+            if fut.done():
+                return
+            try:
+                fut.set_result(data)
+                return
+            except InvalidStateError:
+                # 台帳から引いた直後に expire() / _forget() が期限切れにした（orphan として扱う）
+                pass
+
+        # 台帳にない -> orphan（タイムアウト後の遅延レスポンス等）
+        self.orphan_responses.append(data, size)
+        if self.on_orphan is not None:
+            self.on_orphan(data)
+
+    def _loads(self, frame: bytes):
+        if self.binary:
+            return self._codec.loads(frame)
+        return json.loads(frame)
+
+    def _on_frame(self, frame: bytes):
         """
-        サーバーstdoutを読み続けて、idで突き合わせる。
+        受信した 1 フレームを解析して、idで突き合わせる（受信スレッドから呼ばれる）。
         """
+        if self.tracer is not None:
+            self.tracer.record("recv", frame)
+        # サーバーはstdoutにJSONのみ出す前提だが、
+        # 万一混ざったときに観測しやすいように扱う
         try:
-            for line in self.process.stdout:
-                line = line.strip()
-                if not line:
-                    continue
-
-                # サーバーはstdoutにJSONのみ出す前提だが、
-                # 万一混ざったときに観測しやすいように扱う
-                try:
-                    data = json.loads(line)
-                except json.JSONDecodeError:
-                    print(f"[WARN] JSON以外を受信（stdout汚染の疑い）: {line}")
-                    continue
-
-                # 通知（idなし）
-                resp_id = data.get("id")
-                if resp_id is None:
-                    self.notifications.append(data)
-                    continue
-
-                # レスポンス（idあり）
-                with self._lock:
-                    fut = self._pending.get(resp_id)
-
-                if fut is None:
-                    # 台帳にない -> orphan（タイムアウト後の遅延レスポンス等）
-                    self.orphan_responses.append(data)
-                    continue
-
-                if not fut.done():
-                    fut.set_result(data)
+            data = self._loads(frame)
+        except ValueError:
+            print(f"[WARN] JSON以外を受信（stdout汚染の疑い）: {frame}")
+            return
+
+        try:
+            # バッチレスポンス（配列）は要素ごとに突き合わせる
+            # （要素ごとのバイト数はフレーム長を等分した概算で足りる。再シリアライズはしない）
+            if isinstance(data, list):
+                size = len(frame) // max(len(data), 1)
+                for item in data:
+                    self._dispatch(item, size)
+            else:
+                self._dispatch(data, len(frame))
         except Exception as e:
-            print(f"[FATAL] readerスレッドがクラッシュ: {e}")
-        finally:
-            pass
+            print(f"[FATAL] 受信メッセージの処理で例外: {e!r}")
+
+    def _on_close(self, error):
+        if error is not None and self._running:
+            print(f"[FATAL] 受信が異常終了: {error!r}")
+
+    def _on_oversize(self, error):
+        # 上限（max_frame）を超えた 1 行は捨てる（対応するリクエストはタイムアウトになる）
+        print(f"[WARN] 大きすぎるメッセージを破棄: {error}")
 
     def send_request(self, method: str, params: dict) -> tuple[int, Future]:
         """
         request（idあり）を投げ、Futureを返す（待機は呼び出し側）
         """
+        wait = self._acquire(1)
         request_id = self._issue_id()
-        fut = Future()
+        fut = self._new_future()
         with self._lock:
             self._pending[request_id] = fut
 
@@ -144,7 +256,11 @@ class StdioMcpClient:
             "method": method,
             "params": params
         }
-        self._send(msg)
+        try:
+            self._send(msg, wait)
+        except Exception as e:
+            self._forget([request_id], e)
+            raise
         return request_id, fut
 
     def request(self, method: str, params: dict, timeout: float = 5.0) -> dict:
@@ -155,10 +271,76 @@ class StdioMcpClient:
         request_id, fut = self.send_request(method, params)
         try:
             return fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            if self.cancel_on_timeout:
+                self.cancel(request_id)
+            raise
         finally:
             # 必ず台帳を掃除（ここが orphan 観測の鍵にもなる）
-            with self._lock:
-                self._pending.pop(request_id, None)
+            self._forget([request_id])
+
+    def expire(self, request_id):
+        """
+        台帳から外す（send_request で投げたリクエストの後始末・タイムアウト処理用）。
+        まだ完了していなければ TimeoutError で失敗させる。以後のレスポンスは orphan になる。
+        """
+        self._forget([request_id])
+
+    def send_batch(self, calls: list) -> list:
+        """
+        複数の request を JSON-RPC バッチ（1 行の配列）として投げる。
+
+        calls: [(method, params), ...]
+        戻り値: [(request_id, Future), ...]（calls と同じ順序）
+
+        サーバーはバッチを 1 行の配列で返すので、reader が要素ごとに
+        各 Future を解決する。メッセージごとの flush / syscall をまとめて削減できる。
+        """
+        wait = self._acquire(len(calls))
+        entries = []
+        batch = []
+        for method, params in calls:
+            request_id = self._issue_id()
+            fut = self._new_future()
+            entries.append((request_id, fut))
+            batch.append({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": method,
+                "params": params
+            })
+
+        with self._lock:
+            for request_id, fut in entries:
+                self._pending[request_id] = fut
+
+        try:
+            self._send(batch, wait)
+        except Exception as e:
+            self._forget([request_id for request_id, _ in entries], e)
+            raise
+        return entries
+
+    def request_many(self, calls: list, timeout: float = 5.0) -> list:
+        """
+        バッチで投げて、全レスポンスを calls と同じ順序のリストで返す。
+        timeout はバッチ全体の待ち時間。超えたら TimeoutError を投げる。
+        """
+        entries = self.send_batch(calls)
+        deadline = time.monotonic() + timeout
+        try:
+            return [
+                fut.result(timeout=max(0.0, deadline - time.monotonic()))
+                for _, fut in entries
+            ]
+        except FutureTimeoutError:
+            if self.cancel_on_timeout:
+                for request_id, fut in entries:
+                    if not fut.done():
+                        self.cancel(request_id)
+            raise
+        finally:
+            self._forget([request_id for request_id, _ in entries])
 
     def notify(self, method: str, params: dict):
         """
@@ -169,7 +351,14 @@ class StdioMcpClient:
             "method": method,
             "params": params
         }
-        self._send(msg)
+        self._send(msg, self.overload_wait)
+
+    def cancel(self, request_id, reason: str = "timeout"):
+        """
+        notifications/cancelled を送り、サーバーに処理の打ち切りを求める。
+        キャンセルされたリクエストのレスポンスは返ってこない（間に合わなければ orphan になる）。
+        """
+        self.notify("notifications/cancelled", {"requestId": request_id, "reason": reason})
 
 
 # ============================================================
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+基盤部分の回帰テストシナリオ（scenarios_test_infra.py）
+
+scenarios_test.py / scenarios_test_secure.py はクライアント実装の振る舞い
+（ID・orphan・タイムアウト）を見せるためのもの。
+ここではその下にあるサーバー・トランスポート・メトリクスなどの基盤部分を確認する。
+各シナリオは専用のサーバー・接続を使い、互いに状態を共有しない。
+
+実行方法:
+  ./venv/bin/python mcp/scenarios_test_infra.py
+
+期待される出力:
+  - すべてのシナリオで [PASS]（[FAIL] が出たら回帰）
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import demo_server
+from async_client import AsyncStdioMcpClient
+from secure_client import SecureStdioMcpClient
+from server_pool import ServerPool
+from transport import SocketTransport, MAX_FRAME_SIZE
+
+SERVER_PATH = os.path.join(HERE, "demo_server.py")
+
+
+def header(title: str):
+    print("\n" + "=" * 72)
+    print(title)
+    print("=" * 72)
+
+
+def _sample(families: list, name: str, suffix: str = "", **labels):
+    """collect_metrics() の結果から 1 サンプルの値を取り出す"""
+    for family in families:
+        if family.name != name:
+            continue
+        for sample_suffix, sample_labels, value in family.samples:
+            if sample_suffix == suffix and all(sample_labels.get(k) == v for k, v in labels.items()):
+                return value
+    return None
+
+
+def _collect_cost() -> float:
+    """collect_metrics() 1 回の所要時間（ゆらぎを除くため最小値をとる）"""
+    best = None
+    for _ in range(200):
+        started = time.perf_counter()
+        demo_server.collect_metrics()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _check_sums(responses: list, calls: list) -> bool:
+    """add_numbers のバッチ結果が calls と同じ順序で正しいか"""
+    for resp, (_, params) in zip(responses, calls):
+        args = params["arguments"]
+        if resp.get("result", {}).get("content", [{}])[0].get("text") != str(args["a"] + args["b"]):
+            return False
+    return len(responses) == len(calls)
+
+
+def scenario_listen_shards_bounded():
+    header("SCENARIO 1: 接続を繰り返してもサーバーのメトリクスの集計コストが増え続けない")
+
+    # --listen の 1 接続分の処理（_serve_client）を、socketpair でプロセス内に立てる
+    args = demo_server.parse_args([])
+
+    def connect(n: int):
+        for _ in range(n):
+            client_sock, server_sock = socket.socketpair()
+            server = threading.Thread(target=demo_server._serve_client,
+                                      args=(server_sock, "pipe", args, None))
+            server.start()
+            client = SecureStdioMcpClient(transport=SocketTransport(client_sock, "pipe"))
+            try:
+                client.request("tools/call", {"name": "add_numbers", "arguments": {"a": 1, "b": 2}})
+            finally:
+                client.close()
+            server.join(timeout=5)
+
+    warmup, connections = 10, 300
+    connect(warmup)
+    before = _collect_cost()
+    print(f"[INFO] 接続 → tools/call → 切断 を {connections} 回繰り返す（--workers 0: 接続ごとにスレッド）")
+    connect(connections)
+    after = _collect_cost()
+
+    # 終了したスレッドのシャードが残り続けると、集計（全シャードの合計）が接続数に比例して重くなる
+    print(f"[INFO] collect_metrics(): {before * 1e6:.0f}us → {after * 1e6:.0f}us")
+    if after < before * 3:
+        print("[PASS] 終了したスレッドのシャードは畳み込まれ、集計コストは接続数に比例して増えない")
+    else:
+        print("[FAIL] 接続ごとにシャードが増え、集計コストが増え続けている")
+
+    families = demo_server.collect_metrics()
+    total = warmup + connections
+    calls = _sample(families, "mcp_server_tool_calls_total", tool="add_numbers")
+    durations = _sample(families, "mcp_server_tool_duration_seconds", "_count", tool="add_numbers")
+    open_connections = _sample(families, "mcp_server_connections")
+    if calls == total and durations == total:
+        print(f"[PASS] 畳み込み後も合計は失われない（calls={calls}, duration count={durations}）")
+    else:
+        print(f"[FAIL] 合計が合わない: calls={calls}, duration count={durations}, expected={total}")
+    if open_connections == 0:
+        print("[PASS] 切断済みの接続は接続数のゲージに残らない")
+    else:
+        print(f"[FAIL] 接続数のゲージが 0 に戻らない: {open_connections}")
+
+
+def scenario_frame_limit():
+    header("SCENARIO 2: 上限を超える行は捨てて -32600、上限内の大きなバッチは通る")
+
+    limit = 4096
+    print(f"[INFO] --max-frame-bytes {limit} のサーバーに {limit * 2} バイトの行を送る")
+    client = SecureStdioMcpClient(python_exe=sys.executable, server_script=SERVER_PATH,
+                                  server_args=["--max-frame-bytes", str(limit)])
+    try:
+        line = json.dumps({"jsonrpc": "2.0", "id": "oversized", "method": "ping",
+                           "params": {"pad": "x" * (limit * 2)}}) + "\n"
+        client.transport.send(line.encode("utf-8"))
+
+        deadline = time.monotonic() + 5
+        error = None
+        while error is None and time.monotonic() < deadline:
+            error = next((m for m in client.notifications
+                          if m.get("error", {}).get("code") == -32600), None)
+            time.sleep(0.01)
+        if error is not None:
+            print(f"[PASS] 上限超えの行に Invalid Request が返った: {error['error']}")
+        else:
+            print("[FAIL] 上限超えの行に -32600 が返らなかった")
+
+        try:
+            client.request("ping", {}, timeout=2.0)
+            print("[PASS] 上限超えの行を捨てたあとも同じ接続で ping が通る")
+        except Exception as e:
+            print(f"[FAIL] 上限超えの行のあと ping が通らない: {e!r}")
+    finally:
+        client.close()
+
+    # stdio の上限は --listen（MAX_FRAME_SIZE）より大きい。それを超えるバッチを 1 行で送る
+    count = 12000
+    calls = [("tools/call", {"name": "add_numbers", "arguments": {"a": i, "b": 1}}) for i in range(count)]
+    client = SecureStdioMcpClient(python_exe=sys.executable, server_script=SERVER_PATH)
+    try:
+        size = len(json.dumps([{"jsonrpc": "2.0", "id": "0" * 32, "method": m, "params": p}
+                               for m, p in calls]))
+        print(f"[INFO] {count} 件のバッチ（約 {size // 1024} KiB、--listen の上限 {MAX_FRAME_SIZE // 1024} KiB 超）")
+        responses = client.request_many(calls, timeout=30.0)
+        if _check_sums(responses, calls):
+            print(f"[PASS] stdio では {count} 件のバッチが 1 行で往復できる")
+        else:
+            print("[FAIL] バッチのレスポンスが合わない")
+    except Exception as e:
+        print(f"[FAIL] 大きなバッチが失敗: {e!r}")
+    finally:
+        client.close()
+
+
+def scenario_pool_reuse_after_timeout():
+    header("SCENARIO 3: タイムアウトしたリクエストが残るサーバーは次の借り手に渡さない")
+
+    ms = 300
+    timeout_sec = 0.05
+    print("[INFO] size=1 のプールで、タイムアウト → 返却 → 次の貸し出し を 2 通りの使い方で行う")
+    with ServerPool(sys.executable, SERVER_PATH, size=1) as pool:
+        pool.wait_ready()
+
+        def leave_late_response(client):
+            try:
+                client.request("tools/call", {"name": "sleep_ms", "arguments": {"ms": ms}},
+                               timeout=timeout_sec)
+            except FutureTimeoutError:
+                pass
+
+        def check_next_lease(label: str, discarded_before: int):
+            with pool.client(SecureStdioMcpClient) as client:
+                client.request("ping", {})
+                # 前の借り手のレスポンスが届くはずの時間まで待つ
+                time.sleep(ms / 1000.0 + 0.1)
+                orphans = client.stats["orphans_discarded"]
+            discarded = pool.stats["discarded"] - discarded_before
+            if orphans == 0 and discarded >= 1:
+                print(f"[PASS] {label}: サーバーは捨てられ、次の借り手に orphan は届かない")
+            else:
+                print(f"[FAIL] {label}: 次の借り手の orphan={orphans}, 破棄={discarded}")
+
+        # pool.client() 経由（タイムアウト後は in_flight=0 なので、台帳だけでは見分けられない）
+        discarded_before = pool.stats["discarded"]
+        with pool.client(SecureStdioMcpClient) as client:
+            leave_late_response(client)
+        check_next_lease("pool.client()", discarded_before)
+
+        # lease() を直接クライアントに渡す使い方
+        discarded_before = pool.stats["discarded"]
+        client = SecureStdioMcpClient(transport=pool.lease())
+        leave_late_response(client)
+        client.close()
+        check_next_lease("pool.lease()", discarded_before)
+
+
+def scenario_async_large_batch():
+    header("SCENARIO 4: async クライアントで 1 行が 64 KiB を超えるバッチを往復する")
+
+    count = 1000
+    calls = [("tools/call", {"name": "add_numbers", "arguments": {"a": i, "b": 1}}) for i in range(count)]
+
+    async def run():
+        async with await AsyncStdioMcpClient.start(sys.executable, SERVER_PATH) as client:
+            try:
+                responses = await client.request_many(calls, timeout=30.0)
+            except Exception as e:
+                print(f"[FAIL] {count} 件のバッチが失敗: {e!r}")
+                return
+            if _check_sums(responses, calls):
+                print(f"[PASS] {count} 件のバッチのレスポンスを読めた（StreamReader の既定上限を超える 1 行）")
+            else:
+                print("[FAIL] バッチのレスポンスが合わない")
+
+            try:
+                await client.request("ping", {}, timeout=2.0)
+                print("[PASS] バッチのあとも reader は動き続け、ping が通る")
+            except Exception as e:
+                print(f"[FAIL] バッチのあと ping が通らない: {e!r}")
+
+    asyncio.run(run())
+
+
+def scenario_batch_notifications():
+    header("SCENARIO 5: バッチ内の通知（id なし）にはレスポンスを返さない")
+
+    tool_call = {"name": "add_numbers", "arguments": {"a": 1, "b": 2}}
+    notifications = [
+        {"jsonrpc": "2.0", "method": "ping"},
+        {"jsonrpc": "2.0", "method": "tools/call", "params": tool_call},
+        {"jsonrpc": "2.0", "method": "no/such/method"},
+    ]
+
+    def add_calls():
+        return _sample(demo_server.collect_metrics(), "mcp_server_tool_calls_total", tool="add_numbers")
+
+    calls_before = add_calls()
+    responses = demo_server.handle_request(notifications + [{"jsonrpc": "2.0", "id": 1, "method": "ping"}])
+    calls = add_calls() - calls_before
+    if isinstance(responses, list) and [r.get("id") for r in responses] == [1]:
+        print("[PASS] 通知と request が混ざったバッチは request の分だけ返す")
+    else:
+        print(f"[FAIL] 通知にもレスポンスが返った: {responses}")
+    if calls == 1:
+        print("[PASS] レスポンスを返さない通知も処理自体は行う（tools/call が 1 回実行された）")
+    else:
+        print(f"[FAIL] 通知の tools/call が実行されていない: calls={calls}")
+
+    # stdio 越しに、通知だけのバッチには何も書き出さないこと
+    client = SecureStdioMcpClient(python_exe=sys.executable, server_script=SERVER_PATH)
+    try:
+        client.transport.send((json.dumps(notifications) + "\n").encode("utf-8"))
+        time.sleep(0.2)
+        client.request("ping", {}, timeout=2.0)
+        unexpected = [m for m in client.notifications if "result" in m or "error" in m]
+        orphans = client.stats["orphans_discarded"]
+        if not unexpected and orphans == 0:
+            print("[PASS] 通知だけのバッチには何も返さない")
+        else:
+            print(f"[FAIL] 通知だけのバッチに応答が返った: {unexpected}, orphans={orphans}")
+    finally:
+        client.close()
+
+
+def main():
+    if not os.path.exists(SERVER_PATH):
+        print(f"[FATAL] サーバースクリプトが見つかりません: {SERVER_PATH}")
+        sys.exit(1)
+
+    print("=" * 72)
+    print("基盤部分（サーバー・トランスポート・メトリクス）の回帰テスト")
+    print("=" * 72)
+
+    scenario_listen_shards_bounded()
+    scenario_frame_limit()
+    scenario_pool_reuse_after_timeout()
+    scenario_async_large_batch()
+    scenario_batch_notifications()
+
+
+if __name__ == "__main__":
+    main()
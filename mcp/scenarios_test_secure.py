@@ -19,6 +19,7 @@
 期待される出力:
   - 機能テスト（SCENARIO 1〜3）は脆弱版と同様にPASS
   - SCENARIO 4では orphan が「破棄」されたことを確認
+  - SCENARIO 5ではキャンセル通知により orphan 自体が発生しないことを確認
   - 最後に統計情報を表示
 """
 
@@ -144,8 +145,42 @@ def scenario_timeout_orphan_secure(client: SecureStdioMcpClient):
         print("[WARN] orphan response を検出できなかった（タイミング依存）")
 
 
+def scenario_cancel_on_timeout(client: SecureStdioMcpClient):
+    header("SCENARIO 5: タイムアウト → キャンセル通知で orphan を発生させない")
+
+    ms = 300
+    timeout_sec = 0.05
+
+    print("[INFO] cancel_on_timeout=True のとき、タイムアウトしたリクエストについて")
+    print("       notifications/cancelled を送り、サーバー側の処理を打ち切らせる")
+    print()
+
+    orphans_before = client.stats["orphans_discarded"]
+    client.cancel_on_timeout = True
+    try:
+        client.request("tools/call", {
+            "name": "sleep_ms",
+            "arguments": {"ms": ms}
+        }, timeout=timeout_sec)
+        print("[FAIL] 期待した TimeoutError が発生しなかった")
+        return
+    except FutureTimeoutError:
+        print(f"[PASS] TimeoutError を観測し、キャンセル通知を送信（送信数: {client.stats['cancels_sent']}）")
+    finally:
+        client.cancel_on_timeout = False
+
+    # キャンセルされなければ orphan が届くはずの時間まで待つ
+    time.sleep(ms / 1000.0 + 0.1)
+
+    orphans_after = client.stats["orphans_discarded"]
+    if orphans_after == orphans_before:
+        print("[PASS] orphan response は発生しなかった（サーバーが処理を打ち切った）")
+    else:
+        print(f"[FAIL] orphan response が届いた（カウント: {orphans_before} → {orphans_after}）")
+
+
 def scenario_compare_implementations():
-    header("SCENARIO 5: 脆弱な実装との比較サマリー")
+    header("SCENARIO 6: 脆弱な実装との比較サマリー")
 
     print("""
 ┌─────────────────────────────────────────────────────────────────────┐
@@ -154,8 +189,8 @@ def scenario_compare_implementations():
 │ request_id生成      │ self._next_id += 1   │ secrets.token_hex()   │
 │                     │ → 1, 2, 3...（予測可）│ → ランダム（予測不可）│
 ├─────────────────────────────────────────────────────────────────────┤
-│ orphan response     │ orphan_responses     │ stats["orphans_       │
-│                     │   .append(data)      │   discarded"] += 1    │
+│ orphan response     │ orphan_responses     │ stats.inc(            │
+│                     │   .append(data)      │ "orphans_discarded")  │
 │                     │ → 再利用可能         │ → 破棄（再利用不可）  │
 ├─────────────────────────────────────────────────────────────────────┤
 │ タイムアウト検証    │ なし                 │ MIN/MAX範囲チェック   │
@@ -194,6 +229,7 @@ def main():
         scenario_demux_async(client)
         scenario_tool_error(client)
         scenario_timeout_orphan_secure(client)
+        scenario_cancel_on_timeout(client)
         scenario_compare_implementations()
 
     finally:
@@ -206,6 +242,8 @@ def main():
         print(f"  - レスポンス受信数:    {stats['responses_received']}")
         print(f"  - タイムアウト発生数:  {stats['timeouts']}")
         print(f"  - orphan破棄数:        {stats['orphans_discarded']}")
+        print(f"  - キャンセル通知数:    {stats['cancels_sent']}")
+        print(f"  - 往復時間 p50/p99:    {stats['latency']['p50_ms']}ms / {stats['latency']['p99_ms']}ms")
         print()
         if stats['orphans_discarded'] > 0:
             print("[INFO] orphan response は保存されず、安全に破棄されました")
@@ -18,11 +18,19 @@
 import os
 import sys
 import json
+import time
 import secrets
 import threading
-import subprocess
 from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
+from backpressure import DEFAULT_OVERLOAD_WAIT, InFlightLimiter, OverloadedError, QueuedWriter
+from coalescing_writer import CoalescingWriter, DEFAULT_MAX_BYTES
+from codec import get_codec
+from timer_wheel import TimerWheel
+from metrics import ShardedCounters, LatencyHistogram
+from metrics_exporter import MetricFamily, MetricsServer, histogram_family
+from transport import STDIO_MAX_FRAME_SIZE, StdioTransport
+
 # ============================================================
 # 設定値（堅牢化のためのデフォルト）
 # ============================================================
@@ -31,6 +39,7 @@ DEFAULT_TIMEOUT = 5.0  # デフォルトタイムアウト（秒）
 MIN_TIMEOUT = 0.1      # 最小タイムアウト（これ以下は警告）
 MAX_TIMEOUT = 30.0     # 最大タイムアウト（これ以上は警告）
 ID_BYTES = 16          # request_idのバイト長（16バイト = 128ビット）
+TIMER_GRACE = 1.0      # タイマーが遅れた場合に呼び出し側で諦めるまでの猶予（秒）
 
 
 def log_security(level: str, msg: str):
@@ -44,50 +53,131 @@ class SecureStdioMcpClient:
 
     脆弱な実装との違い:
     - _issue_id(): 連番ではなく secrets.token_hex() を使用
-    - _reader_loop(): orphan responseは保存せず警告ログのみ
+    - _dispatch(): orphan responseは保存せず警告ログのみ
     - request(): タイムアウト値の範囲チェック
     """
 
-    def __init__(self, python_exe: str, server_script: str):
-        self.process = subprocess.Popen(
-            [python_exe, server_script],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            text=True,
-            bufsize=1,
-        )
+    def __init__(self, python_exe: str = None, server_script: str = None,
+                 flush_latency: float = 0.0, flush_bytes: int = DEFAULT_MAX_BYTES,
+                 binary: bool = False, codec: str = "json", server_args: list = None,
+                 metrics_port: int = None, cancel_on_timeout: bool = False, tracer=None,
+                 transport=None, max_in_flight: int = None, max_queued: int = None,
+                 overload_wait: float = DEFAULT_OVERLOAD_WAIT, max_frame: int = STDIO_MAX_FRAME_SIZE):
+        # tracer（session_trace.TraceWriter）を渡すと、送受信した行をすべて記録する
+        self.tracer = tracer
+        self.binary = binary
+        # True のとき、期限切れのリクエストについて notifications/cancelled を送る
+        self.cancel_on_timeout = cancel_on_timeout
+        self._codec = get_codec(codec)
+
+        # transport を渡さなければ、サーバーを子プロセスとして起動する（stdio transport）
+        if transport is None:
+            transport = StdioTransport.spawn([python_exe, server_script, *(server_args or [])], max_frame)
+        self.transport = transport
+        self.process = getattr(transport, "process", None)
+
+        # max_queued を指定すると、上限付きの送信キューと書き込み専用スレッドで送る
+        # （サーバーが読まなくなっても呼び出し側が write の中で止まらない）
+        if max_queued is not None:
+            self._writer = QueuedWriter(transport, max_queued)
+        else:
+            self._writer = CoalescingWriter(
+                transport, max_latency=flush_latency, max_bytes=flush_bytes
+            )
+
+        # max_in_flight を指定すると、応答待ちをその件数までに抑える
+        # 枠・キューに空きがなければ overload_wait 秒まで待ち、それでも空かなければ
+        # OverloadedError（overload_wait=0 なら待たずにすぐ断る）
+        self._limiter = InFlightLimiter(max_in_flight) if max_in_flight is not None else None
+        self.overload_wait = overload_wait
 
         self._lock = threading.Lock()
-        self._pending = {}  # id -> Future
+        self._pending = {}  # id -> (Future, Timer, 送信時刻)
+
+        # タイムアウト管理（呼び出し側が待っていなくても期限切れを処理する）
+        self._timers = TimerWheel()
 
         # 統計情報（監視・アラート用）
-        self.stats = {
-            "requests_sent": 0,
-            "responses_received": 0,
-            "orphans_discarded": 0,  # 保存ではなくカウントのみ
-            "timeouts": 0,
-        }
+        # reader スレッドと呼び出し側スレッドの両方が更新するので、
+        # スレッドごとのシャードに加算し、読むときに合計する（_lock とは独立）
+        self.stats = ShardedCounters((
+            "requests_sent",
+            "responses_received",
+            "orphans_discarded",  # 保存ではなくカウントのみ
+            "timeouts",
+            "cancels_sent",       # タイムアウト時に送った notifications/cancelled
+            "overloaded",         # 枠・送信キューに空きがなく OverloadedError で断った
+        ))
+        # リクエスト往復時間（送信 → レスポンス受信）
+        self.latency = LatencyHistogram()
 
         self.notifications = []
+        # orphan を破棄するたびに reader スレッドから呼ばれるフック（data を受け取る）
+        self.on_orphan = None
+
+        # metrics_port を指定すると /metrics（Prometheus形式）を公開する
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(metrics_port, [self.collect_metrics])
 
         self._running = True
-        self._reader = threading.Thread(target=self._reader_loop, daemon=True)
-        self._reader.start()
+        transport.start(self._on_frame, self._on_close, self._on_oversize)
 
     def close(self):
         self._running = False
+        self._timers.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
         try:
-            if self.process and self.process.poll() is None:
-                self.process.terminate()
-                self.process.wait(timeout=3)
+            self._writer.close()
         except Exception:
             pass
+        self.transport.close()
 
-    def _send(self, msg: dict):
-        s = json.dumps(msg)
-        self.process.stdin.write(s + "\n")
-        self.process.stdin.flush()
+    @property
+    def in_flight(self) -> int:
+        """応答待ち（台帳に残っている）リクエスト数"""
+        with self._lock:
+            return len(self._pending)
+
+    def _send(self, msg, wait: float = None):
+        """送信する（送信キューを使う場合、空きを待つのは wait 秒まで）"""
+        if self.binary:
+            data = self._codec.dumps(msg) + b"\n"
+        else:
+            data = (json.dumps(msg) + "\n").encode("utf-8")
+        if self.tracer is not None:
+            self.tracer.record("send", data)
+        if isinstance(self._writer, QueuedWriter):
+            self._writer.write(data, timeout=wait)
+        else:
+            self._writer.write(data)
+
+    def _acquire(self, n: int) -> float:
+        """
+        応答待ちの枠を n 件分確保し、送信キューの空きを待てる残り時間を返す。
+        空かなければ OverloadedError。
+        """
+        deadline = time.monotonic() + self.overload_wait
+        if self._limiter is not None:
+            try:
+                self._limiter.acquire(n, timeout=self.overload_wait)
+            except OverloadedError:
+                self.stats.inc("overloaded")
+                raise
+        return max(0.0, deadline - time.monotonic())
+
+    def _unregister(self, request_ids: list, error: Exception):
+        """送れなかったリクエストを台帳から外し、error で失敗させる（枠も返る）"""
+        with self._lock:
+            entries = [self._pending.pop(request_id, None) for request_id in request_ids]
+        for entry in entries:
+            if entry is None:
+                continue
+            fut, timer, _ = entry
+            self._timers.cancel(timer)
+            if not fut.done():
+                fut.set_exception(error)
 
     def _issue_id(self) -> str:
         """
@@ -102,52 +192,149 @@ class SecureStdioMcpClient:
         """
         return secrets.token_hex(ID_BYTES)
 
-    def _reader_loop(self):
+    def _dispatch(self, data: dict):
+        if not isinstance(data, dict):
+            log_security("WARN", f"不正な形式のメッセージを破棄: {str(data)[:100]}")
+            return
+
+        resp_id = data.get("id")
+        if resp_id is None:
+            self.notifications.append(data)
+            return
+
+        with self._lock:
+            entry = self._pending.pop(resp_id, None)
+
+        if entry is None:
+            # 【堅牢化ポイント2】orphan responseは保存せず破棄
+            #
+            # 脆弱な実装: self.orphan_responses.append(data)
+            # 堅牢な実装: ログ出力して破棄（再利用させない）
+            #
+            # これにより:
+            # - orphan responseを再利用した情報漏洩を防止
+            # - タイミング攻撃によるレスポンス横取りを防止
+            self.stats.inc("orphans_discarded")
+            log_security("WARN", f"Orphan response を破棄: id={resp_id}")
+            if self.on_orphan is not None:
+                self.on_orphan(data)
+            return  # ← 保存しない
+
+        fut, timer, sent_at = entry
+        self._timers.cancel(timer)
+        self.latency.record(time.perf_counter() - sent_at)
+        self.stats.inc("responses_received")
+        if not fut.done():
+            fut.set_result(data)
+
+    def _expire(self, request_id: str):
+        """
+        タイマーから呼ばれる。まだ台帳にあれば外して TimeoutError で失敗させる。
+        以後に届いたレスポンスは orphan として破棄される。
+        """
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+
+        fut = entry[0]
+        if not fut.done():
+            self.stats.inc("timeouts")
+            fut.set_exception(FutureTimeoutError(f"request {request_id} timed out"))
+            if self.cancel_on_timeout:
+                self.cancel(request_id)
+
+    def cancel(self, request_id: str, reason: str = "timeout"):
+        """
+        notifications/cancelled を送り、サーバーに処理の打ち切りを求める。
+        サーバー側の無駄な処理と、後から届く orphan response の両方を減らせる。
+        """
+        msg = {
+            "jsonrpc": "2.0",
+            "method": "notifications/cancelled",
+            "params": {"requestId": request_id, "reason": reason}
+        }
+        try:
+            # タイマースレッドから呼ばれるので、送信キューが一杯でも待たない
+            self._send(msg, wait=0)
+        except Exception as e:
+            # サーバーが終了済みなど。タイムアウト処理自体は完了しているので記録だけする
+            log_security("WARN", f"キャンセル通知の送信に失敗: id={request_id} ({e!r})")
+            return
+        self.stats.inc("cancels_sent")
+
+    def expire(self, request_id: str):
+        """呼び出し側の都合で期限切れにする（負荷生成器などが独自の期限を持つ場合）"""
+        self._expire(request_id)
+
+    def _register(self, request_id: str, timeout: float) -> Future:
+        """台帳に登録し、タイムアウト用のタイマーを仕掛ける（self._lock 保持中に呼ぶ）"""
+        fut = Future()
+        if self._limiter is not None:
+            # レスポンス・期限切れ・送信失敗のどれで終わっても枠を返す
+            fut.add_done_callback(lambda _: self._limiter.release())
+        timer = self._timers.schedule(timeout, lambda: self._expire(request_id))
+        self._pending[request_id] = (fut, timer, time.perf_counter())
+        return fut
+
+    def _check_timeout(self, timeout: float) -> float:
+        """
+        【堅牢化ポイント3】タイムアウト値の検証（request() の説明を参照）
+        """
+        if timeout is None:
+            return DEFAULT_TIMEOUT
+        if timeout < MIN_TIMEOUT:
+            log_security("WARN", f"タイムアウトが短すぎます: {timeout}s < {MIN_TIMEOUT}s")
+        elif timeout > MAX_TIMEOUT:
+            log_security("WARN", f"タイムアウトが長すぎます: {timeout}s > {MAX_TIMEOUT}s")
+        return timeout
+
+    def _loads(self, frame: bytes):
+        if self.binary:
+            return self._codec.loads(frame)
+        return json.loads(frame)
+
+    def _on_frame(self, frame: bytes):
+        if self.tracer is not None:
+            self.tracer.record("recv", frame)
         try:
-            for line in self.process.stdout:
-                line = line.strip()
-                if not line:
-                    continue
-
-                try:
-                    data = json.loads(line)
-                except json.JSONDecodeError:
-                    log_security("WARN", f"JSON以外を受信（stdout汚染の疑い）: {line[:100]}")
-                    continue
-
-                resp_id = data.get("id")
-                if resp_id is None:
-                    self.notifications.append(data)
-                    continue
-
-                with self._lock:
-                    fut = self._pending.get(resp_id)
-
-                if fut is None:
-                    # 【堅牢化ポイント2】orphan responseは保存せず破棄
-                    #
-                    # 脆弱な実装: self.orphan_responses.append(data)
-                    # 堅牢な実装: ログ出力して破棄（再利用させない）
-                    #
-                    # これにより:
-                    # - orphan responseを再利用した情報漏洩を防止
-                    # - タイミング攻撃によるレスポンス横取りを防止
-                    self.stats["orphans_discarded"] += 1
-                    log_security("WARN", f"Orphan response を破棄: id={resp_id}")
-                    continue  # ← 保存しない
-
-                self.stats["responses_received"] += 1
-                if not fut.done():
-                    fut.set_result(data)
+            data = self._loads(frame)
+        except ValueError:
+            log_security("WARN", f"JSON以外を受信（stdout汚染の疑い）: {frame[:100]}")
+            return
 
+        try:
+            if isinstance(data, list):
+                for item in data:
+                    self._dispatch(item)
+            else:
+                self._dispatch(data)
         except Exception as e:
-            log_security("FATAL", f"readerスレッドがクラッシュ: {e}")
+            log_security("FATAL", f"受信メッセージの処理で例外: {e!r}")
+
+    def _on_close(self, error):
+        if error is not None and self._running:
+            log_security("FATAL", f"受信が異常終了: {error!r}")
+
+    def _on_oversize(self, error):
+        # 上限（max_frame）を超えた 1 行は捨てる（対応するリクエストはタイムアウトになる）
+        log_security("WARN", f"大きすぎるメッセージを破棄: {error}")
+
+    def send_request(self, method: str, params: dict, timeout: float = None) -> tuple[str, Future]:
+        """
+        request を投げ、Future を返す（待機は呼び出し側）。
+
+        タイムアウトはクライアントのタイマーが管理するので、
+        Future を待たない呼び出し側でも期限が来れば TimeoutError で失敗し、
+        stats["timeouts"] に数えられる。
+        """
+        return self._send_request(method, params, self._check_timeout(timeout))
 
-    def send_request(self, method: str, params: dict) -> tuple[str, Future]:
+    def _send_request(self, method: str, params: dict, timeout: float) -> tuple[str, Future]:
+        wait = self._acquire(1)
         request_id = self._issue_id()
-        fut = Future()
         with self._lock:
-            self._pending[request_id] = fut
+            fut = self._register(request_id, timeout)
 
         msg = {
             "jsonrpc": "2.0",
@@ -155,10 +342,20 @@ class SecureStdioMcpClient:
             "method": method,
             "params": params
         }
-        self._send(msg)
-        self.stats["requests_sent"] += 1
+        self._send_registered([request_id], msg, wait)
+        self.stats.inc("requests_sent")
         return request_id, fut
 
+    def _send_registered(self, request_ids: list, msg, wait: float):
+        """台帳に登録済みのリクエストを送る。送れなければ台帳から外して例外を投げ直す"""
+        try:
+            self._send(msg, wait)
+        except Exception as e:
+            if isinstance(e, OverloadedError):
+                self.stats.inc("overloaded")
+            self._unregister(request_ids, e)
+            raise
+
     def request(self, method: str, params: dict, timeout: float = None) -> dict:
         """
         【堅牢化ポイント3】タイムアウト値の検証
@@ -169,23 +366,67 @@ class SecureStdioMcpClient:
         これにより:
         - 極端に長いタイムアウトによるリソース占有（DoS）を抑制
         - 極端に短いタイムアウトによる意図しないorphan大量発生を抑制
+
+        期限切れはタイマーが処理する（台帳から外して TimeoutError を設定）。
         """
-        if timeout is None:
-            timeout = DEFAULT_TIMEOUT
-        elif timeout < MIN_TIMEOUT:
-            log_security("WARN", f"タイムアウトが短すぎます: {timeout}s < {MIN_TIMEOUT}s")
-        elif timeout > MAX_TIMEOUT:
-            log_security("WARN", f"タイムアウトが長すぎます: {timeout}s > {MAX_TIMEOUT}s")
+        timeout = self._check_timeout(timeout)
 
-        request_id, fut = self.send_request(method, params)
+        request_id, fut = self._send_request(method, params, timeout)
         try:
-            return fut.result(timeout=timeout)
+            return fut.result(timeout=timeout + TIMER_GRACE)
         except FutureTimeoutError:
-            self.stats["timeouts"] += 1
+            # 通常はタイマーが先に失敗させる。タイマーが遅れた場合の保険
+            self._expire(request_id)
             raise
-        finally:
-            with self._lock:
-                self._pending.pop(request_id, None)
+
+    def send_batch(self, calls: list, timeout: float = None) -> list:
+        """
+        複数の request を JSON-RPC バッチ（1 行の配列）として投げる。
+
+        calls: [(method, params), ...]
+        戻り値: [(request_id, Future), ...]（calls と同じ順序）
+        各リクエストには send_request と同じくタイムアウトが仕掛けられる。
+        """
+        return self._send_batch(calls, self._check_timeout(timeout))
+
+    def _send_batch(self, calls: list, timeout: float) -> list:
+        wait = self._acquire(len(calls))
+        ids = [self._issue_id() for _ in calls]
+        with self._lock:
+            entries = [(request_id, self._register(request_id, timeout)) for request_id in ids]
+
+        batch = [
+            {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": method,
+                "params": params
+            }
+            for request_id, (method, params) in zip(ids, calls)
+        ]
+        self._send_registered(ids, batch, wait)
+        self.stats.inc("requests_sent", len(entries))
+        return entries
+
+    def request_many(self, calls: list, timeout: float = None) -> list:
+        """
+        バッチで投げて、全レスポンスを calls と同じ順序のリストで返す。
+        timeout は各リクエストの期限（範囲チェックは request() と同じ）。
+        1 件でも期限切れになったら TimeoutError を投げる。
+        """
+        timeout = self._check_timeout(timeout)
+
+        entries = self._send_batch(calls, timeout)
+        deadline = time.monotonic() + timeout + TIMER_GRACE
+        results = []
+        for request_id, fut in entries:
+            try:
+                results.append(fut.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                for rid, _ in entries:
+                    self._expire(rid)
+                raise
+        return results
 
     def notify(self, method: str, params: dict):
         msg = {
@@ -193,8 +434,57 @@ class SecureStdioMcpClient:
             "method": method,
             "params": params
         }
-        self._send(msg)
+        self._send(msg, self.overload_wait)
 
     def get_stats(self) -> dict:
-        """統計情報を取得（監視・デバッグ用）"""
-        return dict(self.stats)
+        """
+        統計情報を取得（監視・デバッグ用）。
+        シャードを合計するだけなので、通信を止めずに何度呼んでもよい。
+        """
+        stats = self.stats.snapshot()
+        stats["latency"] = self.latency.summary()
+        return stats
+
+    def collect_metrics(self) -> list:
+        """
+        Prometheus 形式で公開するメトリクス（MetricsServer の collector）。
+        複数クライアントを 1 つの MetricsServer に登録できるよう server_pid ラベルを付ける
+        （stdio 以外のトランスポートでは transport ラベル）。
+        """
+        if self.process is not None:
+            labels = {"server_pid": str(self.process.pid)}
+        else:
+            labels = {"transport": self.transport.describe()}
+        stats = self.stats.snapshot()
+        sent = stats["requests_sent"]
+
+        in_flight = self.in_flight
+        queued = self._writer.queued if isinstance(self._writer, QueuedWriter) else 0
+
+        return [
+            MetricFamily("mcp_client_requests_sent_total", "counter",
+                         "Requests sent to the MCP server").add(sent, labels),
+            MetricFamily("mcp_client_responses_received_total", "counter",
+                         "Responses matched to a pending request").add(stats["responses_received"], labels),
+            MetricFamily("mcp_client_orphans_discarded_total", "counter",
+                         "Responses with no pending request (discarded)").add(stats["orphans_discarded"], labels),
+            MetricFamily("mcp_client_timeouts_total", "counter",
+                         "Requests that timed out").add(stats["timeouts"], labels),
+            MetricFamily("mcp_client_cancels_sent_total", "counter",
+                         "notifications/cancelled sent for timed-out requests").add(
+                             stats["cancels_sent"], labels),
+            MetricFamily("mcp_client_overloaded_total", "counter",
+                         "Requests rejected with OverloadedError").add(stats["overloaded"], labels),
+            MetricFamily("mcp_client_pending_requests", "gauge",
+                         "Requests currently waiting for a response").add(in_flight, labels),
+            MetricFamily("mcp_client_send_queue_depth", "gauge",
+                         "Messages queued but not yet written").add(queued, labels),
+            MetricFamily("mcp_client_orphan_ratio", "gauge",
+                         "Orphans discarded per request sent").add(
+                             stats["orphans_discarded"] / sent if sent else 0.0, labels),
+            MetricFamily("mcp_client_timeout_ratio", "gauge",
+                         "Timeouts per request sent").add(
+                             stats["timeouts"] / sent if sent else 0.0, labels),
+            histogram_family("mcp_client_request_duration_seconds",
+                             "Request round-trip time", [(labels, self.latency)]),
+        ]
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+サーバープロセスのプール（server_pool.py）
+
+StdioMcpClient(...) / SecureStdioMcpClient(...) は生成のたびに
+python demo_server.py を起動し、close() で止める。短命なクライアントを
+大量に作るテストでは、インタプリタの起動時間が実行時間の大半になる。
+
+ServerPool は initialize 済みの demo_server.py を size 個温めておき、
+transport として貸し出す（クライアントの transport= にそのまま渡せる）。
+
+    pool = ServerPool(sys.executable, SERVER_PATH, size=4)
+    with pool.client(SecureStdioMcpClient) as client:   # 返却は自動
+        client.request("ping", {})
+    client = StdioMcpClient(transport=pool.lease())     # close() でプールに返る
+    ...
+    pool.close()
+
+- 貸し出し時と返却時に ping で死活確認する（応答がなければ捨てて次を使う）
+- 貸し出し中に送ったリクエストの id を LeasedTransport が記録し、
+  まだレスポンスが返っていないものが残っていれば、返却されても再利用しない
+  （クライアント側でタイムアウトして台帳から外れていても、サーバーはまだ処理中かもしれない。
+  遅れて届くレスポンスが次の借り手の orphan にならないように）
+- 待機中に身に覚えのないメッセージが届いたサーバーも捨てる
+- 減った分はバックグラウンドで起動し直し、常に size 個を待機させる
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from secure_client import SecureStdioMcpClient
+from transport import StdioTransport
+
+SERVER_PATH = os.path.join(HERE, "demo_server.py")
+
+PING_TIMEOUT = 1.0   # 死活確認の待ち時間（秒）
+INIT_TIMEOUT = 10.0  # 起動直後の initialize の待ち時間（秒）
+
+INITIALIZE_PARAMS = {
+    "protocolVersion": "2025-11-25",
+    "capabilities": {},
+    "clientInfo": {"name": "server-pool", "version": "0.1.0"},
+}
+
+
+class _PooledServer:
+    """プールが管理する 1 プロセス（待機中の受信はここで受ける）"""
+
+    def __init__(self, transport: StdioTransport):
+        self.transport = transport
+        self.uses = 0
+        self.dirty = False  # 待機中に想定外のメッセージが届いた / 受信が終わった
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._pending = {}
+
+    def attach(self):
+        """受信の受け取り先をプールに戻す"""
+        self.transport.start(self._on_frame, self._on_close, self._on_oversize)
+
+    def call(self, method: str, params: dict, timeout: float) -> dict:
+        with self._lock:
+            self._next_id += 1
+            req_id = f"pool-{self._next_id}"
+            fut = self._pending[req_id] = Future()
+        try:
+            message = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params}
+            self.transport.send(json.dumps(message) + "\n")
+            return fut.result(timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(req_id, None)
+
+    def healthy(self, timeout: float) -> bool:
+        if self.dirty or self.transport.closed:
+            return False
+        try:
+            return "result" in self.call("ping", {}, timeout)
+        except (OSError, ValueError, FutureTimeoutError):
+            return False
+
+    def _on_frame(self, frame: bytes):
+        try:
+            req_id = json.loads(frame).get("id")
+        except (ValueError, AttributeError):
+            req_id = None
+        with self._lock:
+            fut = self._pending.pop(req_id, None) if isinstance(req_id, str) else None
+        if fut is None:
+            # 前の借り手宛てに遅れて届いたレスポンスなど
+            self.dirty = True
+            return
+        fut.set_result(json.loads(frame))
+
+    def _on_oversize(self, error):
+        self.dirty = True
+
+    def _on_close(self, error):
+        self.dirty = True
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            fut.set_exception(OSError("server closed"))
+
+
+def _message_ids(data, requests_only: bool) -> list:
+    """1 行以上の JSON（バッチを含む）から id を取り出す。requests_only なら method を持つものだけ"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    ids = []
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        for item in message if isinstance(message, list) else [message]:
+            if not isinstance(item, dict) or isinstance(item.get("id"), (type(None), list, dict)):
+                continue
+            if requests_only and "method" not in item:
+                continue
+            ids.append(item["id"])
+    return ids
+
+
+class LeasedTransport:
+    """
+    貸し出し中のトランスポート。
+    送受信は元の StdioTransport にそのまま渡し、close() ではプロセスを止めずにプールへ返す。
+
+    送ったリクエストの id とレスポンスの id を突き合わせ、レスポンスがまだ返っていない
+    リクエスト（outstanding）が残っていれば、close() でそのサーバーを捨てる。
+    クライアントの台帳（タイムアウトで外れる）ではなく、サーバーとのやり取りそのものを見るので、
+    StdioMcpClient(transport=pool.lease()) のように直接使っても後着のレスポンスが漏れない。
+    """
+
+    def __init__(self, pool: "ServerPool", server: _PooledServer):
+        self._pool = pool
+        self._server = server
+        transport = server.transport
+        self._transport = transport
+        self.name = transport.name
+        self.process = transport.process
+        self.flush = transport.flush
+        self.describe = transport.describe
+        self.closed = False
+        # False にして close() すると、死活確認なしで捨てる
+        self.reusable = True
+        self._lock = threading.Lock()
+        self._outstanding = set()
+        self._unknown = False  # 突き合わせられないフレームを受け取った（上限超えなど）
+
+    @property
+    def outstanding(self) -> int:
+        """レスポンスがまだ返っていないリクエスト数"""
+        with self._lock:
+            return len(self._outstanding)
+
+    def start(self, on_frame, on_close=None, on_oversize=None):
+        def frame(data: bytes):
+            ids = _message_ids(data, requests_only=False)
+            with self._lock:
+                self._outstanding.difference_update(ids)
+            on_frame(data)
+
+        def oversize(error):
+            self._unknown = True
+            if on_oversize is not None:
+                on_oversize(error)
+
+        self._transport.start(frame, on_close, oversize)
+
+    def send(self, data):
+        ids = _message_ids(data, requests_only=True)
+        if ids:
+            with self._lock:
+                self._outstanding.update(ids)
+        self._transport.send(data)
+
+    write = send
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        reusable = self.reusable and not self._unknown and self.outstanding == 0
+        self._pool.release(self._server, reusable)
+
+
+class ServerPool:
+    """initialize 済みの demo_server.py を貸し出すプール"""
+
+    def __init__(self, python_exe: str, server_script: str, server_args: list = None,
+                 size: int = 4, max_uses: int = None, ping_timeout: float = PING_TIMEOUT):
+        if size < 1:
+            raise ValueError("pool size must be >= 1")
+        self.argv = [python_exe, server_script, *(server_args or [])]
+        self.size = size
+        self.max_uses = max_uses  # この回数貸し出したら捨てる（None なら無制限）
+        self.ping_timeout = ping_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []        # 待機中の _PooledServer
+        self._starting = 0     # 起動中の数
+        self._leased = set()
+        self._closed = False
+        self.stats = {
+            "spawned": 0,
+            "leases": 0,
+            "warm_hits": 0,    # 待機中のサーバーをすぐに貸せた
+            "cold_starts": 0,  # 待機中がなく、その場で起動した
+            "discarded": 0,    # 死活確認の失敗・レスポンス未着ありの返却・max_uses 到達
+        }
+
+        self._filler = threading.Thread(target=self._fill_loop, daemon=True)
+        self._filler.start()
+
+    # ---------- 貸し出し / 返却 ----------
+
+    def lease(self) -> LeasedTransport:
+        """待機中のサーバーを 1 つ貸し出す（なければその場で起動する）"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                server = self._idle.pop() if self._idle else None
+                self._cond.notify_all()  # 補充スレッドを起こす
+            if server is None:
+                server = self._spawn()
+                cold = True
+            else:
+                cold = False
+                if not server.healthy(self.ping_timeout):
+                    self._discard(server)
+                    continue
+            break
+
+        server.uses += 1
+        with self._cond:
+            self._leased.add(server)
+            self.stats["leases"] += 1
+            self.stats["cold_starts" if cold else "warm_hits"] += 1
+        return LeasedTransport(self, server)
+
+    def release(self, server: _PooledServer, reusable: bool = True):
+        """返却されたサーバーを確認して待機に戻す（使えなければ捨てる）"""
+        server.attach()
+        with self._cond:
+            self._leased.discard(server)
+            closed = self._closed
+        worn_out = self.max_uses is not None and server.uses >= self.max_uses
+        if closed or not reusable or worn_out or not server.healthy(self.ping_timeout):
+            self._discard(server)
+            return
+        with self._cond:
+            self._idle.append(server)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def client(self, cls, **kwargs):
+        """
+        プールのサーバーにつないだクライアントを作り、抜けるときに返却する。
+        レスポンスが返っていないリクエストが残っていれば、そのサーバーは再利用しない
+        （LeasedTransport.close() を参照）。
+        """
+        transport = self.lease()
+        client = cls(transport=transport, **kwargs)
+        try:
+            yield client
+        finally:
+            transport.reusable = client.in_flight == 0
+            client.close()
+
+    def close(self):
+        """待機中・貸し出し中のサーバーをすべて止める"""
+        with self._cond:
+            self._closed = True
+            servers = self._idle + list(self._leased)
+            self._idle = []
+            self._leased.clear()
+            self._cond.notify_all()
+        for server in servers:
+            server.transport.close()
+        self._filler.join(timeout=INIT_TIMEOUT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 起動と補充 ----------
+
+    def _spawn(self) -> _PooledServer:
+        """起動して initialize まで済ませる"""
+        server = _PooledServer(StdioTransport.spawn(self.argv))
+        server.attach()
+        try:
+            server.call("initialize", INITIALIZE_PARAMS, INIT_TIMEOUT)
+            server.transport.send(json.dumps(
+                {"jsonrpc": "2.0", "method": "notifications/initialized", "params": {}}) + "\n")
+        except Exception:
+            server.transport.close()
+            raise
+        with self._cond:
+            self.stats["spawned"] += 1
+        return server
+
+    def _discard(self, server: _PooledServer):
+        server.transport.close()
+        with self._cond:
+            self.stats["discarded"] += 1
+            self._cond.notify_all()
+
+    def _fill_loop(self):
+        """待機中が size 個になるまで起動し続ける"""
+        while True:
+            with self._cond:
+                while not self._closed and len(self._idle) + self._starting >= self.size:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                self._starting += 1
+            try:
+                server = self._spawn()
+            except Exception as e:
+                print(f"[WARN] サーバーの起動に失敗: {e!r}", file=sys.stderr)
+                server = None
+                time.sleep(0.5)
+            with self._cond:
+                self._starting -= 1
+                if server is not None and not self._closed:
+                    self._idle.append(server)
+                    server = None
+                self._cond.notify_all()
+            if server is not None:
+                server.transport.close()
+
+    def wait_ready(self, timeout: float = INIT_TIMEOUT) -> bool:
+        """待機中が size 個そろうまで待つ"""
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._idle) >= self.size, timeout=timeout)
+
+
+# ============================================================
+# 計測（プールあり / なし）
+# ============================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="短命なクライアントを大量に作るときの起動時間を比べる")
+    parser.add_argument("--clients", type=int, default=100, help="作って捨てるクライアントの数")
+    parser.add_argument("--size", type=int, default=4, help="プールで待機させるサーバー数")
+    parser.add_argument("--server-args", default="", help="demo_server.py に渡す引数")
+    args = parser.parse_args(argv)
+
+    server_args = args.server_args.split()
+
+    def one(client):
+        client.request("tools/call", {"name": "add_numbers", "arguments": {"a": 1, "b": 2}}, timeout=5.0)
+
+    t0 = time.perf_counter()
+    for _ in range(args.clients):
+        client = SecureStdioMcpClient(sys.executable, SERVER_PATH, server_args=server_args)
+        try:
+            client.request("initialize", INITIALIZE_PARAMS, timeout=INIT_TIMEOUT)
+            one(client)
+        finally:
+            client.close()
+    cold = time.perf_counter() - t0
+
+    with ServerPool(sys.executable, SERVER_PATH, server_args, size=args.size) as pool:
+        pool.wait_ready()
+        t0 = time.perf_counter()
+        for _ in range(args.clients):
+            with pool.client(SecureStdioMcpClient) as client:
+                one(client)
+        pooled = time.perf_counter() - t0
+        stats = dict(pool.stats)
+
+    print(json.dumps({
+        "clients": args.clients,
+        "without_pool_s": round(cold, 3),
+        "with_pool_s": round(pooled, 3),
+        "speedup": round(cold / pooled, 1) if pooled > 0 else None,
+        "pool": stats,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
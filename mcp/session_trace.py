@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+送受信トレースの記録（session_trace.py）
+
+クライアントはカウンターと orphan_responses 以外の記録を残さないので、
+本番で起きた orphan の大量発生を後から手元で再現・解析できない。
+
+TraceWriter はクライアントの _send（送信）と _reader_loop（受信）から呼ばれ、
+送受信した 1 行をそのまま JSONL に追記する。
+
+    {"trace": 1, "start_ns": 123, "meta": {...}}                   ← 先頭行（ヘッダー）
+    {"t_ns": 1200, "dir": "send", "line": "{\"jsonrpc\": ...}"}
+    {"t_ns": 3400, "dir": "recv", "line": "{\"jsonrpc\": ...}"}
+
+- t_ns: 記録開始からの経過ナノ秒（time.monotonic_ns()）
+- line: 送受信した JSON の文字列そのもの（壊れた行や非 JSON 行もそのまま残る）
+
+record() は時刻と行を deque に積むだけで、JSON 化とファイル書き込みは
+バックグラウンドのスレッドがまとめて行う（送受信の経路をほとんど遅くしない）。
+再生は trace_replay.py を使う。
+"""
+
+import json
+import time
+import threading
+from collections import deque
+
+FLUSH_INTERVAL = 0.05  # バックグラウンドスレッドが書き出す間隔（秒）
+TRACE_VERSION = 1
+
+
+class TraceWriter:
+    """
+    送受信トレースを JSONL に追記するレコーダー。
+
+    tracer = TraceWriter("/tmp/session.trace.jsonl", meta={"server_args": [...]})
+    client = StdioMcpClient(..., tracer=tracer)
+    ...
+    client.close()
+    tracer.close()
+    """
+
+    def __init__(self, path: str, meta: dict = None, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.start_ns = time.monotonic_ns()
+        self.records = 0
+
+        self._queue = deque()  # (時刻, 方向, 行)。append / popleft はスレッド間で安全
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write(json.dumps({"trace": TRACE_VERSION, "start_ns": self.start_ns,
+                                     "meta": meta or {}}) + "\n")
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, direction: str, line):
+        """送受信した 1 行を記録する（direction は "send" / "recv"、line は str / bytes）"""
+        self._queue.append((time.monotonic_ns(), direction, line))
+
+    def _drain(self):
+        queue = self._queue
+        start = self.start_ns
+        chunks = []
+        while queue:
+            t_ns, direction, line = queue.popleft()
+            if not isinstance(line, str):
+                line = str(line, "utf-8", "replace")
+            chunks.append(json.dumps({"t_ns": t_ns - start, "dir": direction,
+                                      "line": line.rstrip("\n")}))
+        if chunks:
+            self.records += len(chunks)
+            self._file.write("\n".join(chunks) + "\n")
+            self._file.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+
+    def close(self):
+        """残りを書き出してファイルを閉じる"""
+        self._stop.set()
+        self._thread.join()
+        self._drain()
+        self._file.close()
+
+
+def read_trace(path: str) -> tuple:
+    """トレースを読み込み、(ヘッダー, [(t_ns, 方向, 行), ...]) を返す"""
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("trace") != TRACE_VERSION:
+            raise ValueError(f"unsupported trace format: {path}")
+        entries = []
+        for text in f:
+            if text.strip():
+                entry = json.loads(text)
+                entries.append((entry["t_ns"], entry["dir"], entry["line"]))
+    return header, entries
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+ハッシュドタイミングホイール（timer_wheel.py）
+
+fut.result(timeout=...) によるタイムアウトは、呼び出し側スレッドが
+待っている間しか発火しない。send_request だけ投げて待たない呼び出し側や、
+数万件の未完了リクエストを抱えるクライアントでは、
+「1 リクエスト = 1 ブロックしたスレッド」にせず、
+1 本のタイマースレッドでまとめて期限切れを処理したい。
+
+TimerWheel は時間を tick 単位のスロットに区切った輪（ホイール）で管理し、
+- schedule(): O(1) で登録
+- cancel():   O(1) で取り消し（レスポンスが先に届いた場合）
+- 期限切れ:   tick ごとに現在スロットだけを走査してコールバックを呼ぶ
+を実現する。精度は tick（デフォルト 10ms）単位。
+"""
+
+import sys
+import threading
+import time
+
+DEFAULT_TICK = 0.01   # 10ms 刻み
+DEFAULT_SLOTS = 512   # 512 × 10ms ≒ 5 秒で一周（それ以上先の期限は周回待ち）
+
+
+class Timer:
+    """schedule() が返すハンドル（cancel() に渡す）"""
+
+    __slots__ = ("deadline", "callback", "index")
+
+    def __init__(self, deadline: float, callback, index: int):
+        self.deadline = deadline
+        self.callback = callback
+        self.index = index
+
+
+class TimerWheel:
+    """
+    1 本のスレッドで多数のタイムアウトを管理するタイミングホイール。
+
+    コールバックはタイマースレッド上で呼ばれるので、短く保つこと。
+    """
+
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS):
+        self.tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._cond = threading.Condition()
+        self._count = 0
+        self._cursor = self._tick_index(time.monotonic())
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _tick_index(self, t: float) -> int:
+        return int(t / self.tick)
+
+    def schedule(self, delay: float, callback) -> Timer:
+        """delay 秒後に callback() を呼ぶ"""
+        deadline = time.monotonic() + delay
+        with self._cond:
+            # 処理済みの tick より前には置かない（次の tick で必ず走査される）
+            index = max(self._tick_index(deadline), self._cursor)
+            timer = Timer(deadline, callback, index)
+            self._slots[index % len(self._slots)].add(timer)
+            self._count += 1
+            if self._count == 1:
+                self._cond.notify()
+        return timer
+
+    def cancel(self, timer: Timer) -> bool:
+        """登録を取り消す。既に発火済み・取り消し済みなら False"""
+        if timer is None:
+            return False
+        with self._cond:
+            slot = self._slots[timer.index % len(self._slots)]
+            if timer not in slot:
+                return False
+            slot.discard(timer)
+            self._count -= 1
+            return True
+
+    def stop(self):
+        """タイマースレッドを止める（未発火のタイマーは破棄）"""
+        with self._cond:
+            self._running = False
+            for slot in self._slots:
+                slot.clear()
+            self._count = 0
+            self._cond.notify()
+
+    def _collect_expired(self, now: float) -> list:
+        expired = []
+        now_index = self._tick_index(now)
+        # 遅れて起きた場合も、ホイール 1 周分を超えて走査する必要はない
+        first = max(self._cursor, now_index - len(self._slots) + 1)
+        for index in range(first, now_index + 1):
+            slot = self._slots[index % len(self._slots)]
+            due = [t for t in slot if t.deadline <= now]
+            for t in due:
+                slot.discard(t)
+            expired.extend(due)
+        self._count -= len(expired)
+        # 現在の tick には期限がまだ来ていないタイマーが残り得るので、次回も走査する
+        self._cursor = now_index
+        return expired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._count == 0:
+                    self._cond.wait()
+                if not self._running:
+                    return
+
+            time.sleep(self.tick)
+
+            with self._cond:
+                if not self._running:
+                    return
+                expired = self._collect_expired(time.monotonic())
+
+            for timer in expired:
+                try:
+                    timer.callback()
+                except Exception as e:
+                    print(f"[WARN] タイマーコールバックで例外: {e!r}", file=sys.stderr)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+トレースの再生（trace_replay.py）
+
+session_trace.TraceWriter で記録したトレースから送信行だけを取り出し、
+記録時と同じ順序・同じ時間間隔で demo_server.py に送り直す。
+本番で記録した orphan の大量発生を手元で再現し、プロファイラーを当てるためのもの。
+
+- 送る行は記録したバイト列そのまま（キャンセル通知やバッチも含めて再現される）
+- --speed 2 なら 2 倍速、--speed 0 なら間隔を無視して最速で送る
+- 記録時と再生時で「レスポンスが返った id」を比較して表示する
+- --output を指定すると、再生時の送受信も同じ形式のトレースとして保存する
+
+実行例:
+  ./venv/bin/python mcp/trace_replay.py /tmp/session.trace.jsonl --server-args "--workers 8"
+  ./venv/bin/python -m cProfile -o /tmp/replay.prof mcp/trace_replay.py /tmp/session.trace.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from session_trace import TraceWriter, read_trace
+from metrics import LatencyHistogram
+
+SERVER_PATH = os.path.join(HERE, "demo_server.py")
+
+
+def _items(line: str):
+    """1 行のメッセージ（バッチなら要素）のリスト。JSON でなければ None"""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    return data if isinstance(data, list) else [data]
+
+
+def _ids(items: list) -> list:
+    return [item["id"] for item in items
+            if isinstance(item, dict) and item.get("id") is not None and not isinstance(item["id"], (list, dict))]
+
+
+def message_ids(line: str) -> list:
+    """1 行に含まれる id（バッチなら要素ごと）。JSON でない行や通知は空"""
+    items = _items(line)
+    return [] if items is None else _ids(items)
+
+
+def replay(entries: list, server_args: list, speed: float = 1.0, drain: float = 1.0,
+           tracer: TraceWriter = None) -> dict:
+    """送信行を記録どおりのタイミングでサーバーに送り、結果の要約を返す"""
+    sends = [(t_ns, line) for t_ns, direction, line in entries if direction == "send"]
+    recorded_ids = set()
+    for _, direction, line in entries:
+        if direction == "recv":
+            recorded_ids.update(message_ids(line))
+
+    process = subprocess.Popen(
+        [sys.executable, SERVER_PATH, *server_args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    sent_at = {}     # id -> 送信時刻（ns）
+    received = {}    # id -> 最初のレスポンスの受信時刻（ns）
+    counts = {"recv_lines": 0, "duplicates": 0, "unparsable": 0, "notifications": 0, "null_id": 0}
+
+    def reader():
+        for raw in process.stdout:
+            now = time.monotonic_ns()
+            if tracer is not None:
+                tracer.record("recv", raw)
+            counts["recv_lines"] += 1
+            items = _items(str(raw, "utf-8", "replace"))
+            if items is None:
+                counts["unparsable"] += 1
+                continue
+            ids = _ids(items)
+            if not ids:
+                # id のない正しいメッセージ。サーバーからの通知か、id: null のエラー（-32600 等）
+                if all(isinstance(item, dict) and "method" in item for item in items):
+                    counts["notifications"] += 1
+                else:
+                    counts["null_id"] += 1
+            for request_id in ids:
+                if request_id in received:
+                    counts["duplicates"] += 1
+                else:
+                    received[request_id] = now
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    reader_thread.start()
+
+    # 送信時に解析しないよう、id と bytes は先に用意しておく
+    prepared = [(t_ns, (line + "\n").encode("utf-8"), message_ids(line)) for t_ns, line in sends]
+    lag = LatencyHistogram()
+    start = time.monotonic_ns()
+    for t_ns, data, ids in prepared:
+        if speed > 0:
+            delay = (start + t_ns / speed - time.monotonic_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+        now = time.monotonic_ns()
+        if speed > 0:
+            lag.record(max(0, now - start - t_ns / speed) / 1e9)
+        if tracer is not None:
+            tracer.record("send", data)
+        process.stdin.write(data)
+        process.stdin.flush()
+        for request_id in ids:
+            sent_at[request_id] = now
+
+    time.sleep(drain)
+    process.stdin.close()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    reader_thread.join(timeout=5)
+
+    latency = LatencyHistogram()
+    for request_id, t in received.items():
+        if request_id in sent_at:
+            latency.record((t - sent_at[request_id]) / 1e9)
+
+    replayed_ids = set(received)
+    lag_summary = lag.summary()
+    return {
+        "sent_lines": len(prepared),
+        "requests": len(sent_at),
+        "responses": len(received),
+        "recv_lines": counts["recv_lines"],
+        "duplicate_responses": counts["duplicates"],
+        "notification_lines": counts["notifications"],
+        "null_id_lines": counts["null_id"],
+        "unparsable_lines": counts["unparsable"],
+        "send_lag_ms": {"p99": lag_summary["p99_ms"], "max": lag_summary["max_ms"]},
+        "latency_ms": {key[:-3]: value for key, value in latency.summary().items() if key.endswith("_ms")},
+        # 記録時と再生時の違い（タイミング依存の挙動が再現できたかの目安）
+        "answered_only_in_recording": len((recorded_ids - replayed_ids) & set(sent_at)),
+        "answered_only_in_replay": len(replayed_ids - recorded_ids),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="送受信トレースを demo_server.py に再生する")
+    parser.add_argument("trace", help="session_trace.TraceWriter で記録したトレース（JSONL）")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="再生速度の倍率（0 = 間隔を無視して最速で送る）")
+    parser.add_argument("--server-args", default=None,
+                        help="demo_server.py に渡す引数（省略時はトレースの meta.server_args）")
+    parser.add_argument("--drain", type=float, default=1.0,
+                        help="送信後にレスポンスを待つ時間（秒）")
+    parser.add_argument("--output", default=None, help="再生時の送受信をトレースとして保存するパス")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    header, entries = read_trace(args.trace)
+    if args.server_args is not None:
+        server_args = args.server_args.split()
+    else:
+        server_args = list(header.get("meta", {}).get("server_args", []))
+
+    tracer = None
+    if args.output:
+        tracer = TraceWriter(args.output, meta={"server_args": server_args, "replay_of": args.trace})
+    try:
+        result = replay(entries, server_args, speed=args.speed, drain=args.drain, tracer=tracer)
+    finally:
+        if tracer is not None:
+            tracer.close()
+
+    print(json.dumps(dict(result, trace=args.trace, server_args=server_args),
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
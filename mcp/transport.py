@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+トランスポート層（transport.py）
+
+stdio クライアント（StdioMcpClient / SecureStdioMcpClient）と TCP の経路
+（vulnerable_server.py / tcp_client.py）は、それぞれ改行区切りのフレーミングを
+自前で実装していた。ここでは「改行区切りの JSON を運ぶ双方向の通り道」を
+共通のインターフェースにまとめる。
+
+    transport.start(on_frame, on_close=None, on_oversize=None)                # 受信スレッドを起動
+    transport.run(on_frame, on_close=None, on_oversize=None, on_idle=None)  # 呼び出したスレッドで受信ループを回す
+    transport.send(data)                       # 改行で終わる 1 つ以上のフレームを送る
+    transport.close()
+
+on_frame には改行を含まない 1 フレーム（bytes）が渡される。
+1 フレームが max_frame を超えたとき、on_oversize があればそのフレームだけを捨てて
+on_oversize(FrameTooLarge) を呼び、受信を続ける。なければ FrameTooLarge で受信を終える。
+max_frame のデフォルトは、ソケットでは MAX_FRAME_SIZE、
+stdio（自分で起動した子プロセスとのパイプ）では大きめの STDIO_MAX_FRAME_SIZE。
+write() / flush() も持つので、CoalescingWriter でそのまま包める。
+
+実装:
+- StdioTransport:  子プロセスの stdin / stdout（StdioTransport.spawn(argv)）
+- StreamTransport: 任意のバイナリストリームの組（サーバー側の sys.stdin / sys.stdout）
+- SocketTransport: 接続済みソケット（connect_tcp / connect_unix / pipe_pair）
+
+pipe_pair() は socketpair によるプロセス内の通り道で、
+サーバーを同じプロセスのスレッドで動かしてトランスポートのコストだけを比べるときに使う。
+"""
+
+import socket
+import subprocess
+import threading
+
+RECV_SIZE = 64 * 1024         # 1 回の受信で読む最大バイト数
+MAX_FRAME_SIZE = 1024 * 1024  # 1 フレーム（1 行）の上限。超えたら FrameTooLarge
+STDIO_MAX_FRAME_SIZE = 64 * 1024 * 1024  # stdio の上限（大きなバッチの送受信を妨げない）
+
+
+class FrameTooLarge(ValueError):
+    """1 フレームが上限を超えた"""
+
+
+class LineFramer:
+    """
+    改行区切りの受信バッファ。
+
+    str の連結（buffer += ...）と split を繰り返すと、パイプライン送信された
+    大量のリクエストや大きなメッセージで処理量が二乗に増える。
+    ここでは bytearray に recv_into で直接受信し、
+    - 改行の探索は前回探索した位置から再開する（同じバイトを何度も見ない）
+    - 完成したフレームだけを 1 回コピーして取り出す
+    - 未完成の末尾は、バッファが一杯になったときだけ先頭へ詰める
+    ことで、受信量に対して線形の処理量に抑える。
+
+    max_frame を超えたフレームは、on_oversize がなければ FrameTooLarge を投げる。
+    on_oversize があれば on_oversize(FrameTooLarge) を呼び、
+    そのフレームの残りを次の改行まで読み捨てて続ける。
+    """
+
+    def __init__(self, max_frame: int = MAX_FRAME_SIZE, recv_size: int = RECV_SIZE,
+                 on_oversize=None):
+        self.max_frame = max_frame
+        self.on_oversize = on_oversize
+        self._recv_size = recv_size
+        self._buf = bytearray(recv_size)
+        self._start = 0  # 未処理データの先頭
+        self._scan = 0   # 改行をまだ探していない位置
+        self._end = 0    # 受信済みデータの末尾
+        self._skipping = False  # 上限を超えたフレームの残りを読み捨て中
+
+    def fill(self, readinto) -> int:
+        """readinto(バッファ) で読み込んで追記する（0 なら相手が切断）"""
+        if self._end == len(self._buf):
+            self._make_room()
+        with memoryview(self._buf) as view, view[self._end:] as free:
+            n = readinto(free) or 0
+        self._end += n
+        return n
+
+    def recv_from(self, sock: socket.socket) -> int:
+        """ソケットから受信してバッファに追記する（0 なら相手が切断）"""
+        return self.fill(sock.recv_into)
+
+    def pop_frames(self) -> list:
+        """完成したフレーム（改行を含まない bytes）をすべて取り出す"""
+        frames = []
+        while True:
+            idx = self._buf.find(b"\n", self._scan, self._end)
+            if idx < 0:
+                break
+            if self._skipping:
+                # 読み捨て中のフレームがここで終わる
+                self._skipping = False
+            elif idx - self._start > self.max_frame:
+                self._oversize()
+            else:
+                with memoryview(self._buf) as view:
+                    frames.append(view[self._start:idx].tobytes())
+            self._start = self._scan = idx + 1
+
+        self._scan = self._end
+        if self._start == self._end or self._skipping:
+            # 全部処理済み（または読み捨て中）なら位置を巻き戻すだけ（コピー不要）
+            self._reset()
+        elif self._end - self._start > self.max_frame:
+            self._oversize()
+            self._skipping = True
+            self._reset()
+        return frames
+
+    def _oversize(self):
+        error = FrameTooLarge(f"frame exceeds {self.max_frame} bytes")
+        if self.on_oversize is None:
+            raise error
+        self.on_oversize(error)
+
+    def _reset(self):
+        self._start = self._scan = self._end = 0
+        if len(self._buf) > 4 * self._recv_size:
+            # 大きなフレームのために広げたバッファは手放す
+            self._buf = bytearray(self._recv_size)
+
+    def pop_rest(self) -> bytes:
+        """改行なしで残っている末尾を取り出す（EOF のとき用）"""
+        if self._skipping:
+            self._skipping = False
+            self._reset()
+            return b""
+        with memoryview(self._buf) as view:
+            rest = view[self._start:self._end].tobytes()
+        self._reset()
+        return rest
+
+    def _make_room(self):
+        pending = self._end - self._start
+        if self._start > 0:
+            # 未完成の末尾だけを先頭へ詰める
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._scan -= self._start
+            self._start = 0
+            self._end = pending
+        if self._end == len(self._buf):
+            # 1 フレームがバッファより大きい場合だけ拡張する（上限は max_frame）
+            self._buf.extend(bytes(min(len(self._buf), self.max_frame + 1)))
+
+
+class Transport:
+    """
+    トランスポートの共通部分。
+
+    サブクラスは _readinto（0 で EOF）/ _write / _close_io を実装する。
+    受信ループは LineFramer で改行ごとに区切り、空行は読み飛ばす。
+    EOF の時点で改行なしの末尾が残っていれば、それも 1 フレームとして渡す。
+    """
+
+    name = "transport"
+
+    def __init__(self, max_frame: int = MAX_FRAME_SIZE):
+        self.max_frame = max_frame
+        self.closed = False
+        self._send_lock = threading.Lock()  # 複数スレッドの送信が 1 フレームの途中で混ざらないように
+        self._reader = None
+        # 受信ループが呼ぶ先（start() で差し替えられる）
+        self._on_frame = None
+        self._on_close = None
+        self._on_oversize = None
+        self._on_idle = None
+
+    # ---------- 受信 ----------
+
+    def run(self, on_frame, on_close=None, on_oversize=None, on_idle=None):
+        """
+        呼び出したスレッドで受信ループを回す（EOF / エラー / close() まで戻らない）。
+        終了時に on_close(例外 または None) を呼ぶ。on_frame の中の例外は on_frame 側で処理すること。
+        on_oversize を渡すと、上限を超えたフレームは捨てて受信を続ける。
+        on_idle を渡すと、1 回の受信で届いたフレームをすべて on_frame に渡し終えるたびに呼ぶ
+        （受信済みで未処理のフレームがない = 次の受信は相手が送るまで待つ）。
+        """
+        self._on_frame, self._on_close, self._on_oversize = on_frame, on_close, on_oversize
+        self._on_idle = on_idle
+        self._loop()
+
+    def _oversize(self, error: FrameTooLarge):
+        if self._on_oversize is None:
+            raise error
+        self._on_oversize(error)
+
+    def _loop(self):
+        framer = LineFramer(self.max_frame, on_oversize=self._oversize)
+        error = None
+        try:
+            while framer.fill(self._readinto) > 0:
+                for frame in framer.pop_frames():
+                    if frame.strip():
+                        self._on_frame(frame)
+                if self._on_idle is not None:
+                    self._on_idle()
+            rest = framer.pop_rest()
+            if rest.strip():
+                self._on_frame(rest)
+        except FrameTooLarge as e:
+            error = e
+        except (OSError, ValueError) as e:
+            # close() でストリームが閉じられた場合は正常終了として扱う
+            if not self.closed:
+                error = e
+        finally:
+            if self._on_close is not None:
+                self._on_close(error)
+
+    def start(self, on_frame, on_close=None, on_oversize=None):
+        """
+        受信ループをデーモンスレッドで起動する。
+        起動済みなら受け取り先だけを差し替える（server_pool.py が貸し出し先を切り替えるのに使う）。
+        """
+        self._on_frame, self._on_close, self._on_oversize = on_frame, on_close, on_oversize
+        if self._reader is None:
+            self._reader = threading.Thread(target=self._loop, daemon=True)
+            self._reader.start()
+
+    # ---------- 送信 ----------
+
+    def send(self, data):
+        """改行で終わる 1 つ以上のフレームを送る（str は UTF-8 にする）"""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._send_lock:
+            self._write(data)
+
+    # CoalescingWriter から使えるようにストリームと同じ名前も持つ
+    write = send
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._close_io()
+        reader = self._reader
+        if reader is not None and reader is not threading.current_thread():
+            reader.join(timeout=5)
+
+    def describe(self) -> str:
+        """ログ・メトリクス用の短い説明"""
+        return self.name
+
+    def _readinto(self, buffer) -> int:
+        raise NotImplementedError
+
+    def _write(self, data: bytes):
+        raise NotImplementedError
+
+    def _close_io(self):
+        raise NotImplementedError
+
+
+class StreamTransport(Transport):
+    """読み込み用・書き込み用のバイナリストリームの組"""
+
+    name = "stream"
+
+    def __init__(self, rfile, wfile, max_frame: int = STDIO_MAX_FRAME_SIZE):
+        super().__init__(max_frame)
+        self.rfile = rfile
+        self.wfile = wfile
+        # バッファ付きストリームの readinto はバッファが埋まるまで待つことがあるので、
+        # 「今読めるだけ」読む readinto1 を優先する
+        self._readinto = getattr(rfile, "readinto1", rfile.readinto)
+
+    def _write(self, data: bytes):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _close_io(self):
+        try:
+            self.wfile.close()
+        except OSError:
+            pass
+
+
+class StdioTransport(StreamTransport):
+    """子プロセスとして起動したサーバーの stdin / stdout"""
+
+    name = "stdio"
+
+    def __init__(self, process: subprocess.Popen, max_frame: int = STDIO_MAX_FRAME_SIZE):
+        super().__init__(process.stdout, process.stdin, max_frame)
+        self.process = process
+
+    @classmethod
+    def spawn(cls, argv: list, max_frame: int = STDIO_MAX_FRAME_SIZE) -> "StdioTransport":
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,  # サーバーstderrは捨てる（クライアント出力と混ざらない）
+        )
+        return cls(process, max_frame)
+
+    def _close_io(self):
+        # stdin を閉じてから止める（実行中のレスポンスを待つ必要はない）
+        # ただし書き込みが詰まっている（サーバーが stdin を読んでいない）と
+        # stdin の close もその書き込みを待たされるので、先に止める
+        if self._send_lock.locked():
+            self._terminate()
+        super()._close_io()
+        self._terminate()
+
+    def _terminate(self):
+        try:
+            if self.process.poll() is None:
+                self.process.terminate()
+                self.process.wait(timeout=3)
+        except Exception:
+            pass
+
+    def describe(self) -> str:
+        return f"stdio:pid={self.process.pid}"
+
+
+class SocketTransport(Transport):
+    """接続済みのソケット（TCP / Unix ドメイン / socketpair）"""
+
+    name = "socket"
+
+    def __init__(self, sock: socket.socket, name: str = None, max_frame: int = MAX_FRAME_SIZE):
+        super().__init__(max_frame)
+        self.sock = sock
+        if name is not None:
+            self.name = name
+        self._readinto = sock.recv_into
+
+    def _write(self, data: bytes):
+        self.sock.sendall(data)
+
+    def _close_io(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def describe(self) -> str:
+        try:
+            peer = self.sock.getpeername()
+        except OSError:
+            peer = None
+        return f"{self.name}:{peer}" if peer else self.name
+
+
+def connect_tcp(host: str, port: int, timeout: float = 5.0,
+                max_frame: int = MAX_FRAME_SIZE) -> SocketTransport:
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.settimeout(None)
+    # 小さなメッセージを Nagle で溜めない
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return SocketTransport(sock, "tcp", max_frame)
+
+
+def connect_unix(path: str, timeout: float = 5.0,
+                 max_frame: int = MAX_FRAME_SIZE) -> SocketTransport:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return SocketTransport(sock, "unix", max_frame)
+
+
+def pipe_pair(max_frame: int = MAX_FRAME_SIZE) -> tuple:
+    """プロセス内でつながった (クライアント側, サーバー側) の組"""
+    a, b = socket.socketpair()
+    return SocketTransport(a, "pipe", max_frame), SocketTransport(b, "pipe", max_frame)
+
+
+def open_transport(spec: str, argv: list = None, max_frame: int = None) -> Transport:
+    """
+    文字列の指定からクライアント側のトランスポートを作る。
+
+    - "stdio"           : argv のサーバーを子プロセスとして起動
+    - "tcp:HOST:PORT"   : TCP で接続
+    - "unix:PATH"       : Unix ドメインソケットで接続
+
+    max_frame を省略すると、それぞれのトランスポートのデフォルトの上限を使う。
+    """
+    kind, _, rest = spec.partition(":")
+    kwargs = {} if max_frame is None else {"max_frame": max_frame}
+    if kind == "stdio":
+        if not argv:
+            raise ValueError("stdio transport needs a server command")
+        return StdioTransport.spawn(argv, **kwargs)
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return connect_tcp(host or "127.0.0.1", int(port), **kwargs)
+    if kind == "unix":
+        return connect_unix(rest, **kwargs)
+    raise ValueError(f"unknown transport: {spec!r}")